@@ -0,0 +1,119 @@
+"""Allocation and time benchmarks for the /vision ingestion path in main.py.
+
+Compares the previous upstream payload serialization (a dict of base64
+strings, serialized by httpx) against main._chat_body, and a full-resolution
+frame decode + detection against the reduced decode of decode_max_width.
+Peak traced allocation per call comes from tracemalloc; both payloads must
+parse to the same JSON.
+
+    python backend/bench/ingest_bench.py --faces 4 --width 1920 --height 1080 --output ingest.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+# Keep the import from reading or writing a real persisted config.
+os.environ.setdefault("EMOTION_CONFIG_PATH", os.devnull)
+
+import main  # noqa: E402
+from vision_bench import synthetic_frames  # noqa: E402
+
+
+def baseline_body(images: list[bytes]) -> bytes:
+    # The previous _chat_payload/_image_part, then httpx's json= encoding.
+    parts = []
+    for image in images:
+        image_b64 = base64.b64encode(image).decode("ascii")
+        parts.append({"type": "image_url", "image_url": {"url": f"data:image/{main._image_format(image)};base64,{image_b64}"}})
+    payload = {
+        "model": "mock",
+        "temperature": 0.2,
+        "max_tokens": 220,
+        "messages": [
+            {"role": "system", "content": main.BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": [{"type": "text", "text": "Faces: 0..n"}, *parts]},
+        ],
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def current_body(images: list[bytes]) -> bytes:
+    return main._chat_body("mock", main.BATCH_SYSTEM_PROMPT, "Faces: 0..n", images, 220)
+
+
+def _measure(fn, number: int, repeat: int) -> tuple[float, float]:
+    """Best microseconds per call and peak traced KiB of one call."""
+    best = min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak / 1024
+
+
+def run(args: argparse.Namespace) -> dict:
+    frame = synthetic_frames(args.faces, args.width, args.height, 1, args.seed)[0]
+    crops = main._detect_faces_in_frame(frame).crops
+    if json.loads(baseline_body(crops)) != json.loads(current_body(crops)):
+        raise AssertionError("serialized payloads differ")
+    reduced = main.DetectorParams(decode_max_width=args.decode_max_width)
+    cases = {
+        "payload": (lambda: baseline_body(crops), lambda: current_body(crops)),
+        "decode_detect": (
+            lambda: main._detect_faces_in_frame(frame),
+            lambda: main._detect_faces_in_frame(frame, reduced),
+        ),
+    }
+    results = []
+    for name, (baseline, current) in cases.items():
+        baseline_us, baseline_kb = _measure(baseline, args.number, args.repeat)
+        current_us, current_kb = _measure(current, args.number, args.repeat)
+        results.append(
+            {
+                "case": name,
+                "baseline_us": round(baseline_us, 1),
+                "current_us": round(current_us, 1),
+                "baseline_peak_kb": round(baseline_kb, 1),
+                "current_peak_kb": round(current_kb, 1),
+            }
+        )
+    return {
+        "faces": len(crops),
+        "frame_bytes": len(frame),
+        "width": args.width,
+        "height": args.height,
+        "decode_max_width": args.decode_max_width,
+        "cases": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--faces", type=int, default=4)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--decode-max-width", type=int, default=960)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--number", type=int, default=20, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=3, help="timings per case; the best is kept")
+    parser.add_argument("--output", default="", help="write JSON results here")
+    args = parser.parse_args()
+    report = run(args)
+    print(f"{report['faces']} faces, {report['frame_bytes'] / 1024:.0f} KB frame")
+    print(f"{'case':<16}{'baseline us':>13}{'current us':>12}{'baseline KB':>13}{'current KB':>12}")
+    for item in report["cases"]:
+        print(
+            f"{item['case']:<16}{item['baseline_us']:>13.1f}{item['current_us']:>12.1f}"
+            f"{item['baseline_peak_kb']:>13.1f}{item['current_peak_kb']:>12.1f}"
+        )
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
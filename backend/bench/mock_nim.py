@@ -0,0 +1,193 @@
+"""Mock OpenAI-compatible /v1/chat/completions server for benchmarking /vision.
+
+Latency, error rate and malformed-JSON rate are injectable, either from the
+command line or at runtime through POST /mock/settings. GET /mock/stats
+returns call counters; POST /mock/reset clears them.
+
+    python backend/bench/mock_nim.py --port 18080 --latency-ms 150 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+EMOTIONS = ("neutral", "happy", "joy", "excited", "smile", "sad", "angry", "fear", "disgust", "frustrated")
+
+
+class MockSettings(BaseModel):
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # Extra latency per image of a multi-image request.
+    per_image_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    malformed_rate: float = 0.0
+    # Reject multi-image requests like a single-image deployment does.
+    reject_batches: bool = False
+    seed: int | None = None
+
+
+@dataclass
+class MockStats:
+    calls: int = 0
+    images: int = 0
+    batch_calls: int = 0
+    errors: int = 0
+    malformed: int = 0
+    traced_calls: int = 0
+    # Request body bytes, base64 images included.
+    request_bytes: int = 0
+    busy_seconds: float = 0.0
+
+
+class MockNim:
+    def __init__(self, settings: MockSettings | None = None) -> None:
+        self.settings = settings or MockSettings()
+        self.stats = MockStats()
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+
+    def configure(self, settings: MockSettings) -> None:
+        self.settings = settings
+        self._random = random.Random(settings.seed)
+
+    def reset(self) -> MockStats:
+        with self._lock:
+            stats, self.stats = self.stats, MockStats()
+        return stats
+
+    def _delay(self, images: int) -> float:
+        settings = self.settings
+        jitter = self._random.uniform(-settings.jitter_ms, settings.jitter_ms) if settings.jitter_ms else 0.0
+        return max(0.0, settings.latency_ms + jitter + settings.per_image_ms * max(0, images - 1)) / 1000
+
+    def _answer(self, images: int) -> str:
+        if images > 1:
+            faces = [{"index": idx, "emotion": self._random.choice(EMOTIONS)} for idx in range(images)]
+            return json.dumps({"faces": faces})
+        emotion = self._random.choice(EMOTIONS)
+        return json.dumps({"emotion_counts": {emotion: 1}, "dominant_emotion": emotion})
+
+    async def complete(self, body: dict, traced: bool, size: int = 0) -> JSONResponse:
+        started = time.perf_counter()
+        images = sum(
+            1
+            for message in body.get("messages", [])
+            if isinstance(message.get("content"), list)
+            for part in message["content"]
+            if part.get("type") == "image_url"
+        )
+        settings = self.settings
+        with self._lock:
+            self.stats.calls += 1
+            self.stats.images += images
+            self.stats.batch_calls += images > 1
+            self.stats.traced_calls += traced
+            self.stats.request_bytes += size
+        await asyncio.sleep(self._delay(images))
+
+        roll = self._random.random()
+        if images > 1 and settings.reject_batches:
+            status, content = 400, {"error": "only one image per request is supported"}
+        elif roll < settings.error_rate:
+            status, content = settings.error_status, {"error": "injected upstream error"}
+        else:
+            status = 200
+            text = self._answer(images)
+            if roll < settings.error_rate + settings.malformed_rate:
+                # Truncated JSON wrapped in prose, like a model cut off by max_tokens.
+                text = f"Sure! Here is the result: {text[: len(text) // 2]}"
+                with self._lock:
+                    self.stats.malformed += 1
+            content = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "model": body.get("model") or "mock",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            }
+        with self._lock:
+            self.stats.errors += status != 200
+            self.stats.busy_seconds += time.perf_counter() - started
+        return JSONResponse(content, status_code=status)
+
+
+def create_app(mock: MockNim) -> FastAPI:
+    app = FastAPI(title="Mock NIM")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        raw = await request.body()
+        return await mock.complete(json.loads(raw), "traceparent" in request.headers, len(raw))
+
+    @app.get("/mock/stats")
+    async def mock_stats():
+        return asdict(mock.stats)
+
+    @app.post("/mock/reset")
+    async def mock_reset():
+        return asdict(mock.reset())
+
+    @app.post("/mock/settings")
+    async def mock_settings(payload: MockSettings):
+        mock.configure(payload)
+        return payload
+
+    return app
+
+
+class MockServer:
+    """Runs the mock in a background thread; used by vision_bench.py."""
+
+    def __init__(self, mock: MockNim, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.mock = mock
+        config = uvicorn.Config(create_app(mock), host=host, port=port, log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> "MockServer":
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("mock NIM server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    for name, field in MockSettings.model_fields.items():
+        flag = "--" + name.replace("_", "-")
+        if field.annotation is bool:
+            parser.add_argument(flag, action="store_true")
+        elif name == "seed":
+            parser.add_argument(flag, type=int, default=None)
+        else:
+            parser.add_argument(flag, type=field.annotation, default=field.default)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    settings = MockSettings(**{name: getattr(args, name) for name in MockSettings.model_fields})
+    uvicorn.run(create_app(MockNim(settings)), host=args.host, port=args.port, log_level="warning")
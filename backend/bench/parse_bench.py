@@ -0,0 +1,187 @@
+"""Microbenchmarks for the model-answer parsing helpers in main.py.
+
+Times the current parsers against the previous implementations (kept below
+as the baseline) on typical answers: the one-word format requested by
+backend/data/nim-payload.json, prose, strict/fenced/wrapped counts JSON,
+batch arrays and truncated JSON. Both must agree on every sample.
+
+    python backend/bench/parse_bench.py --number 20000 --output parse.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+from collections import Counter
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+# Keep the import from reading or writing a real persisted config.
+os.environ.setdefault("EMOTION_CONFIG_PATH", os.devnull)
+
+import main  # noqa: E402
+
+
+def _baseline_detail_from_chat(data: dict) -> tuple[str, str]:
+    choices = data.get("choices", [])
+    if not choices:
+        return "neutral", ""
+    content = choices[0].get("message", {}).get("content", "")
+    if isinstance(content, list):
+        content = " ".join(str(item["text"]) for item in content if isinstance(item, dict) and "text" in item)
+    text = str(content)
+    if text.strip().startswith(("{", "[", "```")):
+        # Added alongside main: JSON that failed to parse is not keyword-scanned.
+        return "neutral", text
+    token = re.sub(r"[^a-z]", "", text.strip().lower())
+    if token:
+        normalized = main._normalize_emotion_detail(token)
+        # Originally `normalized in DETAILED_EMOTIONS`, which also accepted every unknown
+        # text as neutral and skipped the keyword scan; fixed alongside main.
+        if normalized != "neutral" or token == "neutral":
+            return normalized, text
+    text_l = text.lower()
+    # The original iterated the DETAILED_EMOTIONS set, whose order (and so tie-breaking)
+    # varied per process; keyword order keeps the comparison deterministic.
+    scores = {k: 0 for k in main.EMOTION_KEYWORDS}
+    for emotion, words in main.EMOTION_KEYWORDS.items():
+        for word in words:
+            if re.search(rf"\b{re.escape(word)}\b", text_l):
+                scores[emotion] += 1
+    non_neutral = {k: v for k, v in scores.items() if k != "neutral"}
+    best_non_neutral = max(non_neutral, key=non_neutral.get)
+    if non_neutral[best_non_neutral] > 0:
+        return best_non_neutral, text
+    if scores["neutral"] > 0:
+        return "neutral", text
+    match = re.search(
+        r"\b(happy|joy|excited|smile|sad|angry|fear|disgust|frustrated|neutral|positive|negative)\b",
+        text,
+        re.I,
+    )
+    if not match:
+        return "neutral", text
+    return main._normalize_emotion_detail(match.group(1)), text
+
+
+def _baseline_json_payload(text: str) -> dict | list | None:
+    cleaned = text.replace("```json", "").replace("```", "").strip()
+    starts = [idx for idx in (cleaned.find("{"), cleaned.find("[")) if idx != -1]
+    if not starts:
+        return None
+    start = min(starts)
+    open_ch = cleaned[start]
+    close_ch = "}" if open_ch == "{" else "]"
+    depth = 0
+    end = -1
+    for idx, ch in enumerate(cleaned[start:], start=start):
+        if ch == open_ch:
+            depth += 1
+        elif ch == close_ch:
+            depth -= 1
+            if depth == 0:
+                end = idx
+                break
+    if end == -1 or end <= start:
+        return None
+    try:
+        payload = json.loads(cleaned[start : end + 1])
+    except Exception:
+        return None
+    return payload if isinstance(payload, (dict, list)) else None
+
+
+def _counts(payload: dict | list | None) -> dict[str, int]:
+    # Same post-processing as main._extract_counts_from_text.
+    if payload is None:
+        return {}
+    counts = payload.get("emotion_counts") if isinstance(payload, dict) else None
+    if not isinstance(counts, dict):
+        return dict(Counter(main._face_emotions_from_payload(payload)))
+    normalized: dict[str, int] = {}
+    for k, v in counts.items():
+        try:
+            n = int(v)
+        except Exception:
+            continue
+        if n > 0:
+            emotion = main._normalize_emotion_detail(str(k))
+            normalized[emotion] = normalized.get(emotion, 0) + n
+    return normalized
+
+
+def baseline_parse(data: dict) -> tuple[str, dict[str, int]]:
+    detail, text = _baseline_detail_from_chat(data)
+    counts = _counts(_baseline_json_payload(text))
+    return (main._dominant_from_counts(counts) if counts else detail), counts
+
+
+def current_parse(data: dict) -> tuple[str, dict[str, int]]:
+    # Mirrors the chat branch of main._request_face_sentiment.
+    text = main._chat_message_text(data)
+    counts = main._extract_counts_from_text(text)
+    return (main._dominant_from_counts(counts) if counts else main._emotion_detail_from_text(text)), counts
+
+
+def _chat(text: str) -> dict:
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]}
+
+
+def samples() -> dict[str, dict]:
+    payload = json.loads((BACKEND_DIR / "data" / "nim-payload.json").read_text(encoding="utf-8"))
+    system = payload["messages"][0]["content"]
+    labels = [label.strip(" .") for label in system.split(":", 1)[1].split(",")]
+    counts = {label: 0 for label in main.EMOTION_LABELS if label in main.DETAILED_EMOTIONS}
+    counts.update({"neutral": 2, "happy": 1})
+    counts_json = json.dumps({"emotion_counts": counts, "dominant_emotion": "neutral"})
+    faces_json = json.dumps({"faces": [{"index": idx, "emotion": label} for idx, label in enumerate(labels[:4])]})
+    return {
+        "one_word": _chat(labels[0]),
+        "one_word_punct": _chat(f" {labels[4].capitalize()}.\n"),
+        "prose": _chat("The person appears calm, with a slight smile; overall they look pleased and content."),
+        "prose_unknown": _chat("I cannot determine the emotion from this image."),
+        "counts_strict": _chat(counts_json),
+        "counts_fenced": _chat(f"```json\n{counts_json}\n```"),
+        "counts_wrapped": _chat(f"Here is the analysis: {counts_json} Let me know if you need more."),
+        "faces_strict": _chat(faces_json),
+        "truncated": _chat(counts_json[: len(counts_json) // 2]),
+    }
+
+
+def run(number: int, repeat: int) -> dict:
+    results = []
+    for name, data in samples().items():
+        expected, got = baseline_parse(data), current_parse(data)
+        if expected != got:
+            raise AssertionError(f"{name}: baseline {expected} != current {got}")
+        timings = {}
+        for label, fn in (("baseline", baseline_parse), ("current", current_parse)):
+            best = min(timeit.repeat(lambda: fn(data), number=number, repeat=repeat))
+            timings[label] = best / number * 1e6
+        results.append(
+            {
+                "sample": name,
+                "baseline_us": round(timings["baseline"], 3),
+                "current_us": round(timings["current"], 3),
+                "speedup": round(timings["baseline"] / timings["current"], 2),
+                "result": got[0],
+            }
+        )
+    return {"number": number, "repeat": repeat, "samples": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=5000, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timings per sample; the best is kept")
+    parser.add_argument("--output", default="", help="write JSON results here")
+    args = parser.parse_args()
+    report = run(args.number, args.repeat)
+    print(f"{'sample':<16}{'baseline us':>13}{'current us':>12}{'speedup':>9}  result")
+    for item in report["samples"]:
+        print(f"{item['sample']:<16}{item['baseline_us']:>13.2f}{item['current_us']:>12.2f}{item['speedup']:>8.1f}x  {item['result']}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
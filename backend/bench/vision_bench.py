@@ -0,0 +1,543 @@
+"""Load test for POST /vision against a mock (or real) emotion endpoint.
+
+By default it starts the mock NIM server in-process and the backend as a
+uvicorn subprocess pointed at it, then drives each workload (sample images
+from backend/data and synthetic multi-face frames) with `--concurrency`
+streams. Frames repeat, so by default the frame gate, tracking and the
+result cache are turned off and every frame takes the cold path (detect and
+classify); `--warm` measures with them on. Per workload it reports
+throughput, latency percentiles, backend CPU time and peak memory, upstream
+calls and bytes per frame, encoded crop sizes and each frame's answer, and
+writes everything as JSON for offline comparison:
+
+    python backend/bench/vision_bench.py --requests 200 --concurrency 8 \\
+        --latency-ms 120 --jitter-ms 40 --malformed-rate 0.05 --output bench.json
+    python backend/bench/vision_bench.py --baseline bench.json --max-regression 0.15
+
+Against a real model, the answer agreement with the baseline shows what a
+smaller crop costs in accuracy:
+
+    python backend/bench/vision_bench.py synthetic:4 --upstream-url $URL --output full.json
+    python backend/bench/vision_bench.py synthetic:4 --upstream-url $URL \\
+        --config '{"crop_size":96,"crop_quality":70}' --baseline full.json --min-agreement 0.9
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict
+from pathlib import Path
+
+import cv2
+import httpx
+import numpy as np
+
+from mock_nim import MockNim, MockServer, MockSettings
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BACKEND_DIR / "data"
+SAMPLE_IMAGES = ("probe.jpg", "probe.png", "tiny.png")
+DEFAULT_WORKLOADS = (*SAMPLE_IMAGES, "synthetic:1", "synthetic:2", "synthetic:4")
+# Cycled frames repeat, so with these on most frames are answered by the
+# frame gate, tracks or the result cache. The default run turns them off
+# so every frame is detected and classified; --warm keeps them.
+COLD_CONFIG = {"frame_gate": False, "tracking": False, "cache_enabled": False}
+
+
+def _draw_face(image: np.ndarray, cx: int, cy: int, size: int) -> None:
+    # Crude frontal face the stock Haar cascade detects reliably.
+    cv2.ellipse(image, (cx, cy), (int(size * 0.42), int(size * 0.55)), 0, 0, 360, (170, 190, 215), -1)
+    for side in (-1, 1):
+        ex, ey = cx + side * int(size * 0.18), cy - int(size * 0.12)
+        cv2.ellipse(image, (ex, ey - int(size * 0.1)), (int(size * 0.12), int(size * 0.03)), 0, 0, 360, (40, 40, 50), -1)
+        cv2.ellipse(image, (ex, ey), (int(size * 0.09), int(size * 0.045)), 0, 0, 360, (245, 245, 245), -1)
+        cv2.circle(image, (ex, ey), int(size * 0.04), (30, 30, 30), -1)
+    cv2.ellipse(image, (cx, cy + int(size * 0.1)), (int(size * 0.05), int(size * 0.1)), 0, 0, 360, (130, 150, 180), -1)
+    cv2.ellipse(image, (cx, cy + int(size * 0.3)), (int(size * 0.16), int(size * 0.05)), 0, 0, 360, (60, 60, 140), -1)
+
+
+def synthetic_frames(faces: int, width: int, height: int, count: int, seed: int) -> list[bytes]:
+    """JPEG frames with `faces` faces on a grid, jittered a few pixels per frame like a live camera."""
+    rng = np.random.default_rng(seed)
+    cols = max(1, int(np.ceil(np.sqrt(faces))))
+    rows = max(1, int(np.ceil(faces / cols)))
+    size = int(min(width / cols, height / rows) * 0.6)
+    frames = []
+    for _ in range(count):
+        image = np.full((height, width, 3), 90, np.uint8)
+        for idx in range(faces):
+            row, col = divmod(idx, cols)
+            cx = int((col + 0.5) * width / cols) + int(rng.integers(-4, 5))
+            cy = int((row + 0.5) * height / rows) + int(rng.integers(-4, 5))
+            _draw_face(image, cx, cy, size)
+        image = cv2.GaussianBlur(image, (5, 5), 0)
+        image = cv2.add(image, rng.integers(0, 6, image.shape, dtype=np.uint8))
+        frames.append(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes())
+    return frames
+
+
+def workload_frames(name: str, args: argparse.Namespace) -> list[bytes]:
+    if name.startswith("synthetic:"):
+        return synthetic_frames(int(name.split(":", 1)[1]), args.width, args.height, args.distinct_frames, args.seed)
+    path = Path(name) if Path(name).is_file() else DATA_DIR / name
+    return [path.read_bytes()]
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    return round(float(np.percentile(np.asarray(values), pct)), 3)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree(root_pid: int) -> dict[int, list[str]] | None:
+    """/proc stat fields of a process and its live descendants (Linux only)."""
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    parents: dict[int, int] = {}
+    stats: dict[int, list[str]] = {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces; fields resume after the last ")".
+        fields = stat[stat.rfind(")") + 2 :].split()
+        parents[int(entry.name)] = int(fields[1])
+        stats[int(entry.name)] = fields
+    if root_pid not in stats:
+        return None
+    tree, stack = {}, [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree[pid] = stats[pid]
+        stack.extend(child for child, parent in parents.items() if parent == pid)
+    return tree
+
+
+def _process_tree_cpu_seconds(root_pid: int) -> float | None:
+    """utime + stime of a process and its live descendants."""
+    tree = _process_tree(root_pid)
+    if tree is None:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return sum((int(fields[11]) + int(fields[12])) / ticks for fields in tree.values())
+
+
+def _process_tree_peak_rss_mb(root_pid: int) -> float | None:
+    """Summed VmHWM (peak resident set) of a process and its live descendants."""
+    tree = _process_tree(root_pid)
+    if tree is None:
+        return None
+    total_kb = 0
+    for pid in tree:
+        try:
+            status = Path(f"/proc/{pid}/status").read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith("VmHWM:"):
+                total_kb += int(line.split()[1])
+    return round(total_kb / 1024, 1)
+
+
+class Backend:
+    """The /vision backend under test: a local uvicorn subprocess or an external URL."""
+
+    def __init__(self, args: argparse.Namespace, upstream_url: str) -> None:
+        self.url = args.backend_url.rstrip("/") if args.backend_url else ""
+        self.process: subprocess.Popen | None = None
+        if self.url:
+            return
+        port = _free_port()
+        self._config_dir = tempfile.TemporaryDirectory()
+        env = {
+            **os.environ,
+            "EMOTION_CONFIG_PATH": str(Path(self._config_dir.name) / "emotion-config.json"),
+            "EMOTION_ENDPOINT": upstream_url,
+            "EMOTION_MODEL": "mock",
+        }
+        for item in args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        # OpenCV reports undecodable sample images on stderr; keep it out of the results.
+        self._log = open(args.backend_log or os.devnull, "ab")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR,
+            env=env,
+            stdout=self._log,
+            stderr=subprocess.STDOUT,
+        )
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def wait_ready(self, client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f"backend exited with code {self.process.returncode}")
+            try:
+                if (await client.get(f"{self.url}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"backend at {self.url} did not become ready")
+            await asyncio.sleep(0.1)
+
+    def cpu_seconds(self) -> float | None:
+        return _process_tree_cpu_seconds(self.process.pid) if self.process is not None else None
+
+    def peak_rss_mb(self) -> float | None:
+        return _process_tree_peak_rss_mb(self.process.pid) if self.process is not None else None
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+        self._config_dir.cleanup()
+
+
+async def _upstream_stats(client: httpx.AsyncClient, args: argparse.Namespace, mock: MockNim | None) -> dict | None:
+    if mock is not None:
+        return asdict(mock.reset())
+    if args.upstream_stats_url:
+        return (await client.post(args.upstream_stats_url)).json()
+    return None
+
+
+async def _crop_bytes(client: httpx.AsyncClient, backend: Backend) -> tuple[float, float] | None:
+    """Sum and count of the backend's vision_crop_bytes histogram over all formats."""
+    try:
+        text = (await client.get(f"{backend.url}/metrics")).text
+    except httpx.HTTPError:
+        return None
+    total = count = 0.0
+    for line in text.splitlines():
+        name, _, value = line.rpartition(" ")
+        if name.startswith("vision_crop_bytes_sum"):
+            total += float(value)
+        elif name.startswith("vision_crop_bytes_count"):
+            count += float(value)
+    return total, count
+
+
+async def run_workload(
+    name: str,
+    frames: list[bytes],
+    backend: Backend,
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    mock: MockNim | None,
+) -> dict:
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    counters = {"faces": 0, "cached": 0, "superseded": 0, "timed_out_faces": 0}
+    sources: dict[str, int] = {}
+    answers: dict[int, Counter] = {}
+    next_request = 0
+
+    async def stream(stream_idx: int, total: int, record: bool) -> None:
+        nonlocal next_request
+        session_id = f"bench-{name}-{stream_idx}-{uuid.uuid4().hex[:8]}"
+        seq = 0
+        while next_request < total:
+            next_request += 1
+            frame_idx = seq % len(frames)
+            data = frames[frame_idx]
+            seq += 1
+            started = time.perf_counter()
+            try:
+                if args.raw:
+                    resp = await client.post(
+                        f"{backend.url}/vision",
+                        content=data,
+                        headers={"Content-Type": "image/jpeg", "X-Session-Id": session_id},
+                    )
+                else:
+                    resp = await client.post(
+                        f"{backend.url}/vision",
+                        files={"frame": ("frame.jpg", data, "image/jpeg")},
+                        data={"session_id": session_id},
+                    )
+                status = str(resp.status_code)
+                body = resp.json() if resp.status_code == 200 else {}
+            except httpx.HTTPError as exc:
+                status, body = type(exc).__name__, {}
+            elapsed = time.perf_counter() - started
+            if not record:
+                continue
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            counters["faces"] += int(body.get("face_count") or 0)
+            counters["cached"] += bool(body.get("cached"))
+            counters["superseded"] += bool(body.get("superseded"))
+            counters["timed_out_faces"] += int((body.get("debug") or {}).get("timed_out_faces") or 0)
+            source = body.get("sentiment_source") or "none"
+            sources[source] = sources.get(source, 0) + 1
+            if body.get("emotion_detail"):
+                answers.setdefault(frame_idx, Counter())[body["emotion_detail"]] += 1
+
+    if args.warmup:
+        await asyncio.gather(*(stream(idx, args.warmup, False) for idx in range(min(args.concurrency, args.warmup))))
+    next_request = 0
+    await _upstream_stats(client, args, mock)
+    crops_before = await _crop_bytes(client, backend)
+    cpu_before = backend.cpu_seconds()
+    started = time.perf_counter()
+    await asyncio.gather(*(stream(idx, args.requests, True) for idx in range(args.concurrency)))
+    wall = time.perf_counter() - started
+    cpu_after = backend.cpu_seconds()
+    upstream = await _upstream_stats(client, args, mock)
+    crops_after = await _crop_bytes(client, backend)
+    crop_bytes, crop_count = (
+        (crops_after[0] - crops_before[0], crops_after[1] - crops_before[1])
+        if crops_before is not None and crops_after is not None
+        else (0.0, 0.0)
+    )
+
+    frames_done = len(latencies)
+    ms = [value * 1000 for value in latencies]
+    return {
+        "workload": name,
+        "frames": frames_done,
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 4),
+        "throughput_fps": round(frames_done / wall, 3) if wall > 0 else None,
+        "latency_ms": {
+            "mean": round(sum(ms) / frames_done, 3) if frames_done else None,
+            "p50": percentile(ms, 50),
+            "p95": percentile(ms, 95),
+            "p99": percentile(ms, 99),
+            "max": round(max(ms), 3) if ms else None,
+        },
+        "cpu_ms_per_frame": (
+            round((cpu_after - cpu_before) * 1000 / frames_done, 3)
+            if cpu_before is not None and cpu_after is not None and frames_done
+            else None
+        ),
+        "upstream_calls_per_frame": (
+            round(upstream["calls"] / frames_done, 3) if upstream is not None and frames_done else None
+        ),
+        "upstream_images_per_frame": (
+            round(upstream["images"] / frames_done, 3) if upstream is not None and frames_done else None
+        ),
+        "upstream_bytes_per_frame": (
+            round(upstream["request_bytes"] / frames_done, 1)
+            if upstream is not None and "request_bytes" in upstream and frames_done
+            else None
+        ),
+        "crop_bytes_mean": round(crop_bytes / crop_count, 1) if crop_count else None,
+        # High-water mark since the backend started, so it only grows across workloads.
+        "backend_peak_rss_mb": backend.peak_rss_mb(),
+        "crop_bytes_per_frame": round(crop_bytes / frames_done, 1) if frames_done else None,
+        "upstream": upstream,
+        "statuses": statuses,
+        "sentiment_sources": sources,
+        "faces_per_frame": round(counters["faces"] / frames_done, 3) if frames_done else None,
+        "cached_frames": counters["cached"],
+        "superseded_frames": counters["superseded"],
+        "timed_out_faces": counters["timed_out_faces"],
+        # Most frequent answer per distinct frame, for agreement across runs.
+        "answers": {str(idx): counts.most_common(1)[0][0] for idx, counts in sorted(answers.items())},
+    }
+
+
+def agreement(item: dict, base: dict) -> float | None:
+    """Share of frames answered the same as in the baseline run."""
+    shared = set(item.get("answers", {})) & set(base.get("answers", {}))
+    if not shared:
+        return None
+    return sum(item["answers"][idx] == base["answers"][idx] for idx in shared) / len(shared)
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_agreement: float = 0.0) -> list[str]:
+    """Regressions of throughput, p95 latency and per-frame costs beyond tolerance.
+
+    With min_agreement, frames answered differently from the baseline count
+    as a regression once their share exceeds 1 - min_agreement.
+    """
+    previous = {item["workload"]: item for item in baseline.get("workloads", [])}
+    problems = []
+    # Baselines written before --warm existed measured the warm path.
+    path, base_path = results["meta"].get("path"), baseline.get("meta", {}).get("path", "warm")
+    if path != base_path:
+        problems.append(f"baseline measured the {base_path} path, this run the {path} path")
+        return problems
+    for item in results["workloads"]:
+        base = previous.get(item["workload"])
+        if base is None:
+            continue
+        checks = (
+            ("throughput_fps", item["throughput_fps"], base["throughput_fps"], False),
+            ("latency_ms.p95", item["latency_ms"]["p95"], base["latency_ms"]["p95"], True),
+            ("cpu_ms_per_frame", item["cpu_ms_per_frame"], base["cpu_ms_per_frame"], True),
+            ("upstream_calls_per_frame", item["upstream_calls_per_frame"], base["upstream_calls_per_frame"], True),
+            ("crop_bytes_per_frame", item.get("crop_bytes_per_frame"), base.get("crop_bytes_per_frame"), True),
+        )
+        for metric, now, then, lower_is_better in checks:
+            if now is None or not then:
+                continue
+            change = (now - then) / then
+            if (change > tolerance) if lower_is_better else (change < -tolerance):
+                problems.append(f"{item['workload']}: {metric} {then:.3f} -> {now:.3f} ({change:+.1%})")
+        same = agreement(item, base)
+        if same is not None:
+            print(f"{item['workload']}: answer agreement with baseline {same:.1%}", file=sys.stderr)
+            if same < min_agreement:
+                problems.append(f"{item['workload']}: answer agreement {same:.1%} < {min_agreement:.1%}")
+    return problems
+
+
+def _print_table(results: dict) -> None:
+    header = (
+        f"{'workload':<14}{'fps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'cpu ms/f':>10}{'calls/f':>9}"
+        f"{'faces/f':>9}{'crop KB':>9}{'peak MB':>9}"
+    )
+    print(header, file=sys.stderr)
+
+    def cell(value: float | None, width: int, digits: int = 1) -> str:
+        return f"{'-':>{width}}" if value is None else f"{value:>{width}.{digits}f}"
+
+    for item in results["workloads"]:
+        latency = item["latency_ms"]
+        print(
+            f"{item['workload']:<14}{cell(item['throughput_fps'], 9)}{cell(latency['p50'], 10)}"
+            f"{cell(latency['p95'], 10)}{cell(latency['p99'], 10)}{cell(item['cpu_ms_per_frame'], 10)}"
+            f"{cell(item['upstream_calls_per_frame'], 9, 2)}{cell(item['faces_per_frame'], 9, 2)}"
+            f"{cell(item['crop_bytes_mean'] / 1024 if item['crop_bytes_mean'] else None, 9, 2)}"
+            f"{cell(item.get('backend_peak_rss_mb'), 9)}",
+            file=sys.stderr,
+        )
+
+
+async def main(args: argparse.Namespace) -> dict:
+    mock = None
+    server = None
+    upstream_url = args.upstream_url
+    if not upstream_url:
+        settings = MockSettings(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            per_image_ms=args.per_image_ms,
+            error_rate=args.error_rate,
+            malformed_rate=args.malformed_rate,
+            reject_batches=args.reject_batches,
+            seed=args.seed,
+        )
+        mock = MockNim(settings)
+        server = MockServer(mock).start()
+        upstream_url = server.url
+
+    backend = Backend(args, upstream_url)
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            await backend.wait_ready(client)
+            overrides = {**({} if args.warm else COLD_CONFIG), **(json.loads(args.config) if args.config else {})}
+            if overrides:
+                resp = await client.post(f"{backend.url}/emotion-config", json=overrides)
+                resp.raise_for_status()
+            config = (await client.get(f"{backend.url}/emotion-config")).json()
+            config.pop("token", None)
+            workloads = []
+            for name in args.workloads:
+                workloads.append(await run_workload(name, workload_frames(name, args), backend, client, args, mock))
+    finally:
+        backend.stop()
+        if server is not None:
+            server.stop()
+
+    return {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend_url or "subprocess",
+            "upstream": args.upstream_url or "mock",
+            "mock": mock.settings.model_dump() if mock is not None else None,
+            "backend_config": config,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "raw": args.raw,
+            "path": "warm" if args.warm else "cold",
+        },
+        "workloads": workloads,
+    }
+
+
+def _parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("workloads", nargs="*", default=list(DEFAULT_WORKLOADS),
+                        help="sample image names/paths or synthetic:<faces> (default: all samples, synthetic:1,2,4)")
+    parser.add_argument("--requests", type=int, default=100, help="frames per workload")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent streams, one session each")
+    parser.add_argument("--warmup", type=int, default=8, help="unrecorded frames per workload")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--raw", action="store_true", help="POST frames as raw image/jpeg bodies instead of multipart")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--distinct-frames", type=int, default=16, help="synthetic frames cycled per workload")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend-url", default="", help="use a running backend instead of starting one")
+    parser.add_argument("--backend-log", default="", help="file for the backend subprocess output")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="environment for the backend subprocess, e.g. VISION_WORKER_MODE=process")
+    parser.add_argument("--config", default="", help="JSON object POSTed to /emotion-config before the run")
+    parser.add_argument("--warm", action="store_true",
+                        help="keep the frame gate, tracking and result cache on (default: cold path, all off)")
+    parser.add_argument("--upstream-url", default="", help="use a real emotion endpoint instead of the mock")
+    parser.add_argument("--upstream-stats-url", default="", help="POST endpoint returning and resetting call stats")
+    mock = parser.add_argument_group("mock upstream")
+    mock.add_argument("--latency-ms", type=float, default=50.0)
+    mock.add_argument("--jitter-ms", type=float, default=0.0)
+    mock.add_argument("--per-image-ms", type=float, default=0.0)
+    mock.add_argument("--error-rate", type=float, default=0.0)
+    mock.add_argument("--malformed-rate", type=float, default=0.0)
+    mock.add_argument("--reject-batches", action="store_true")
+    parser.add_argument("--output", default="", help="write JSON results here (default: stdout)")
+    parser.add_argument("--baseline", default="", help="previous JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1, help="allowed relative regression")
+    parser.add_argument("--min-agreement", type=float, default=0.0,
+                        help="minimum share of frames answered as in the baseline (meaningful with a real model)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    results = asyncio.run(main(args))
+    _print_table(results)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        problems = compare(results, baseline, args.max_regression, args.min_agreement)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        sys.exit(1 if problems else 0)
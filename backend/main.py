@@ -1,17 +1,53 @@
+import asyncio
+import importlib.util
 import json
+import logging
+import multiprocessing
 import os
 import base64
+import hashlib
+import random
 import re
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
 from pathlib import Path
-from collections import Counter, deque
+from collections import Counter, OrderedDict
 import httpx
 import cv2
 import numpy as np
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="Live Vision Backend")
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    _emotion_upstreams()
+    _get_cpu_pool()
+    await _warm_up_detectors()
+    await _warm_up_classifiers()
+    watcher = asyncio.create_task(_watch_emotion_config()) if _CONFIG_WATCH_INTERVAL > 0 else None
+    try:
+        yield
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await _close_emotion_client()
+        await _close_shared_store()
+        _shutdown_cpu_pool()
+
+
+app = FastAPI(title="Live Vision Backend", lifespan=_lifespan)
+_logger = logging.getLogger("live_vision")
 
 # Allow local dev usage; lock down for prod.
 app.add_middleware(
@@ -22,39 +58,433 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name, "").strip().lower()
+    if not value:
+        return default
+    return value in {"1", "true", "yes", "on"}
+
+
+# Minimal Prometheus text-format metrics, rendered by GET /metrics.
+_METRICS: list["_Metric"] = []
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_metric_labels(pairs: list[tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        _METRICS.append(self)
+
+    def _key(self, labels: dict[str, object]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self):
+        """Yield (suffix, label pairs, value) tuples."""
+        return ()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, pairs, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_metric_labels(pairs)} {_format_metric_value(value)}")
+        return lines
+
+
+class MetricCounter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        if not self.label_names and not self._values:
+            yield "", [], 0
+        for key, value in sorted(self._values.items()):
+            yield "", list(zip(self.label_names, key)), value
+
+
+class MetricHistogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = _LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[idx] += 1
+        state[len(self.buckets)] += 1
+        state[-1] += value
+
+    def samples(self):
+        for key, state in sorted(self._values.items()):
+            pairs = list(zip(self.label_names, key))
+            for bound, count in zip(self.buckets, state):
+                yield "_bucket", pairs + [("le", _format_metric_value(bound))], count
+            yield "_bucket", pairs + [("le", "+Inf")], state[len(self.buckets)]
+            yield "_sum", pairs, state[-1]
+            yield "_count", pairs, state[len(self.buckets)]
+
+
+class MetricCallback(_Metric):
+    """Metric read from a callback at scrape time.
+
+    Without labels the callback returns the value; with labels it returns a
+    {label values tuple: value} dict.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, fn, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self.kind = kind
+        self._fn = fn
+
+    def samples(self):
+        if not self.label_names:
+            yield "", [], self._fn()
+            return
+        for key, value in sorted(self._fn().items()):
+            yield "", list(zip(self.label_names, key)), value
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_STAGE_SECONDS = MetricHistogram(
+    "vision_stage_seconds",
+    "CPU stage time per frame: decode, gray, detect, encode (all face crops).",
+    ("stage",),
+)
+_DETECTOR_SECONDS = MetricHistogram("vision_detector_seconds", "Face detection time per frame by detector backend.", ("detector",))
+_EMOTION_CALL_SECONDS = MetricHistogram(
+    "emotion_call_seconds",
+    "Duration of each emotion analysis call by sentiment_source.",
+    ("sentiment_source",),
+)
+_REQUEST_SECONDS = MetricHistogram("vision_request_seconds", "Total frame processing time.", ("transport",))
+_CROP_BYTES = MetricHistogram(
+    "vision_crop_bytes",
+    "Encoded size of face crops sent for emotion analysis, before base64.",
+    ("format",),
+    buckets=(1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288),
+)
+_FACES_DETECTED = MetricCounter("vision_faces_detected_total", "Faces found by the detector.")
+_FACES_ANALYZED = MetricCounter("vision_faces_analyzed_total", "Detected faces cropped for emotion analysis.")
+_TRACKED_FACES = MetricCounter("vision_tracked_faces_total", "Faces answered from a track's cached emotion.")
+_CLASSIFIED_FACES = MetricCounter("vision_classified_faces_total", "Faces sent for emotion classification.")
+_STATIC_FRAMES = MetricCounter("vision_static_frames_total", "Frames answered by the static-scene gate without detection.")
+_SUPERSEDED_REQUESTS = MetricCounter(
+    "vision_superseded_requests_total",
+    "Requests answered with a newer or cached result by latest-frame-wins scheduling.",
+)
+_UPSTREAM_RESPONSES = MetricCounter(
+    "emotion_upstream_responses_total",
+    "Emotion endpoint responses by HTTP status code (\"error\" for transport failures).",
+    ("status",),
+)
+_BREAKER_TRANSITIONS = MetricCounter(
+    "emotion_breaker_transitions_total",
+    "Circuit breaker state changes by new state.",
+    ("state",),
+)
+_BREAKER_REJECTED = MetricCounter("emotion_breaker_rejected_total", "Emotion calls answered instantly by an open breaker.")
+_HEDGED_REQUESTS = MetricCounter(
+    "emotion_hedged_requests_total",
+    "Duplicate emotion calls sent after the hedge delay, by which call answered first.",
+    ("winner",),
+)
+_FACE_TIERS = MetricCounter(
+    "vision_face_tier_total",
+    "Faces classified by the local model alone or sent to the remote model.",
+    ("tier",),
+)
+_MICRO_BATCH_SIZE = MetricHistogram(
+    "emotion_micro_batch_size",
+    "Crops per cross-stream micro-batch, by what flushed it (size or wait).",
+    ("flush",),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+_CONFIG_RELOADS = MetricCounter(
+    "emotion_config_reloads_total",
+    "Config changes picked up from EMOTION_CONFIG_PATH, written by another worker or by hand.",
+)
+_SHARED_STORE_OPS = MetricCounter(
+    "vision_shared_store_ops_total",
+    "Shared store reads and writes by kind (session, cache) and result (hit, miss, ok, error).",
+    ("kind", "result"),
+)
+
+
+class EmotionUpstream(BaseModel):
+    endpoint: str
+    # Empty token/model use the EmotionConfig values.
+    token: str = ""
+    model: str = ""
+    weight: float = 1.0
+    # Concurrent calls to this upstream; 0 uses upstream_max_concurrency.
+    max_concurrency: int = 0
+
+
 class EmotionConfig(BaseModel):
     endpoint: str = ""
     token: str = ""
     model: str = ""
+    # Model replicas to spread calls over instead of the single endpoint,
+    # routed by lb_policy: least_outstanding or p2c (power of two choices).
+    upstreams: list[EmotionUpstream] = []
+    lb_policy: str = os.getenv("EMOTION_LB_POLICY", "least_outstanding").strip().lower()
+    # Concurrent calls per upstream; 0 is unlimited.
+    upstream_max_concurrency: int = _env_int("EMOTION_UPSTREAM_MAX_CONCURRENCY", 0)
+    # HTTP client settings for the emotion endpoint; changing any of these
+    # rebuilds the pooled client on the next call.
+    verify_tls: bool = _env_bool("EMOTION_VERIFY_TLS", True)
+    http2: bool = _env_bool("EMOTION_HTTP2", True)
+    connect_timeout: float = _env_float("EMOTION_CONNECT_TIMEOUT", 3.0)
+    read_timeout: float = _env_float("EMOTION_TIMEOUT", 10.0)
+    max_connections: int = _env_int("EMOTION_MAX_CONNECTIONS", 32)
+    max_keepalive_connections: int = _env_int("EMOTION_MAX_KEEPALIVE", 16)
+    keepalive_expiry: float = _env_float("EMOTION_KEEPALIVE_EXPIRY", 30.0)
+    # Per-frame fan-out: concurrent face calls and the overall budget (s) for
+    # a frame's model calls; 0 disables the deadline.
+    face_concurrency: int = _env_int("EMOTION_FACE_CONCURRENCY", 4)
+    request_deadline: float = _env_float("EMOTION_REQUEST_DEADLINE", 8.0)
+    # Send all crops of a frame in one multi-image chat completion.
+    batch_faces: bool = _env_bool("EMOTION_BATCH_FACES", False)
+    # Cross-stream micro-batching: crops of all in-flight frames are collected
+    # for up to batch_max_wait seconds or batch_max_size crops and sent as one
+    # multi-image call, with results fanned back out to each frame.
+    micro_batch: bool = _env_bool("EMOTION_MICRO_BATCH", False)
+    batch_max_size: int = _env_int("EMOTION_BATCH_MAX_SIZE", 8)
+    batch_max_wait: float = _env_float("EMOTION_BATCH_MAX_WAIT", 0.01)
+    # Face tracking across frames: a tracked face reuses its last emotion until
+    # its appearance changes or the refresh interval (s) passes.
+    tracking: bool = _env_bool("VISION_TRACKING", True)
+    track_iou: float = _env_float("VISION_TRACK_IOU", 0.3)
+    track_refresh_seconds: float = _env_float("VISION_TRACK_REFRESH", 5.0)
+    track_appearance_threshold: float = _env_float("VISION_TRACK_APPEARANCE", 0.12)
+    track_max_missed: int = _env_int("VISION_TRACK_MAX_MISSED", 3)
+    # Result cache keyed by a perceptual hash of the crop; near-identical
+    # crops (within cache_hamming bits, max 3) skip the model call.
+    cache_enabled: bool = _env_bool("EMOTION_CACHE", True)
+    cache_ttl: float = _env_float("EMOTION_CACHE_TTL", 30.0)
+    cache_max_bytes: int = _env_int("EMOTION_CACHE_MAX_BYTES", 4 * 1024 * 1024)
+    cache_hamming: int = _env_int("EMOTION_CACHE_HAMMING", 2)
+    # Static-scene gate: a frame whose thumbnail differs from the last fully
+    # processed frame by at most frame_gate_threshold (0-1) reuses that result,
+    # for up to frame_gate_max_staleness seconds.
+    frame_gate: bool = _env_bool("VISION_FRAME_GATE", True)
+    frame_gate_threshold: float = _env_float("VISION_FRAME_GATE_THRESHOLD", 0.02)
+    frame_gate_max_staleness: float = _env_float("VISION_FRAME_GATE_MAX_STALENESS", 2.0)
+    # Local face detector backend: haar, lbp, yunet or dnn (model files are
+    # set through VISION_LBP_CASCADE, VISION_YUNET_MODEL, VISION_DNN_*).
+    detector: str = os.getenv("VISION_DETECTOR", "haar").strip().lower()
+    detector_score_threshold: float = _env_float("VISION_DETECTOR_SCORE_THRESHOLD", 0.6)
+    # Face detector pyramid. Detection runs on a gray frame downscaled to at
+    # most detect_max_width pixels (0 keeps full resolution); detect_min_size
+    # is in full-resolution pixels.
+    detect_scale_factor: float = _env_float("VISION_DETECT_SCALE_FACTOR", 1.1)
+    detect_min_neighbors: int = _env_int("VISION_DETECT_MIN_NEIGHBORS", 5)
+    detect_min_size: int = _env_int("VISION_DETECT_MIN_SIZE", 48)
+    detect_max_width: int = _env_int("VISION_DETECT_MAX_WIDTH", 640)
+    # Search only around the previous frame's faces, expanded by
+    # detect_roi_margin (fraction of box size), with a full scan every
+    # detect_full_scan_interval frames.
+    detect_roi: bool = _env_bool("VISION_DETECT_ROI", True)
+    detect_roi_margin: float = _env_float("VISION_DETECT_ROI_MARGIN", 0.5)
+    detect_full_scan_interval: int = _env_int("VISION_DETECT_FULL_SCAN_INTERVAL", 10)
+    # JPEG frames at least twice decode_max_width wide are decoded at 1/2,
+    # 1/4 or 1/8 scale, keeping them at least that wide; 0 decodes at full
+    # size. Crops then come from the reduced frame.
+    decode_max_width: int = _env_int("VISION_DECODE_MAX_WIDTH", 0)
+    # Crop normalization before upload: boxes padded by crop_margin (fraction
+    # of box size), downscaled to fit crop_size px (0 keeps the detected
+    # size), optionally gray, encoded as crop_format (jpeg or webp) at
+    # crop_quality (1-100).
+    crop_margin: float = _env_float("VISION_CROP_MARGIN", 0.0)
+    crop_size: int = _env_int("VISION_CROP_SIZE", 0)
+    crop_grayscale: bool = _env_bool("VISION_CROP_GRAYSCALE", False)
+    crop_format: str = os.getenv("VISION_CROP_FORMAT", "jpeg").strip().lower()
+    crop_quality: int = _env_int("VISION_CROP_QUALITY", 95)
+    # Per-stream latest-frame-wins scheduling of concurrent /vision requests.
+    latest_frame_wins: bool = _env_bool("VISION_LATEST_FRAME_WINS", True)
+    # Add the timing block to every /vision response, not only opted-in ones.
+    debug_timing: bool = _env_bool("VISION_DEBUG_TIMING", False)
+    # Adaptive per-call timeout: adaptive_timeout_multiplier x the observed
+    # latency percentile, clamped to [adaptive_timeout_min, read_timeout].
+    adaptive_timeout: bool = _env_bool("EMOTION_ADAPTIVE_TIMEOUT", True)
+    adaptive_timeout_percentile: float = _env_float("EMOTION_ADAPTIVE_TIMEOUT_PERCENTILE", 99.0)
+    adaptive_timeout_multiplier: float = _env_float("EMOTION_ADAPTIVE_TIMEOUT_MULTIPLIER", 3.0)
+    adaptive_timeout_min: float = _env_float("EMOTION_ADAPTIVE_TIMEOUT_MIN", 1.0)
+    # Hedged requests: a duplicate single-face call once the first one has run
+    # for the observed hedge_percentile latency; at most hedge_budget
+    # duplicates per call overall.
+    hedge: bool = _env_bool("EMOTION_HEDGE", False)
+    hedge_percentile: float = _env_float("EMOTION_HEDGE_PERCENTILE", 95.0)
+    hedge_budget: float = _env_float("EMOTION_HEDGE_BUDGET", 0.1)
+    # Circuit breaker: after breaker_failures consecutive failures (5xx, 429,
+    # transport errors, timeouts) the endpoint is not called for
+    # breaker_cooldown seconds, then a single probe call decides.
+    breaker: bool = _env_bool("EMOTION_BREAKER", True)
+    breaker_failures: int = _env_int("EMOTION_BREAKER_FAILURES", 5)
+    breaker_cooldown: float = _env_float("EMOTION_BREAKER_COOLDOWN", 30.0)
+    # Emotion engine: "remote" (the model endpoints above; stub without one),
+    # "local" (the offline classifier from EMOTION_LOCAL_MODEL) or "cascade"
+    # (local first; only faces whose top emotion has less than
+    # cascade_threshold probability or leads the runner-up by less than
+    # cascade_margin go to the remote engine). With local_fallback, faces the
+    # remote engine fails on or does not answer before the request deadline
+    # are classified locally instead.
+    emotion_engine: str = os.getenv("EMOTION_ENGINE", "remote").strip().lower()
+    local_fallback: bool = _env_bool("EMOTION_LOCAL_FALLBACK", False)
+    cascade_threshold: float = _env_float("EMOTION_CASCADE_THRESHOLD", 0.8)
+    cascade_margin: float = _env_float("EMOTION_CASCADE_MARGIN", 0.0)
 
 
 _config_path = Path(os.getenv("EMOTION_CONFIG_PATH", "/data/emotion-config.json"))
 
 
-def _load_emotion_config() -> EmotionConfig:
-    if _config_path.exists():
-        try:
-            data = json.loads(_config_path.read_text(encoding="utf-8"))
-            return EmotionConfig(**data)
-        except Exception:
-            pass
-    return EmotionConfig(
-        endpoint=os.getenv("EMOTION_ENDPOINT", "").strip(),
-        token=os.getenv("EMOTION_TOKEN", "").strip(),
-        model=os.getenv("EMOTION_MODEL", "").strip(),
-    )
+def _read_config_file() -> dict | None:
+    """The persisted overrides: only fields someone set through POST /emotion-config.
+
+    None when the file is missing or unreadable.
+    """
+    try:
+        data = json.loads(_config_path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _load_emotion_config(data: dict | None = None) -> EmotionConfig:
+    # Env values (and the env defaults of the tunables) apply under the saved overrides.
+    env = {
+        "endpoint": os.getenv("EMOTION_ENDPOINT", "").strip(),
+        "token": os.getenv("EMOTION_TOKEN", "").strip(),
+        "model": os.getenv("EMOTION_MODEL", "").strip(),
+        "upstreams": _env_upstreams(),
+    }
+    data = _read_config_file() if data is None else data
+    try:
+        return EmotionConfig(**{**env, **(data or {})})
+    except Exception:
+        return EmotionConfig(**env)
+
+
+def _env_upstreams() -> list[EmotionUpstream]:
+    # EMOTION_UPSTREAMS: a JSON list of upstream objects or comma-separated endpoints.
+    value = os.getenv("EMOTION_UPSTREAMS", "").strip()
+    if not value:
+        return []
+    if value.startswith("["):
+        return [EmotionUpstream(**item) for item in json.loads(value)]
+    return [EmotionUpstream(endpoint=endpoint.strip()) for endpoint in value.split(",") if endpoint.strip()]
 
 
-def _save_emotion_config(config: EmotionConfig) -> None:
+def _config_file_stamp() -> tuple[int, int, int] | None:
+    try:
+        stat = _config_path.stat()
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _save_emotion_config(config: EmotionConfig, fields: set[str]) -> None:
+    """Persist the given fields on top of the saved overrides.
+
+    Fields never set through the API are left out of the file, so their
+    EMOTION_*/VISION_* env defaults keep applying after a restart.
+    """
+    global _config_stamp
     _config_path.parent.mkdir(parents=True, exist_ok=True)
-    _config_path.write_text(config.model_dump_json(), encoding="utf-8")
+    text = json.dumps({**(_read_config_file() or {}), **config.model_dump(mode="json", include=fields)})
+    if _config_path.exists() and not _config_path.is_file():
+        # e.g. /dev/null to disable persistence; never replace it.
+        _config_path.write_text(text, encoding="utf-8")
+        return
+    # Write-then-rename so workers watching the file never read it half-written.
+    tmp = _config_path.with_name(f".{_config_path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, _config_path)
+    _config_stamp = _config_file_stamp()
+
+
+def _reload_emotion_config() -> set[str]:
+    """Apply config file changes made outside this process; returns the changed fields.
+
+    With several uvicorn workers, POST /emotion-config reaches one of them;
+    the others pick the change up from the file.
+    """
+    global _config_stamp
+    stamp = _config_file_stamp()
+    if stamp is None or stamp == _config_stamp:
+        return set()
+    _config_stamp = stamp
+    data = _read_config_file()
+    if data is None:
+        return set()
+    loaded = _load_emotion_config(data)
+    changed = {name for name in EmotionConfig.model_fields if getattr(loaded, name) != getattr(_emotion_config, name)}
+    for name in changed:
+        setattr(_emotion_config, name, getattr(loaded, name))
+    if changed:
+        _CONFIG_RELOADS.inc()
+    return changed
 
 
 _emotion_config = _load_emotion_config()
-_emotion_history = deque(maxlen=12)
-_face_cascade = cv2.CascadeClassifier(
-    cv2.data.haarcascades + "haarcascade_frontalface_default.xml",
-)
+_config_stamp = _config_file_stamp()
+# Seconds between checks of EMOTION_CONFIG_PATH for changes by other workers; 0 disables.
+_CONFIG_WATCH_INTERVAL = _env_float("EMOTION_CONFIG_WATCH_INTERVAL", 1.0)
+_HAAR_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
 
 
 DETAILED_EMOTIONS = {
@@ -98,12 +528,14 @@ def _normalize_emotion_detail(label: str) -> str:
         return "joy"
     if s in {"surprised", "surprise"}:
         return "excited"
-    if s in {"upset", "frown", "frowning", "depressed", "contempt"}:
+    if s in {"upset", "frown", "frowning", "depressed", "contempt", "sadness"}:
         return "sad"
     if s in {"anger", "mad"}:
         return "angry"
     if s in {"afraid", "fearful"}:
         return "fear"
+    if s in {"disgusted"}:
+        return "disgust"
     if s in {"frustration"}:
         return "frustrated"
     return "neutral"
@@ -117,19 +549,188 @@ def _emotion_bucket(detail: str) -> str:
     return "neutral"
 
 
-def _stabilize_emotion(detail: str) -> str:
-    _emotion_history.append(detail)
-    recent = list(_emotion_history)[-6:]
+EMOTION_LABELS = tuple(sorted(DETAILED_EMOTIONS))
+_EMOTION_CODES = {label: code for code, label in enumerate(EMOTION_LABELS)}
+
+# Per-stream state: each camera/browser gets its own session so smoothing
+# and caches never mix clients. Bounded by count and idle time.
+_SESSION_HISTORY = 12
+_SESSION_MAX = max(1, _env_int("VISION_SESSION_MAX", 1024))
+_SESSION_TTL = _env_float("VISION_SESSION_TTL", 300.0)
+_SESSION_BY_ADDRESS = _env_bool("VISION_SESSION_BY_ADDRESS", False)
+
+
+class StreamSession:
+    __slots__ = (
+        "key",
+        "history",
+        "history_len",
+        "history_pos",
+        "last_seen",
+        "tracks",
+        "next_track_id",
+        "last_thumbnail",
+        "last_response",
+        "last_response_at",
+        "last_boxes",
+        "frames_since_full_scan",
+        "scheduler",
+    )
+
+    def __init__(self, key: str = "") -> None:
+        self.key = key
+        # Ring buffer of emotion label codes, one byte per entry.
+        self.history = bytearray(_SESSION_HISTORY)
+        self.history_len = 0
+        self.history_pos = 0
+        self.last_seen = time.monotonic()
+        self.tracks: list[FaceTrack] = []
+        self.next_track_id = 1
+        # Thumbnail and response of the last fully processed frame.
+        self.last_thumbnail: bytes | None = None
+        self.last_response: dict | None = None
+        self.last_response_at = 0.0
+        # Face boxes of the previous detection pass, for ROI-restricted scans.
+        self.last_boxes: list[Box] = []
+        self.frames_since_full_scan = 0
+        self.scheduler = FrameScheduler()
+
+    def push_emotion(self, detail: str) -> None:
+        self.history[self.history_pos] = _EMOTION_CODES.get(detail, _EMOTION_CODES["neutral"])
+        self.history_pos = (self.history_pos + 1) % _SESSION_HISTORY
+        self.history_len = min(self.history_len + 1, _SESSION_HISTORY)
+
+    def recent_emotions(self, n: int) -> list[str]:
+        n = min(n, self.history_len)
+        start = self.history_pos - n
+        return [EMOTION_LABELS[self.history[(start + i) % _SESSION_HISTORY]] for i in range(n)]
+
+
+class SessionStore:
+    """LRU map of session id -> StreamSession with idle-time expiry."""
+
+    def __init__(self, max_sessions: int, ttl: float) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: OrderedDict[str, StreamSession] = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_expired(self, now: float) -> None:
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if self.ttl <= 0 or now - oldest.last_seen < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def get(self, session_id: str) -> StreamSession:
+        now = time.monotonic()
+        self._evict_expired(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = StreamSession(session_id)
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_seen = now
+        return session
+
+
+_sessions = SessionStore(_SESSION_MAX, _SESSION_TTL)
+
+
+class FrameScheduler:
+    """Latest-frame-wins runner for the requests of one stream.
+
+    At most one frame is processed at a time and at most one waits. A newer
+    request replaces the waiting frame; requests whose frame was replaced
+    are answered with the latest completed result (or, before any result
+    exists, with the result of the frame that replaced theirs), flagged as
+    superseded. The running frame is never cancelled, so its result stays
+    available for superseded requests.
+    """
+
+    __slots__ = ("runner", "pending", "last_result")
+
+    def __init__(self) -> None:
+        self.runner: asyncio.Task | None = None
+        # (job, [(future, superseded)]) of the frame waiting to run.
+        self.pending: tuple[object, list[tuple[asyncio.Future, bool]]] | None = None
+        self.last_result: dict | None = None
+
+    async def submit(self, job) -> dict:
+        """Run job (a no-argument coroutine function processing one frame) latest-frame-wins."""
+        future = asyncio.get_running_loop().create_future()
+        waiters: list[tuple[asyncio.Future, bool]] = []
+        if self.pending is not None:
+            _, older = self.pending
+            # Waiters carried forward from an earlier replacement were counted then.
+            _SUPERSEDED_REQUESTS.inc(sum(1 for _, superseded in older if not superseded))
+            for waiter, _ in older:
+                if self.last_result is not None:
+                    if not waiter.done():
+                        waiter.set_result({**self.last_result, "superseded": True})
+                else:
+                    waiters.append((waiter, True))
+        waiters.append((future, False))
+        self.pending = (job, waiters)
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self._drain())
+        return await future
+
+    async def _drain(self) -> None:
+        while self.pending is not None:
+            job, waiters = self.pending
+            self.pending = None
+            if all(waiter.done() for waiter, _ in waiters):
+                # Every client of this frame went away.
+                continue
+            try:
+                result = await job()
+            except Exception as exc:
+                for waiter, _ in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(exc)
+                continue
+            self.last_result = result
+            for waiter, superseded in waiters:
+                if not waiter.done():
+                    waiter.set_result({**result, "superseded": True} if superseded else result)
+
+
+def _stabilize_emotion(session: StreamSession, detail: str) -> str:
+    session.push_emotion(detail)
+    recent = session.recent_emotions(6)
     non_neutral = [e for e in recent if e != "neutral"]
     if detail == "neutral" and len(non_neutral) >= 2:
         return Counter(non_neutral).most_common(1)[0][0]
     return detail
 
 
-def _extract_emotion_detail_from_chat(data: dict) -> tuple[str, str]:
+_NON_ALPHA = re.compile(r"[^a-z]")
+# Keywords are single words, so one tokenizing pass plus dict lookups matches
+# exactly what a \bkeyword\b search per keyword would.
+_KEYWORD_EMOTIONS = {word: emotion for emotion, words in EMOTION_KEYWORDS.items() for word in words}
+_WORD_PATTERN = re.compile(r"\w+")
+_LABEL_PATTERN = re.compile(
+    r"\b(happy|joy|excited|smile|sad|angry|fear|disgust|frustrated|neutral|positive|negative)\b",
+    re.I,
+)
+_JSON_DECODER = json.JSONDecoder()
+_JSON_START = re.compile(r"\{")
+_JSON_START_ARRAYS = re.compile(r"[{\[]")
+
+
+def _chat_message_text(data: dict) -> str:
     choices = data.get("choices", [])
     if not choices:
-        return "neutral", ""
+        return ""
     message = choices[0].get("message", {})
     content = message.get("content", "")
     if isinstance(content, list):
@@ -138,59 +739,104 @@ def _extract_emotion_detail_from_chat(data: dict) -> tuple[str, str]:
             if isinstance(item, dict) and "text" in item:
                 parts.append(str(item["text"]))
         content = " ".join(parts)
-    text = str(content)
-    token = re.sub(r"[^a-z]", "", text.strip().lower())
+    return str(content)
+
+
+def _emotion_detail_from_text(text: str) -> str:
+    stripped = text.strip()
+    if stripped.startswith(("{", "[", "```")):
+        # Unparseable JSON (e.g. cut off by max_tokens) names every label as a key.
+        return "neutral"
+    token = _NON_ALPHA.sub("", stripped.lower())
     if token:
         normalized = _normalize_emotion_detail(token)
-        if normalized in DETAILED_EMOTIONS:
-            return normalized, text
-    text_l = text.lower()
-    scores = {k: 0 for k in DETAILED_EMOTIONS}
-    for emotion, words in EMOTION_KEYWORDS.items():
-        for word in words:
-            if re.search(rf"\b{re.escape(word)}\b", text_l):
-                scores[emotion] += 1
-    # Prefer explicit non-neutral signals over neutral when both appear.
-    non_neutral = {k: v for k, v in scores.items() if k != "neutral"}
-    best_non_neutral = max(non_neutral, key=non_neutral.get)
-    if non_neutral[best_non_neutral] > 0:
-        return best_non_neutral, text
-    if scores["neutral"] > 0:
-        return "neutral", text
-    match = re.search(
-        r"\b(happy|joy|excited|smile|sad|angry|fear|disgust|frustrated|neutral|positive|negative)\b",
-        text,
-        re.I,
-    )
+        # Unknown words normalize to neutral too; only a recognized one-word answer returns here.
+        if normalized != "neutral" or token == "neutral":
+            return normalized
+    # Each distinct keyword scores one point for its emotion.
+    scores: dict[str, int] = {}
+    for word in _KEYWORD_EMOTIONS.keys() & _WORD_PATTERN.findall(text.lower()):
+        emotion = _KEYWORD_EMOTIONS[word]
+        scores[emotion] = scores.get(emotion, 0) + 1
+    if scores:
+        # Prefer explicit non-neutral signals over neutral when both appear.
+        non_neutral = [emotion for emotion in EMOTION_KEYWORDS if emotion != "neutral" and emotion in scores]
+        return max(non_neutral, key=scores.__getitem__) if non_neutral else "neutral"
+    match = _LABEL_PATTERN.search(text)
     if not match:
-        return "neutral", text
-    return _normalize_emotion_detail(match.group(1)), text
+        return "neutral"
+    return _normalize_emotion_detail(match.group(1))
+
+
+def _extract_emotion_detail_from_chat(data: dict) -> tuple[str, str]:
+    text = _chat_message_text(data)
+    return _emotion_detail_from_text(text), text
+
+
+def _extract_json_payload(text: str, arrays: bool = False) -> dict | list | None:
+    """The first JSON object in a model answer, or also a bare array with arrays=True.
+
+    Only the batch prompt asks for an array; elsewhere a bracket in the
+    prose (e.g. "[1 face]") is skipped rather than parsed as the answer.
+    """
+    accepted = (dict, list) if arrays else dict
+    # Fast path: the prompts ask for strict JSON, which most answers are.
+    stripped = text.strip()
+    if stripped[:1] in ("{", "[") and stripped[-1:] in ("}", "]"):
+        try:
+            payload = json.loads(stripped)
+        except ValueError:
+            pass
+        else:
+            if isinstance(payload, accepted):
+                return payload
+    cleaned = stripped.replace("```json", "").replace("```", "").strip()
+    for match in (_JSON_START_ARRAYS if arrays else _JSON_START).finditer(cleaned):
+        try:
+            # Decodes one JSON value and ignores any prose after it.
+            payload, _ = _JSON_DECODER.raw_decode(cleaned, match.start())
+        except ValueError:
+            continue
+        if isinstance(payload, accepted):
+            return payload
+    return None
+
+
+def _face_emotions_from_payload(payload: dict | list | None) -> list[str]:
+    """Per-face labels from a `{"faces": [...]}` object or a bare array."""
+    faces = payload.get("faces") if isinstance(payload, dict) else payload
+    if not isinstance(faces, list):
+        return []
+    entries: list[tuple[int, str]] = []
+    for pos, item in enumerate(faces):
+        index = pos
+        if isinstance(item, dict):
+            label = item.get("emotion") or item.get("dominant_emotion") or item.get("label")
+            if isinstance(item.get("index"), int):
+                index = item["index"]
+        elif isinstance(item, str):
+            label = item
+        else:
+            # A stray number or list is not a face answer.
+            continue
+        if label is None:
+            continue
+        entries.append((index, _normalize_emotion_detail(str(label))))
+    entries.sort(key=lambda entry: entry[0])
+    return [label for _, label in entries]
+
+
+def _extract_face_emotions_from_text(text: str) -> list[str]:
+    return _face_emotions_from_payload(_extract_json_payload(text, arrays=True))
 
 
 def _extract_counts_from_text(text: str) -> dict[str, int]:
-    cleaned = text.replace("```json", "").replace("```", "").strip()
-    start = cleaned.find("{")
-    if start == -1:
-        return {}
-    depth = 0
-    end = -1
-    for idx, ch in enumerate(cleaned[start:], start=start):
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                end = idx
-                break
-    if end == -1 or end <= start:
+    payload = _extract_json_payload(text)
+    if payload is None:
         return {}
-    try:
-        payload = json.loads(cleaned[start : end + 1])
-    except Exception:
-        return {}
-    counts = payload.get("emotion_counts")
+    counts = payload.get("emotion_counts") if isinstance(payload, dict) else None
     if not isinstance(counts, dict):
-        return {}
+        return dict(Counter(_face_emotions_from_payload(payload)))
     normalized: dict[str, int] = {}
     for k, v in counts.items():
         emotion = _normalize_emotion_detail(str(k))
@@ -215,201 +861,2666 @@ def _dominant_from_counts(counts: dict[str, int]) -> str:
     return sorted(counts.items(), key=lambda x: x[1], reverse=True)[0][0]
 
 
-async def analyze_face_sentiment(
-    frame_bytes: bytes,
-) -> tuple[str, str, str | None, str | None, dict[str, int] | None]:
-    if not _emotion_config.endpoint:
-        # Stub mode: neutral by default.
-        return "neutral", "stub", None, None, None
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+# Replaced clients waiting to be closed, by the task that closes them.
+_retiring_clients: dict[asyncio.Task, httpx.AsyncClient] = {}
 
-    headers = {"Authorization": f"Bearer {_emotion_config.token}"} if _emotion_config.token else {}
+
+def _emotion_verify_tls(config: EmotionConfig, endpoint: str) -> bool:
     # Temporary compatibility for private endpoints with non-public CA chains.
-    verify_tls = not _emotion_config.endpoint.endswith(".pcaidev.ai.greendatacenter.com/v1/chat/completions")
+    if endpoint.endswith(".pcaidev.ai.greendatacenter.com/v1/chat/completions"):
+        return False
+    return config.verify_tls
+
+
+def _emotion_client_settings(config: EmotionConfig, endpoint: str) -> tuple:
+    return (
+        _emotion_verify_tls(config, endpoint),
+        config.http2 and _HTTP2_AVAILABLE,
+        config.connect_timeout,
+        config.read_timeout,
+        config.max_connections,
+        config.max_keepalive_connections,
+        config.keepalive_expiry,
+    )
+
+
+def _build_emotion_client(config: EmotionConfig, endpoint: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=config.http2 and _HTTP2_AVAILABLE,
+        verify=_emotion_verify_tls(config, endpoint),
+        timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+    )
+
+
+async def _close_client_later(client: httpx.AsyncClient, delay: float) -> None:
+    # Let requests already in flight on the old pool finish before closing it.
+    await asyncio.sleep(delay)
+    await client.aclose()
+
+
+def _retire_client(client: httpx.AsyncClient, config: EmotionConfig) -> None:
     try:
-        async with httpx.AsyncClient(timeout=10, verify=verify_tls) as client:
-            if "/v1/chat/completions" in _emotion_config.endpoint:
-                image_b64 = base64.b64encode(frame_bytes).decode("ascii")
-                req_headers = {**headers, "Content-Type": "application/json"}
-                payload = {
-                    "model": _emotion_config.model,
-                    "temperature": 0.2,
-                    "max_tokens": 220,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": (
-                                "Analyze all visible human faces in the image. "
-                                "Return strict JSON only with this schema: "
-                                "{\"emotion_counts\":{\"neutral\":0,\"happy\":0,\"joy\":0,\"excited\":0,\"smile\":0,"
-                                "\"sad\":0,\"angry\":0,\"fear\":0,\"disgust\":0,\"frustrated\":0},"
-                                "\"dominant_emotion\":\"neutral\"}. "
-                                "Use only these emotion labels as keys. "
-                                "Counts must be non-negative integers. "
-                                "dominant_emotion must be one of those labels. "
-                                "If at least one face is visible, the sum of emotion_counts must be >= 1. "
-                                "Do not return all-zero counts when a face is visible. "
-                                "Do not wrap JSON in markdown, code fences, or prose."
-                            ),
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": "Count face emotions in this image and provide JSON only."},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}},
-                            ],
-                        },
-                    ],
-                }
-                resp = await client.post(_emotion_config.endpoint, headers=req_headers, json=payload)
-                if resp.status_code >= 400:
-                    return "neutral", "fallback", f"HTTP {resp.status_code}: {resp.text[:500]}", None, None
-                data = resp.json()
-                detail, raw_text = _extract_emotion_detail_from_chat(data)
-                counts = _extract_counts_from_text(raw_text)
-                if counts:
-                    detail = _dominant_from_counts(counts)
-                detail = _stabilize_emotion(detail)
-                return detail, "nim-chat", None, raw_text, counts if counts else None
-
-            files = {"frame": ("frame.jpg", frame_bytes, "image/jpeg")}
-            data = {"model": _emotion_config.model} if _emotion_config.model else None
-            resp = await client.post(_emotion_config.endpoint, headers=headers, files=files, data=data)
-            if resp.status_code >= 400:
-                return "neutral", "fallback", f"HTTP {resp.status_code}: {resp.text[:500]}", None, None
-            data = resp.json()
-            sentiment = data.get("sentiment") or data.get("emotion") or "neutral"
-            detail = _normalize_emotion_detail(str(sentiment))
-            detail = _stabilize_emotion(detail)
-            return detail, "external", None, str(sentiment), None
-    except Exception as exc:
-        return "neutral", "fallback", str(exc), None, None
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # No loop yet (startup): nothing can be in flight on it.
+        return
+    task = loop.create_task(_close_client_later(client, config.connect_timeout + config.read_timeout))
+    _retiring_clients[task] = client
+    task.add_done_callback(lambda done: _retiring_clients.pop(done, None))
 
 
-@app.post("/vision")
-async def vision(frame: UploadFile = File(...)):
-    data = await frame.read()
-    face_count = 0
-    emotion_counts: dict[str, int] = {}
-    sentiment_source = "nim-chat"
-    sentiment_error = None
-    emotion_raw = None
-    detected_faces = 0
-    analyzed_faces = 0
-    counts_source = "none"
+# Successful calls needed before latency percentiles drive timeouts and hedging.
+_LATENCY_MIN_SAMPLES = 20
+_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling when every emotion upstream is ejected."""
+
+
+class LatencyWindow:
+    """Latencies (s) of the last successful calls, for percentile estimates."""
+
+    __slots__ = ("samples", "pos", "count", "_sorted")
+
+    def __init__(self, size: int = 256) -> None:
+        self.samples = [0.0] * size
+        self.pos = 0
+        self.count = 0
+        self._sorted: list[float] | None = None
+
+    def add(self, seconds: float) -> None:
+        self.samples[self.pos] = seconds
+        self.pos = (self.pos + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+        self._sorted = None
+
+    def percentile(self, pct: float) -> float | None:
+        if self.count < _LATENCY_MIN_SAMPLES:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.samples[: self.count])
+        return self._sorted[min(self.count - 1, int(pct / 100 * self.count))]
+
+
+class Upstream:
+    """One emotion endpoint: its HTTP client, latency windows, circuit breaker and load.
 
-    np_img = np.frombuffer(data, dtype=np.uint8)
-    img = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-    if img is not None and not _face_cascade.empty():
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = _face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(48, 48),
+    The breaker doubles as passive health checking: an upstream that fails
+    breaker_failures times in a row is ejected from routing for the cool-down.
+    """
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self.chat = "/v1/chat/completions" in endpoint
+        self.token = ""
+        self.model = ""
+        self.weight = 1.0
+        self.max_concurrency = 0
+        self.slots: asyncio.Semaphore | None = None
+        self.client: httpx.AsyncClient | None = None
+        self.client_key: tuple | None = None
+        # Calls routed here that have not finished, including those waiting for a slot.
+        self.outstanding = 0
+        # "single" (one crop) and "batch" (multi-image) calls differ in latency.
+        self.latency = {"single": LatencyWindow(), "batch": LatencyWindow()}
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = 0
+
+    def configure(self, config: EmotionConfig, spec: EmotionUpstream) -> None:
+        self.token = spec.token.strip() or config.token
+        self.model = spec.model.strip() or config.model
+        self.weight = spec.weight
+        limit = spec.max_concurrency or config.upstream_max_concurrency
+        if limit != self.max_concurrency:
+            self.max_concurrency = limit
+            self.slots = asyncio.Semaphore(limit) if limit > 0 else None
+        key = _emotion_client_settings(config, self.endpoint)
+        if self.client is None or key != self.client_key:
+            if self.client is not None:
+                _retire_client(self.client, config)
+            self.client = _build_emotion_client(config, self.endpoint)
+            self.client_key = key
+
+    def saturated(self) -> bool:
+        return 0 < self.max_concurrency <= self.outstanding
+
+    def load(self) -> float:
+        if self.saturated():
+            # Only compared among saturated upstreams: queued calls per slot.
+            return (self.outstanding + 1) / self.max_concurrency
+        return (self.outstanding + 1) / self.weight
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        _BREAKER_TRANSITIONS.inc(state=state)
+        if state == "open":
+            self.opened_at = time.monotonic()
+
+    def is_open(self, config: EmotionConfig) -> bool:
+        return (
+            config.breaker
+            and self.state == "open"
+            and time.monotonic() - self.opened_at < config.breaker_cooldown
         )
-        face_count = len(faces)
-        detected_faces = face_count
 
-        if face_count > 0:
-            # Limit per-frame model calls for latency and cost.
-            cropped_blobs: list[bytes] = []
-            for (x, y, w, h) in faces[:4]:
-                face_crop = img[y : y + h, x : x + w]
-                ok, enc = cv2.imencode(".jpg", face_crop)
-                if ok:
-                    cropped_blobs.append(enc.tobytes())
-            analyzed_faces = len(cropped_blobs)
+    def current_state(self, config: EmotionConfig) -> str:
+        # An open breaker past its cool-down admits the next call as a probe.
+        if self.state == "open" and not self.is_open(config):
+            return "half_open"
+        return self.state
 
-            results = []
-            for crop_bytes in cropped_blobs:
-                results.append(await analyze_face_sentiment(crop_bytes))
+    def admissible(self, config: EmotionConfig) -> bool:
+        if not config.breaker or self.state == "closed":
+            return True
+        return not self.is_open(config) and not self.probe_in_flight
 
-            raw_chunks = []
-            for detail, source, err, raw, counts in results:
-                sentiment_source = source
-                if err and not sentiment_error:
-                    sentiment_error = err
-                if raw:
-                    raw_chunks.append(raw)
-                if _has_nonzero_counts(counts):
-                    for k, v in counts.items():
-                        emotion_counts[k] = emotion_counts.get(k, 0) + v
-                    counts_source = "model-per-face"
-                else:
-                    emotion_counts[detail] = emotion_counts.get(detail, 0) + 1
-                    if counts_source == "none":
-                        counts_source = "fallback-per-face"
+    def admit(self, config: EmotionConfig) -> bool:
+        """Count a call routed here; after the cool-down it is the single probe, and True is returned."""
+        if config.breaker and self.state == "open":
+            self._transition("half_open")
+        probe = config.breaker and self.state == "half_open"
+        if probe:
+            self.probe_in_flight = True
+        self.calls += 1
+        return probe
 
-            if raw_chunks:
-                emotion_raw = " | ".join(raw_chunks[:4])
+    def finish(
+        self, config: EmotionConfig, kind: str, ok: bool | None, seconds: float | None = None, probe: bool = False
+    ) -> None:
+        """Record a call outcome (None: cancelled before an answer) and its latency.
 
-    if face_count == 0:
-        # Fallback to whole-frame classification when no face box is found.
-        emotion_detail, sentiment_source, sentiment_error, emotion_raw, frame_counts = await analyze_face_sentiment(data)
-        if _has_nonzero_counts(frame_counts):
-            emotion_counts = frame_counts or {}
-            face_count = max(1, sum(emotion_counts.values()))
-            counts_source = "model-full-frame"
-        else:
-            face_count = max(1, face_count)
-            emotion_counts = {emotion_detail: face_count}
-            counts_source = "fallback-full-frame"
+        Only the probe moves a half-open breaker; calls admitted before the
+        breaker opened can still finish during the cool-down or the probe and
+        are ignored by it.
+        """
+        if probe:
+            self.probe_in_flight = False
+        if seconds is not None:
+            self.latency[kind].add(seconds)
+        if ok is None:
+            return
+        if probe:
+            self.failures = 0 if ok else self.failures + 1
+            self._transition("closed" if ok else "open")
+            return
+        if self.state != "closed":
+            return
+        if ok:
+            self.failures = 0
+            return
+        self.failures += 1
+        if config.breaker and self.failures >= config.breaker_failures:
+            self._transition("open")
 
-    dominant_detail = _dominant_from_counts(emotion_counts) if emotion_counts else "neutral"
-    return {
-        "face_count": face_count,
-        "bytes": len(data),
-        "sentiment": _emotion_bucket(dominant_detail),
-        "emotion_detail": dominant_detail,
-        "emotion_counts": emotion_counts,
-        "emotion_raw": emotion_raw,
-        "sentiment_source": sentiment_source,
-        "sentiment_error": sentiment_error,
-        "debug": {
-            "detected_faces": detected_faces,
-            "analyzed_faces": analyzed_faces,
-            "counts_source": counts_source,
-        },
-    }
+    def timeout(self, config: EmotionConfig, kind: str) -> float:
+        if not config.adaptive_timeout:
+            return config.read_timeout
+        observed = self.latency[kind].percentile(config.adaptive_timeout_percentile)
+        if observed is None:
+            return config.read_timeout
+        return min(config.read_timeout, max(config.adaptive_timeout_min, observed * config.adaptive_timeout_multiplier))
 
+    def snapshot(self, config: EmotionConfig) -> dict:
+        latency = self.latency["single"]
+        return {
+            "endpoint": self.endpoint,
+            "model": self.model,
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "outstanding": self.outstanding,
+            "calls": self.calls,
+            "state": self.current_state(config),
+            "consecutive_failures": self.failures,
+            "open_for_seconds": (
+                round(config.breaker_cooldown - (time.monotonic() - self.opened_at), 3) if self.is_open(config) else 0.0
+            ),
+            "timeout_seconds": {kind: self.timeout(config, kind) for kind in self.latency},
+            "latency_ms": {
+                f"p{pct}": (round(value * 1000, 3) if (value := latency.percentile(pct)) is not None else None)
+                for pct in (50, 95, 99)
+            },
+        }
 
-class SentimentRequest(BaseModel):
-    text: str
 
+# Upstreams by endpoint; _upstream_pool is the routed set of the current config.
+_upstreams: dict[str, Upstream] = {}
+_upstream_pool: list[Upstream] = []
+_upstream_pool_key: tuple | None = None
+_hedges_sent = 0
 
-def analyze_sentiment(text: str) -> str:
-    # Simple heuristic for demo use; replace with real model as needed.
-    positive = {"good", "great", "excellent", "love", "happy", "awesome", "fantastic", "positive"}
-    negative = {"bad", "terrible", "awful", "hate", "sad", "angry", "negative", "horrible"}
-    tokens = {t.strip(".,!?;:").lower() for t in text.split()}
-    score = len(tokens & positive) - len(tokens & negative)
-    if score > 0:
-        return "positive"
-    if score < 0:
-        return "negative"
-    return "neutral"
 
+def _upstream_specs(config: EmotionConfig) -> list[EmotionUpstream]:
+    if config.upstreams:
+        return [spec for spec in config.upstreams if spec.endpoint.strip() and spec.weight > 0]
+    return [EmotionUpstream(endpoint=config.endpoint)] if config.endpoint else []
 
-@app.post("/sentiment")
-async def sentiment(payload: SentimentRequest):
-    label = analyze_sentiment(payload.text)
-    return {"sentiment": label}
 
+def _emotion_upstreams() -> list[Upstream]:
+    """Routed upstreams of the current config, re-synced when the config changed."""
+    global _upstream_pool, _upstream_pool_key
+    config = _emotion_config
+    key = (
+        tuple((spec.endpoint, spec.token, spec.model, spec.weight, spec.max_concurrency) for spec in config.upstreams),
+        config.endpoint,
+        config.token,
+        config.model,
+        config.upstream_max_concurrency,
+        config.verify_tls,
+        config.http2,
+        config.connect_timeout,
+        config.read_timeout,
+        config.max_connections,
+        config.max_keepalive_connections,
+        config.keepalive_expiry,
+    )
+    if key == _upstream_pool_key:
+        return _upstream_pool
+    pool = []
+    for spec in _upstream_specs(config):
+        endpoint = spec.endpoint.strip()
+        upstream = _upstreams.get(endpoint)
+        if upstream is None:
+            upstream = _upstreams[endpoint] = Upstream(endpoint)
+        upstream.configure(config, spec)
+        if upstream not in pool:
+            pool.append(upstream)
+    for endpoint in [endpoint for endpoint, upstream in _upstreams.items() if upstream not in pool]:
+        _retire_client(_upstreams.pop(endpoint).client, config)
+    _upstream_pool, _upstream_pool_key = pool, key
+    return pool
 
-@app.get("/health")
-async def health():
-    return {"status": "ok"}
 
+def _upstreams_identity() -> tuple:
+    """What answers depend on: result caches are keyed by it."""
+    return tuple((upstream.endpoint, upstream.model) for upstream in _emotion_upstreams())
 
-@app.get("/emotion-config")
-async def get_emotion_config():
-    return _emotion_config
 
+def _acquire_upstream(eligible=None) -> tuple[Upstream, bool]:
+    """Route a call to an admissible upstream by lb_policy, weighted by upstream weight.
 
-@app.post("/emotion-config")
-async def set_emotion_config(payload: EmotionConfig):
-    _emotion_config.endpoint = payload.endpoint.strip()
-    _emotion_config.token = payload.token.strip()
-    _emotion_config.model = payload.model.strip()
-    _save_emotion_config(_emotion_config)
-    return _emotion_config
+    Also returns whether the call is the upstream's half-open probe, which
+    _post_emotion hands back to Upstream.finish.
+    """
+    config = _emotion_config
+    candidates = [
+        upstream
+        for upstream in _emotion_upstreams()
+        if (eligible is None or eligible(upstream)) and upstream.admissible(config)
+    ]
+    if not candidates:
+        _BREAKER_REJECTED.inc()
+        raise CircuitOpenError("Emotion endpoint circuit open: every upstream is ejected")
+    # Upstreams at their concurrency limit only take calls when all of them are.
+    candidates = [upstream for upstream in candidates if not upstream.saturated()] or candidates
+    if config.lb_policy == "p2c" and len(candidates) > 2:
+        # Power of two choices: two weighted random picks, the less loaded wins.
+        chosen = min(random.choices(candidates, weights=[u.weight for u in candidates], k=2), key=Upstream.load)
+    else:
+        lowest = min(upstream.load() for upstream in candidates)
+        chosen = random.choice([upstream for upstream in candidates if upstream.load() == lowest])
+    return chosen, chosen.admit(config)
+
+
+def _upstreams_down() -> bool:
+    config = _emotion_config
+    pool = _emotion_upstreams()
+    return bool(pool) and not any(upstream.admissible(config) for upstream in pool)
+
+
+async def _post_emotion(upstream: Upstream, kind: str, probe: bool = False, **kwargs) -> httpx.Response:
+    """POST to an acquired upstream within its concurrency limit and adaptive timeout."""
+    config = _emotion_config
+    timeout = httpx.Timeout(upstream.timeout(config, kind), connect=config.connect_timeout)
+    upstream.outstanding += 1
+    ok: bool | None = None
+    seconds = None
+    try:
+        async with upstream.slots or nullcontext():
+            started = time.perf_counter()
+            try:
+                resp = await upstream.client.post(upstream.endpoint, timeout=timeout, **kwargs)
+            except httpx.HTTPError:
+                ok = False
+                raise
+            ok = resp.status_code < 500 and resp.status_code != 429
+            if resp.status_code < 400:
+                # Only successful answers shape the timeout and hedge percentiles.
+                seconds = time.perf_counter() - started
+            return resp
+    finally:
+        upstream.outstanding -= 1
+        upstream.finish(config, kind, ok, seconds, probe)
+
+
+def _hedge_delay() -> float | None:
+    config = _emotion_config
+    if not config.hedge:
+        return None
+    delays = [
+        delay
+        for upstream in _emotion_upstreams()
+        if upstream.state == "closed" and (delay := upstream.latency["single"].percentile(config.hedge_percentile)) is not None
+    ]
+    return min(delays) if delays else None
+
+
+def _take_hedge() -> bool:
+    global _hedges_sent
+    calls = sum(upstream.calls for upstream in _emotion_upstreams())
+    if _hedges_sent >= _emotion_config.hedge_budget * calls:
+        return False
+    _hedges_sent += 1
+    return True
+
+
+async def _close_emotion_client() -> None:
+    global _upstream_pool, _upstream_pool_key
+    # Skip the in-flight grace period of replaced clients, but still close them.
+    retiring = dict(_retiring_clients)
+    for task in retiring:
+        task.cancel()
+    await asyncio.gather(*retiring, return_exceptions=True)
+    for client in retiring.values():
+        await client.aclose()
+    for upstream in _upstreams.values():
+        if upstream.client is not None:
+            await upstream.client.aclose()
+    _upstreams.clear()
+    _upstream_pool, _upstream_pool_key = [], None
+
+
+class RequestTrace:
+    """Timing spans of one frame, plus W3C trace context for outbound calls.
+
+    Only created when a request opts into timing or carries a traceparent
+    header; otherwise _current_trace stays None and nothing is recorded.
+    """
+
+    __slots__ = ("trace_id", "parent_span_id", "flags", "span_id", "report", "started", "stages", "spans")
+
+    def __init__(self, traceparent: str = "", report: bool = True) -> None:
+        parts = traceparent.strip().lower().split("-")
+        valid = (
+            len(parts) == 4
+            and len(parts[1]) == 32
+            and len(parts[2]) == 16
+            and len(parts[3]) == 2
+            and all(c in "0123456789abcdef" for c in parts[1] + parts[2] + parts[3])
+            and parts[1] != "0" * 32
+            and parts[2] != "0" * 16
+        )
+        self.trace_id = parts[1] if valid else secrets.token_hex(16)
+        self.parent_span_id = parts[2] if valid else None
+        self.flags = parts[3] if valid else "00"
+        self.span_id = secrets.token_hex(8)
+        # Whether the timing block is added to the response.
+        self.report = report
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.spans: list[dict] = []
+
+    def new_span_id(self) -> str:
+        return secrets.token_hex(8)
+
+    def traceparent(self, span_id: str) -> str:
+        """Outbound header for one emotion call.
+
+        Nothing exports this service's spans, so a continued trace keeps the
+        caller's span as parent and the caller's sampling decision. A trace
+        started here goes out unsampled, with the call's own span id.
+        """
+        if self.parent_span_id is not None:
+            return f"00-{self.trace_id}-{self.parent_span_id}-{self.flags}"
+        return f"00-{self.trace_id}-{span_id}-00"
+
+    def add_span(self, name: str, started: float, ended: float, span_id: str | None = None, **attrs: object) -> None:
+        self.spans.append(
+            {
+                "name": name,
+                "span_id": span_id or self.new_span_id(),
+                "parent_span_id": self.span_id,
+                "start_ms": round((started - self.started) * 1000, 3),
+                "duration_ms": round((ended - started) * 1000, 3),
+                **attrs,
+            }
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "faces": [
+                {"sentiment_source": span["sentiment_source"], "ms": span["duration_ms"]}
+                for span in self.spans
+                if span["name"] == "emotion_call"
+            ],
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[RequestTrace | None] = ContextVar("vision_trace", default=None)
+
+
+# (emotion_detail, sentiment_source, error, raw_text, emotion_counts)
+SentimentResult = tuple[str, str, str | None, str | None, dict[str, int] | None]
+
+
+COUNTS_SYSTEM_PROMPT = (
+    "Analyze all visible human faces in the image. "
+    "Return strict JSON only with this schema: "
+    "{\"emotion_counts\":{\"neutral\":0,\"happy\":0,\"joy\":0,\"excited\":0,\"smile\":0,"
+    "\"sad\":0,\"angry\":0,\"fear\":0,\"disgust\":0,\"frustrated\":0},"
+    "\"dominant_emotion\":\"neutral\"}. "
+    "Use only these emotion labels as keys. "
+    "Counts must be non-negative integers. "
+    "dominant_emotion must be one of those labels. "
+    "If at least one face is visible, the sum of emotion_counts must be >= 1. "
+    "Do not return all-zero counts when a face is visible. "
+    "Do not wrap JSON in markdown, code fences, or prose."
+)
+
+BATCH_SYSTEM_PROMPT = (
+    "You receive several images, each showing one human face, in order. "
+    "Classify the facial emotion of every image. "
+    "Return strict JSON only with this schema: "
+    "{\"faces\":[{\"index\":0,\"emotion\":\"neutral\"}]} "
+    "with exactly one entry per image, in image order, index starting at 0. "
+    "emotion must be one of: neutral, happy, joy, excited, smile, sad, angry, fear, disgust, frustrated. "
+    "Do not wrap JSON in markdown, code fences, or prose."
+)
+
+# Endpoint/model pairs whose multi-image requests were rejected (400/422), as
+# (rejections in a row, time of the last one). After _BATCH_REJECT_LIMIT of
+# them the pair gets per-crop calls for _BATCH_REJECT_PAUSE seconds; the next
+# batch call then tries again, and a success clears the record.
+_BATCH_REJECT_LIMIT = 3
+_BATCH_REJECT_PAUSE = 300.0
+_batch_rejections: dict[tuple[str, str], tuple[int, float]] = {}
+
+
+def _image_format(image_bytes: bytes) -> str:
+    # Crops are JPEG or WebP (crop_format); client uploads may also be PNG.
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "webp"
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    return "jpeg"
+
+
+def _chat_body(model: str, system_prompt: str, user_text: str, images: list[bytes], max_tokens: int) -> bytes:
+    """The chat completion request as JSON bytes.
+
+    Base64 never needs JSON escaping, so each image is encoded straight into
+    the body: one base64 buffer per image and one join, instead of a str
+    copy, a json.dumps copy and an encode copy per request.
+    """
+    parts = [
+        b'{"model":',
+        json.dumps(model).encode(),
+        b',"temperature":0.2,"max_tokens":',
+        str(int(max_tokens)).encode(),
+        b',"messages":[{"role":"system","content":',
+        json.dumps(system_prompt).encode(),
+        b'},{"role":"user","content":[{"type":"text","text":',
+        json.dumps(user_text).encode(),
+        b"}",
+    ]
+    for image in images:
+        parts += (
+            b',{"type":"image_url","image_url":{"url":"data:image/',
+            _image_format(image).encode(),
+            b";base64,",
+            base64.b64encode(image),
+            b'"}}',
+        )
+    parts.append(b"]}]}")
+    return b"".join(parts)
+
+
+def _emotion_headers(token: str, span_id: str | None = None) -> dict[str, str]:
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    trace = _current_trace.get()
+    if trace is not None and span_id is not None:
+        headers["traceparent"] = trace.traceparent(span_id)
+    return headers
+
+
+def _batch_capable(upstream: Upstream) -> bool:
+    if not upstream.chat:
+        return False
+    count, last = _batch_rejections.get((upstream.endpoint, upstream.model), (0, 0.0))
+    return count < _BATCH_REJECT_LIMIT or time.monotonic() - last >= _BATCH_REJECT_PAUSE
+
+
+def _record_batch_rejection(upstream: Upstream) -> None:
+    key = (upstream.endpoint, upstream.model)
+    count, _ = _batch_rejections.get(key, (0, 0.0))
+    _batch_rejections[key] = (count + 1, time.monotonic())
+
+
+def _batch_enabled() -> bool:
+    return _emotion_config.batch_faces and any(_batch_capable(upstream) for upstream in _emotion_upstreams())
+
+
+async def analyze_faces_batch(crops: list[bytes]) -> list[SentimentResult] | None:
+    """Classify all face crops of a frame with one multi-image chat completion.
+
+    Returns None when the endpoint rejects multi-image input or answers with a
+    face list that does not line up with the crops, so the caller can fall
+    back to per-crop calls. A batch too large for the endpoint (413) is split
+    in halves instead.
+    """
+    trace = _current_trace.get()
+    span_id = trace.new_span_id() if trace is not None else None
+    started = time.perf_counter()
+    try:
+        upstream, probe = _acquire_upstream(_batch_capable)
+        body = _chat_body(
+            upstream.model,
+            BATCH_SYSTEM_PROMPT,
+            f"Classify the facial emotion in each of these {len(crops)} images and provide JSON only.",
+            crops,
+            max_tokens=40 + 24 * len(crops),
+        )
+        resp = await _post_emotion(
+            upstream,
+            "batch",
+            probe,
+            headers={**_emotion_headers(upstream.token, span_id), "Content-Type": "application/json"},
+            content=body,
+        )
+        ended = time.perf_counter()
+        _UPSTREAM_RESPONSES.inc(status=resp.status_code)
+        # Labelled like analyze_face_sentiment: error statuses yield fallback results.
+        source = "nim-chat" if resp.status_code < 400 else "fallback"
+        _EMOTION_CALL_SECONDS.observe(ended - started, sentiment_source=source)
+        if trace is not None:
+            trace.add_span("emotion_call", started, ended, span_id, sentiment_source=source, faces=len(crops))
+        if resp.status_code == 413:
+            return await _split_faces_batch(crops) if len(crops) > 1 else None
+        if resp.status_code in {400, 422}:
+            _record_batch_rejection(upstream)
+            return None
+        if resp.status_code >= 400:
+            error = f"HTTP {resp.status_code}: {resp.text[:500]}"
+            return [("neutral", "fallback", error, None, None) for _ in crops]
+        raw_text = _chat_message_text(resp.json())
+    except httpx.HTTPError as exc:
+        ended = time.perf_counter()
+        _UPSTREAM_RESPONSES.inc(status="error")
+        _EMOTION_CALL_SECONDS.observe(ended - started, sentiment_source="fallback")
+        if trace is not None:
+            trace.add_span("emotion_call", started, ended, span_id, sentiment_source="fallback", faces=len(crops))
+        # Timeouts stringify to an empty message.
+        return [("neutral", "fallback", str(exc) or type(exc).__name__, None, None) for _ in crops]
+    except Exception as exc:
+        return [("neutral", "fallback", str(exc), None, None) for _ in crops]
+    _batch_rejections.pop((upstream.endpoint, upstream.model), None)
+    labels = _extract_face_emotions_from_text(raw_text)
+    if len(labels) != len(crops):
+        return None
+    # The raw model text is attached to the first face only to avoid repeating it.
+    return [
+        (label, "nim-chat", None, raw_text if idx == 0 else None, {label: 1})
+        for idx, label in enumerate(labels)
+    ]
+
+
+async def _split_faces_batch(crops: list[bytes]) -> list[SentimentResult]:
+    """Classify a batch the endpoint found too large as two halves; a half it cannot batch goes per crop."""
+    half = len(crops) // 2
+    parts = [crops[:half], crops[half:]]
+    results = await asyncio.gather(*(analyze_faces_batch(part) for part in parts))
+    out: list[SentimentResult] = []
+    for part, result in zip(parts, results):
+        if result is None:
+            result = await asyncio.gather(*(analyze_face_sentiment(crop) for crop in part))
+        out.extend(result)
+    return out
+
+
+async def analyze_face_sentiment(frame_bytes: bytes) -> SentimentResult:
+    trace = _current_trace.get()
+    span_id = trace.new_span_id() if trace is not None else None
+    started = time.perf_counter()
+    result = await _hedged_face_sentiment(frame_bytes, span_id)
+    ended = time.perf_counter()
+    _EMOTION_CALL_SECONDS.observe(ended - started, sentiment_source=result[1])
+    if trace is not None:
+        trace.add_span("emotion_call", started, ended, span_id, sentiment_source=result[1])
+    return result
+
+
+async def _hedged_face_sentiment(frame_bytes: bytes, span_id: str | None) -> SentimentResult:
+    """Send a duplicate call when the first is slower than the hedge delay; first answer wins."""
+    delay = _hedge_delay()
+    if delay is None:
+        return await _request_face_sentiment(frame_bytes, span_id)
+    tasks = [asyncio.create_task(_request_face_sentiment(frame_bytes, span_id))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not _take_hedge():
+            return await tasks[0]
+        trace = _current_trace.get()
+        tasks.append(asyncio.create_task(_request_face_sentiment(frame_bytes, trace.new_span_id() if trace else None)))
+        pending = set(tasks)
+        result: SentimentResult | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result[1] != "fallback":
+                    _HEDGED_REQUESTS.inc(winner="hedge" if task is tasks[1] else "primary")
+                    return result
+        _HEDGED_REQUESTS.inc(winner="none")
+        return result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _request_face_sentiment(frame_bytes: bytes, span_id: str | None = None) -> SentimentResult:
+    if not _emotion_upstreams():
+        # Stub mode: neutral by default.
+        return "neutral", "stub", None, None, None
+
+    try:
+        upstream, probe = _acquire_upstream()
+        headers = _emotion_headers(upstream.token, span_id)
+        if upstream.chat:
+            req_headers = {**headers, "Content-Type": "application/json"}
+            body = _chat_body(
+                upstream.model,
+                COUNTS_SYSTEM_PROMPT,
+                "Count face emotions in this image and provide JSON only.",
+                [frame_bytes],
+                max_tokens=220,
+            )
+            resp = await _post_emotion(upstream, "single", probe, headers=req_headers, content=body)
+            _UPSTREAM_RESPONSES.inc(status=resp.status_code)
+            if resp.status_code >= 400:
+                return "neutral", "fallback", f"HTTP {resp.status_code}: {resp.text[:500]}", None, None
+            raw_text = _chat_message_text(resp.json())
+            counts = _extract_counts_from_text(raw_text)
+            # The keyword scan is only needed when the answer carries no counts.
+            detail = _dominant_from_counts(counts) if counts else _emotion_detail_from_text(raw_text)
+            return detail, "nim-chat", None, raw_text, counts if counts else None
+
+        image_format = _image_format(frame_bytes)
+        files = {"frame": (f"frame.{image_format}", frame_bytes, f"image/{image_format}")}
+        data = {"model": upstream.model} if upstream.model else None
+        resp = await _post_emotion(upstream, "single", probe, headers=headers, files=files, data=data)
+        _UPSTREAM_RESPONSES.inc(status=resp.status_code)
+        if resp.status_code >= 400:
+            return "neutral", "fallback", f"HTTP {resp.status_code}: {resp.text[:500]}", None, None
+        data = resp.json()
+        sentiment = data.get("sentiment") or data.get("emotion") or "neutral"
+        detail = _normalize_emotion_detail(str(sentiment))
+        return detail, "external", None, str(sentiment), None
+    except httpx.HTTPError as exc:
+        _UPSTREAM_RESPONSES.inc(status="error")
+        return "neutral", "fallback", str(exc) or type(exc).__name__, None, None
+    except Exception as exc:
+        return "neutral", "fallback", str(exc), None, None
+
+
+# Band layout of the 64-bit hash index: two hashes within 3 bits of each
+# other share at least one exact 16-bit band (pigeonhole).
+_HASH_BANDS = 4
+_HASH_BAND_BITS = 16
+# Rough per-entry bookkeeping cost added to the size of the cached result.
+_CACHE_ENTRY_OVERHEAD = 256
+
+
+class ResultCache:
+    """Byte-bounded LRU of emotion results keyed by (endpoint identity, dHash)."""
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[tuple[tuple[str, str], int], tuple[SentimentResult, float, int]] = OrderedDict()
+        self._bands: dict[tuple[tuple[str, str], int, int], set[int]] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, identity: tuple[str, str], phash: int):
+        mask = (1 << _HASH_BAND_BITS) - 1
+        for band in range(_HASH_BANDS):
+            yield identity, band, (phash >> (band * _HASH_BAND_BITS)) & mask
+
+    def _remove(self, key: tuple[tuple[str, str], int]) -> None:
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+        identity, phash = key
+        for band_key in self._band_keys(identity, phash):
+            members = self._bands.get(band_key)
+            if members is not None:
+                members.discard(phash)
+                if not members:
+                    del self._bands[band_key]
+
+    def get(self, identity: tuple[str, str], phash: int, tolerance: int) -> SentimentResult | None:
+        now = time.monotonic()
+        tolerance = max(0, min(tolerance, _HASH_BANDS - 1))
+        candidates = {phash}
+        if tolerance:
+            for band_key in self._band_keys(identity, phash):
+                candidates.update(self._bands.get(band_key, ()))
+        best: tuple[int, tuple[tuple[str, str], int]] | None = None
+        for candidate in candidates:
+            key = (identity, candidate)
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if entry[1] <= now:
+                self._remove(key)
+                continue
+            distance = (candidate ^ phash).bit_count()
+            if distance <= tolerance and (best is None or distance < best[0]):
+                best = (distance, key)
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(best[1])
+        return self._entries[best[1]][0]
+
+    def put(self, identity: tuple[str, str], phash: int, result: SentimentResult, ttl: float, max_bytes: int) -> None:
+        key = (identity, phash)
+        if key in self._entries:
+            self._remove(key)
+        size = _CACHE_ENTRY_OVERHEAD + len(result[3] or "")
+        if size > max_bytes:
+            return
+        self._entries[key] = (result, time.monotonic() + ttl, size)
+        self.bytes += size
+        for band_key in self._band_keys(identity, phash):
+            self._bands.setdefault(band_key, set()).add(phash)
+        while self.bytes > max_bytes:
+            self._remove(next(iter(self._entries)))
+
+
+_result_cache = ResultCache()
+
+
+# Multi-worker state. Every uvicorn worker process has its own sessions and
+# result cache; VISION_SHARED_STORE lets them share session history, the
+# frame-gate reference and cached results:
+#   sqlite:///dev/shm/live-vision.db  a SQLite file, for the workers of one pod
+#   redis://[:password@]host:6379/0   a Redis-compatible server, for several pods
+_REDIS_AVAILABLE = importlib.util.find_spec("redis") is not None
+_SHARED_STORE_URL = os.getenv("VISION_SHARED_STORE", "").strip()
+_SHARED_STORE_TIMEOUT = _env_float("VISION_SHARED_STORE_TIMEOUT", 0.1)
+_SHARED_STORE_CONNECT_TIMEOUT = _env_float("VISION_SHARED_STORE_CONNECT_TIMEOUT", 1.0)
+_SHARED_STORE_MAX_CONNECTIONS = _env_int("VISION_SHARED_STORE_MAX_CONNECTIONS", 16)
+_SHARED_STORE_PREFIX = "live-vision:"
+
+
+class SqliteStore:
+    """Key-value store with expiry in a SQLite file shared by local processes."""
+
+    kind = "sqlite"
+    # Expired rows are purged every this many writes.
+    _PURGE_EVERY = 512
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=_SHARED_STORE_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _get_many(self, keys: list[str]) -> list[bytes | None]:
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT key, value FROM kv WHERE expires > ? AND key IN ({','.join('?' * len(keys))})",
+                (time.time(), *keys),
+            ).fetchall()
+        values = dict(rows)
+        return [values.get(key) for key in keys]
+
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, now + ttl if ttl > 0 else float("inf"))
+            )
+            self._writes += 1
+            if self._writes % self._PURGE_EVERY == 0:
+                conn.execute("DELETE FROM kv WHERE expires <= ?", (now,))
+
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return await asyncio.to_thread(self._get_many, keys)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RedisStore:
+    """The same store on a Redis-compatible server, through a redis.asyncio connection pool."""
+
+    kind = "redis"
+
+    def __init__(self, url: str) -> None:
+        import redis.asyncio as aioredis
+
+        # Waiting for a free pooled connection and each command read or write
+        # are bounded by VISION_SHARED_STORE_TIMEOUT; opening a connection (TCP
+        # and TLS) has its own, longer VISION_SHARED_STORE_CONNECT_TIMEOUT.
+        self._pool = aioredis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=_SHARED_STORE_MAX_CONNECTIONS,
+            timeout=_SHARED_STORE_TIMEOUT,
+            socket_timeout=_SHARED_STORE_TIMEOUT,
+            socket_connect_timeout=_SHARED_STORE_CONNECT_TIMEOUT,
+        )
+        self._client = aioredis.Redis(connection_pool=self._pool)
+
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return await self._client.mget(keys)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._client.set(key, value, px=max(1, int(ttl * 1000)) if ttl > 0 else None)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+        await self._pool.disconnect()
+
+
+def _open_shared_store(url: str) -> SqliteStore | RedisStore | None:
+    if url.startswith("sqlite://"):
+        return SqliteStore(url[len("sqlite://") :])
+    if url.startswith(("redis://", "rediss://")):
+        if not _REDIS_AVAILABLE:
+            _logger.warning("VISION_SHARED_STORE is a Redis URL but the redis package is not installed")
+            return None
+        return RedisStore(url)
+    return None
+
+
+_shared_store = _open_shared_store(_SHARED_STORE_URL)
+
+
+async def _close_shared_store() -> None:
+    if _shared_store is not None:
+        await _shared_store.close()
+
+
+async def _shared_get(kind: str, keys: list[str]) -> list[bytes | None]:
+    """Read keys from the shared store; failures count as misses."""
+    try:
+        values = await _shared_store.get_many(keys)
+    except Exception:
+        _SHARED_STORE_OPS.inc(len(keys), kind=kind, result="error")
+        return [None] * len(keys)
+    for value in values:
+        _SHARED_STORE_OPS.inc(kind=kind, result="miss" if value is None else "hit")
+    return values
+
+
+async def _shared_set(kind: str, key: str, value: bytes, ttl: float) -> None:
+    try:
+        await _shared_store.set(key, value, ttl)
+    except Exception:
+        _SHARED_STORE_OPS.inc(kind=kind, result="error")
+    else:
+        _SHARED_STORE_OPS.inc(kind=kind, result="ok")
+
+
+def _shared_cache_key(identity: tuple, phash: int) -> str:
+    digest = hashlib.blake2b(json.dumps(identity).encode(), digest_size=8).hexdigest()
+    return f"{_SHARED_STORE_PREFIX}cache:{digest}:{phash:016x}"
+
+
+async def _shared_cache_get(identity: tuple, hashes: list[int]) -> list[SentimentResult | None]:
+    """Exact-hash lookups; near matches within cache_hamming are only found in the local cache."""
+    values = await _shared_get("cache", [_shared_cache_key(identity, phash) for phash in hashes])
+    return [tuple(json.loads(value)) if value is not None else None for value in values]
+
+
+async def _shared_cache_put(identity: tuple, phash: int, result: SentimentResult, ttl: float) -> None:
+    await _shared_set("cache", _shared_cache_key(identity, phash), json.dumps(result).encode(), ttl)
+
+
+def _session_snapshot(session: StreamSession) -> bytes:
+    # Wall-clock age: monotonic time does not carry across hosts.
+    response_time = time.time() - (time.monotonic() - session.last_response_at)
+    return json.dumps(
+        {
+            "history": session.recent_emotions(session.history_len),
+            "thumbnail": base64.b64encode(session.last_thumbnail).decode() if session.last_thumbnail else None,
+            "response": session.last_response,
+            "response_time": response_time if session.last_response is not None else None,
+        }
+    ).encode()
+
+
+def _restore_session(session: StreamSession, snapshot: dict) -> None:
+    """Adopt the shared history, and the shared frame-gate reference when it is newer."""
+    session.history_len = session.history_pos = 0
+    for detail in snapshot["history"][-_SESSION_HISTORY:]:
+        session.push_emotion(detail)
+    if snapshot["response"] is None or snapshot["thumbnail"] is None:
+        return
+    response_at = time.monotonic() - (time.time() - snapshot["response_time"])
+    if session.last_response is None or response_at > session.last_response_at:
+        session.last_thumbnail = base64.b64decode(snapshot["thumbnail"])
+        session.last_response = snapshot["response"]
+        session.last_response_at = response_at
+
+
+async def _load_shared_session(session: StreamSession) -> None:
+    (value,) = await _shared_get("session", [f"{_SHARED_STORE_PREFIX}session:{session.key}"])
+    if value is not None:
+        try:
+            _restore_session(session, json.loads(value))
+        except (ValueError, KeyError, TypeError):
+            _SHARED_STORE_OPS.inc(kind="session", result="error")
+
+
+async def _save_shared_session(session: StreamSession) -> None:
+    key = f"{_SHARED_STORE_PREFIX}session:{session.key}"
+    await _shared_set("session", key, _session_snapshot(session), _SESSION_TTL)
+
+
+def _perceptual_hash(gray: np.ndarray) -> int:
+    """64-bit difference hash (dHash) of a grayscale image."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _emotion_engine() -> str:
+    return _emotion_config.emotion_engine.strip().lower()
+
+
+async def _local_scores(crops: list[bytes]) -> list[tuple[str, float, float] | None] | None:
+    """Offline model scores of the crops (see EmotionClassifier.classify); None without a model."""
+    trace = _current_trace.get()
+    started = time.perf_counter()
+    scores = await _run_cpu(_classify_local, crops)
+    ended = time.perf_counter()
+    if trace is not None:
+        trace.add_span("local_classify", started, ended, faces=len(crops))
+    if scores is not None:
+        _EMOTION_CALL_SECONDS.observe(ended - started, sentiment_source="local")
+    return scores
+
+
+def _local_result(score: tuple[str, float, float], error: str | None = None) -> SentimentResult:
+    detail, probability, _ = score
+    return detail, "local", error, f"{detail} ({probability:.2f})", {detail: 1}
+
+
+async def analyze_faces_local(crops: list[bytes]) -> list[SentimentResult]:
+    """Classify crops with the offline model in the CPU pool, all in one forward pass."""
+    scores = await _local_scores(crops)
+    if scores is None:
+        return [("neutral", "fallback", "Local emotion model is not loaded", None, None) for _ in crops]
+    return [
+        _local_result(score)
+        if score is not None
+        else ("neutral", "fallback", "Local emotion model could not decode the crop", None, None)
+        for score in scores
+    ]
+
+
+def _result_reusable(result: SentimentResult | None) -> bool:
+    """Whether a fresh result may be cached or kept on a track.
+
+    Local answers standing in for a failed remote call carry its error and
+    are not, so the next frame tries the remote engine again.
+    """
+    if result is None or result[1] == "fallback":
+        return False
+    return result[1] != "local" or result[2] is None
+
+
+def _count_tier(tiers: Counter | None, tier: str, faces: int) -> None:
+    if faces:
+        _FACE_TIERS.inc(faces, tier=tier)
+        if tiers is not None:
+            tiers[tier] += faces
+
+
+class MicroBatcher:
+    """Collects face crops of concurrent frames into shared multi-image calls.
+
+    The first waiting crop starts the batch_max_wait timer; the batch is sent
+    when it fires or as soon as batch_max_size crops are waiting. Each caller
+    gets the results of its own crops back in order.
+    """
+
+    def __init__(self) -> None:
+        self._pending: list[tuple[bytes, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, crops: list[bytes]) -> list[SentimentResult]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for crop in crops:
+            future = loop.create_future()
+            self._pending.append((crop, future))
+            futures.append(future)
+            if len(self._pending) >= max(1, _emotion_config.batch_max_size):
+                self._flush("size")
+        if self._pending and self._timer is None:
+            self._timer = loop.call_later(max(0.0, _emotion_config.batch_max_wait), self._flush, "wait")
+        trace = _current_trace.get()
+        started = time.perf_counter()
+        try:
+            return list(await asyncio.gather(*futures))
+        finally:
+            if trace is not None:
+                trace.add_span("micro_batch", started, time.perf_counter(), faces=len(crops))
+
+    def _flush(self, reason: str) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Crops of callers that gave up (deadline) are not sent.
+        batch = [(crop, future) for crop, future in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+        _MICRO_BATCH_SIZE.observe(len(batch), flush=reason)
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[bytes, asyncio.Future]]) -> None:
+        # The call serves several frames; it is not part of any one frame's trace.
+        _current_trace.set(None)
+        crops = [crop for crop, _ in batch]
+        try:
+            results = await analyze_faces_batch(crops) if len(crops) > 1 else None
+            if results is None:
+                # One crop failing must not take the other callers' answers with it.
+                results = await asyncio.gather(*(analyze_face_sentiment(crop) for crop in crops), return_exceptions=True)
+        except Exception as exc:
+            results = [exc] * len(crops)
+        results = [
+            ("neutral", "fallback", str(result), None, None) if isinstance(result, BaseException) else result
+            for result in results
+        ]
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+_micro_batcher = MicroBatcher()
+
+
+def _micro_batch_enabled() -> bool:
+    return _emotion_config.micro_batch and any(_batch_capable(upstream) for upstream in _emotion_upstreams())
+
+
+async def _analyze_crops_cached(
+    crops: list[bytes],
+    hashes: list[int],
+    batch: bool = True,
+    tiers: Counter | None = None,
+) -> tuple[list[SentimentResult | None], int, int]:
+    """Like _analyze_crops, answering near-identical crops from the result cache.
+
+    Returns the results, the number of cache hits and the number of cache
+    lookups made (0 when the cache does not apply).
+    """
+    if not _emotion_config.cache_enabled or _emotion_engine() == "local" or not _emotion_upstreams():
+        return await _analyze_crops(crops, batch, tiers), 0, 0
+    identity = _upstreams_identity()
+    results: list[SentimentResult | None] = [None] * len(crops)
+    misses: list[int] = []
+    for idx, phash in enumerate(hashes):
+        cached = _result_cache.get(identity, phash, _emotion_config.cache_hamming)
+        if cached is None:
+            misses.append(idx)
+        else:
+            results[idx] = cached
+    if misses and _shared_store is not None:
+        # Faces another worker already classified.
+        shared = await _shared_cache_get(identity, [hashes[idx] for idx in misses])
+        for idx, cached in zip(misses, shared):
+            if cached is not None:
+                results[idx] = cached
+                _result_cache.put(
+                    identity, hashes[idx], cached, _emotion_config.cache_ttl, _emotion_config.cache_max_bytes
+                )
+        misses = [idx for idx in misses if results[idx] is None]
+    fresh = await _analyze_crops([crops[idx] for idx in misses], batch, tiers)
+    shared_puts = []
+    for idx, result in zip(misses, fresh):
+        results[idx] = result
+        if _result_reusable(result):
+            _result_cache.put(
+                identity,
+                hashes[idx],
+                result,
+                _emotion_config.cache_ttl,
+                _emotion_config.cache_max_bytes,
+            )
+            if _shared_store is not None:
+                shared_puts.append(_shared_cache_put(identity, hashes[idx], result, _emotion_config.cache_ttl))
+    if shared_puts:
+        await asyncio.gather(*shared_puts)
+    return results, len(crops) - len(misses), len(crops)
+
+
+async def _analyze_crops(
+    crops: list[bytes],
+    batch: bool = True,
+    tiers: Counter | None = None,
+) -> list[SentimentResult | None]:
+    """Analyze crops with the configured engine, returning results in crop order.
+
+    The cascade engine answers the crops the local model is confident about
+    and sends only the rest to the remote engine. With local_fallback, crops
+    the remote engine failed on or did not finish get the local answer with
+    the remote error attached. tiers counts the crops per tier.
+    """
+    engine = _emotion_engine()
+    if engine == "local":
+        _count_tier(tiers, "local", len(crops))
+        return await analyze_faces_local(crops)
+    results: list[SentimentResult | None] = [None] * len(crops)
+    remote = list(range(len(crops)))
+    scores = await _local_scores(crops) if engine == "cascade" and _LOCAL_MODEL_PATH and crops else None
+    if scores is not None:
+        remote = []
+        for idx, score in enumerate(scores):
+            if (
+                score is not None
+                and score[1] >= _emotion_config.cascade_threshold
+                and score[2] >= _emotion_config.cascade_margin
+            ):
+                results[idx] = _local_result(score)
+            else:
+                remote.append(idx)
+    _count_tier(tiers, "local", len(crops) - len(remote))
+    _count_tier(tiers, "remote", len(remote))
+    if remote:
+        answers = await _analyze_crops_remote([crops[idx] for idx in remote], batch)
+        for idx, result in zip(remote, answers):
+            results[idx] = result
+
+    if _emotion_config.local_fallback and _LOCAL_MODEL_PATH:
+        failed = [idx for idx in remote if results[idx] is None or results[idx][1] in {"fallback", "stub"}]
+        if failed:
+            if scores is None:
+                fallback_scores = await _local_scores([crops[idx] for idx in failed]) or [None] * len(failed)
+            else:
+                fallback_scores = [scores[idx] for idx in failed]
+            for idx, score in zip(failed, fallback_scores):
+                if score is None:
+                    continue
+                previous = results[idx]
+                if previous is None:
+                    error = "Deadline exceeded; answered by the local model"
+                elif previous[1] == "stub":
+                    error = "No emotion endpoint configured; answered by the local model"
+                else:
+                    error = f"{previous[2]}; answered by the local model"
+                results[idx] = _local_result(score, error)
+    return results
+
+
+async def _analyze_crops_remote(crops: list[bytes], batch: bool = True) -> list[SentimentResult | None]:
+    """Analyze crops concurrently, returning results in crop order.
+
+    Faces that have not finished when the request deadline expires are
+    cancelled and reported as None so the caller can aggregate the rest.
+    batch=False keeps whole frames out of multi-image calls, whose prompt
+    expects a single face per image.
+    """
+    deadline = _emotion_config.request_deadline
+    timeout = deadline if deadline > 0 else None
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    if batch and crops and _micro_batch_enabled():
+        try:
+            return await asyncio.wait_for(_micro_batcher.submit(crops), timeout)
+        except asyncio.TimeoutError:
+            return [None] * len(crops)
+    if batch and len(crops) > 1 and _batch_enabled():
+        try:
+            batched = await asyncio.wait_for(analyze_faces_batch(crops), timeout)
+        except asyncio.TimeoutError:
+            return [None] * len(crops)
+        if batched is not None:
+            return batched
+        if timeout is not None:
+            timeout = max(0.0, timeout - (loop.time() - started))
+
+    semaphore = asyncio.Semaphore(max(1, _emotion_config.face_concurrency))
+
+    async def run(crop: bytes) -> SentimentResult:
+        async with semaphore:
+            return await analyze_face_sentiment(crop)
+
+    tasks = [asyncio.create_task(run(crop)) for crop in crops]
+    if not tasks:
+        return []
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    results: list[SentimentResult | None] = []
+    for task in tasks:
+        if task in done and task.exception() is None:
+            results.append(task.result())
+        else:
+            results.append(None)
+    return results
+
+
+def _stabilize_result(session: StreamSession, result: SentimentResult) -> SentimentResult:
+    detail, source, err, raw, counts = result
+    if source in {"nim-chat", "external", "local"}:
+        detail = _stabilize_emotion(session, detail)
+    return detail, source, err, raw, counts
+
+
+_detector_warmup: dict[str, object] = {}
+
+# Face box as (x, y, w, h) in full-frame pixels.
+Box = tuple[int, int, int, int]
+
+# Side of the grayscale thumbnail used to compare a face's appearance.
+_SIGNATURE_SIZE = 16
+# (width, height) of the whole-frame thumbnail used by the static-scene gate.
+_FRAME_THUMBNAIL_SIZE = (32, 24)
+
+
+class FaceTrack:
+    __slots__ = ("track_id", "box", "signature", "result", "classified_at", "missed")
+
+    def __init__(self, track_id: int, box: Box, signature: bytes) -> None:
+        self.track_id = track_id
+        self.box = box
+        # Appearance when the cached result was produced.
+        self.signature = signature
+        self.result: SentimentResult | None = None
+        self.classified_at = 0.0
+        self.missed = 0
+
+
+def _box_iou(a: Box, b: Box) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def _signature_distance(a: bytes, b: bytes) -> float:
+    """Mean absolute difference of two appearance thumbnails, in [0, 1]."""
+    if len(a) != len(b) or not a:
+        return 1.0
+    diff = np.abs(np.frombuffer(a, dtype=np.uint8).astype(np.int16) - np.frombuffer(b, dtype=np.uint8))
+    return float(diff.mean()) / 255.0
+
+
+def _match_tracks(session: StreamSession, boxes: list[Box], signatures: list[bytes]) -> list[FaceTrack]:
+    """Assign each detected box to a track of the session, creating new tracks as needed.
+
+    Greedy matching by descending IoU; tracks left unmatched for more than
+    track_max_missed frames are dropped.
+    """
+    pairs = sorted(
+        (
+            (_box_iou(track.box, box), t_idx, b_idx)
+            for t_idx, track in enumerate(session.tracks)
+            for b_idx, box in enumerate(boxes)
+        ),
+        reverse=True,
+    )
+    assigned: dict[int, FaceTrack] = {}
+    used_tracks: set[int] = set()
+    for iou, t_idx, b_idx in pairs:
+        if iou < _emotion_config.track_iou:
+            break
+        if t_idx in used_tracks or b_idx in assigned:
+            continue
+        used_tracks.add(t_idx)
+        track = session.tracks[t_idx]
+        track.box = boxes[b_idx]
+        track.missed = 0
+        assigned[b_idx] = track
+
+    kept: list[FaceTrack] = []
+    for t_idx, track in enumerate(session.tracks):
+        if t_idx not in used_tracks:
+            track.missed += 1
+            if track.missed > _emotion_config.track_max_missed:
+                continue
+        kept.append(track)
+    for b_idx, box in enumerate(boxes):
+        if b_idx not in assigned:
+            track = FaceTrack(session.next_track_id, box, signatures[b_idx])
+            session.next_track_id += 1
+            assigned[b_idx] = track
+            kept.append(track)
+    session.tracks = kept
+    return [assigned[b_idx] for b_idx in range(len(boxes))]
+
+
+def _track_result_reusable(track: FaceTrack, signature: bytes, now: float) -> bool:
+    if track.result is None:
+        return False
+    if _upstreams_down():
+        # A stale emotion of the same face beats the fallback while the endpoint is down.
+        return True
+    if now - track.classified_at >= _emotion_config.track_refresh_seconds:
+        return False
+    return _signature_distance(track.signature, signature) <= _emotion_config.track_appearance_threshold
+
+
+# Limit per-frame model calls for latency and cost.
+MAX_FACES_PER_FRAME = 4
+
+# CPU stage (decode/detect/encode) runs in a worker pool so it never blocks
+# the event loop; "thread" or "process".
+_CPU_WORKER_MODE = os.getenv("VISION_WORKER_MODE", "thread").strip().lower()
+# uvicorn runs WEB_CONCURRENCY server processes, each with its own pool; by
+# default they split the cores between them.
+_WEB_WORKERS = max(1, _env_int("WEB_CONCURRENCY", 1))
+_CPU_WORKERS = max(1, _env_int("VISION_WORKERS", min(4, (os.cpu_count() or 1) // _WEB_WORKERS)))
+_cpu_pool: Executor | None = None
+_cpu_in_flight = 0
+_worker_state = threading.local()
+
+
+@dataclass
+class DetectorParams:
+    detector: str = "haar"
+    score_threshold: float = 0.6
+    scale_factor: float = 1.1
+    min_neighbors: int = 5
+    min_size: int = 48
+    max_width: int = 640
+    roi_margin: float = 0.5
+    gate_threshold: float = 0.0
+    decode_max_width: int = 0
+
+
+@dataclass
+class CropParams:
+    margin: float = 0.0
+    size: int = 0
+    grayscale: bool = False
+    format: str = "jpeg"
+    quality: int = 95
+
+
+def _crop_params() -> CropParams:
+    return CropParams(
+        margin=max(0.0, _emotion_config.crop_margin),
+        size=max(0, _emotion_config.crop_size),
+        grayscale=_emotion_config.crop_grayscale,
+        format="webp" if _emotion_config.crop_format.strip().lower() == "webp" else "jpeg",
+        quality=min(100, max(1, _emotion_config.crop_quality)),
+    )
+
+
+def _detector_params() -> DetectorParams:
+    return DetectorParams(
+        detector=_emotion_config.detector.strip().lower(),
+        score_threshold=_emotion_config.detector_score_threshold,
+        scale_factor=max(1.01, _emotion_config.detect_scale_factor),
+        min_neighbors=max(0, _emotion_config.detect_min_neighbors),
+        min_size=max(1, _emotion_config.detect_min_size),
+        max_width=max(0, _emotion_config.detect_max_width),
+        roi_margin=max(0.0, _emotion_config.detect_roi_margin),
+        gate_threshold=_emotion_config.frame_gate_threshold,
+        decode_max_width=max(0, _emotion_config.decode_max_width),
+    )
+
+
+@dataclass
+class FrameDetection:
+    decoded: bool = False
+    face_count: int = 0
+    crops: list[bytes] = field(default_factory=list)
+    # Aligned with crops: face boxes and appearance thumbnails.
+    boxes: list[Box] = field(default_factory=list)
+    signatures: list[bytes] = field(default_factory=list)
+    hashes: list[int] = field(default_factory=list)
+    # Perceptual hash of the whole frame, for the no-face fallback call.
+    frame_hash: int | None = None
+    thumbnail: bytes | None = None
+    # Set when the frame matched the reference thumbnail and detection was skipped.
+    static: bool = False
+    frame_diff: float | None = None
+    # Every detected face, including those beyond MAX_FACES_PER_FRAME.
+    face_boxes: list[Box] = field(default_factory=list)
+    # "full" or "roi", and the detector input scale relative to the frame.
+    scan: str = "full"
+    detect_scale: float = 1.0
+    # Detector backend actually used, and seconds spent per CPU stage.
+    detector: str = ""
+    timings: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class ClientFaces:
+    """Faces located by the client: pre-cropped JPEGs, or one frame with face boxes."""
+
+    crops: list[bytes] = field(default_factory=list)
+    # Aligned with crops when given; for a frame, the regions to crop.
+    boxes: list[Box] = field(default_factory=list)
+    frame: bytes | None = None
+
+    @property
+    def size(self) -> int:
+        return sum(len(crop) for crop in self.crops) + len(self.frame or b"")
+
+
+class FaceDetector:
+    """Local CPU face detector backend.
+
+    Instances hold OpenCV models that are not safe to share across threads;
+    every pool worker creates its own through _worker_detector.
+    """
+
+    name = ""
+    # Whether detect() takes the BGR frame instead of the gray one.
+    needs_color = False
+
+    def empty(self) -> bool:
+        return False
+
+    def detect(self, image: np.ndarray, params: DetectorParams, scale: float) -> list[Box]:
+        """Return face boxes in the coordinates of image (downscaled by scale)."""
+        raise NotImplementedError
+
+
+class CascadeDetector(FaceDetector):
+    def __init__(self, name: str, path: str) -> None:
+        self.name = name
+        self._cascade = cv2.CascadeClassifier(path) if path and Path(path).exists() else cv2.CascadeClassifier()
+
+    def empty(self) -> bool:
+        return self._cascade.empty()
+
+    def detect(self, image: np.ndarray, params: DetectorParams, scale: float) -> list[Box]:
+        min_side = max(1, round(params.min_size * scale))
+        faces = self._cascade.detectMultiScale(
+            image,
+            scaleFactor=params.scale_factor,
+            minNeighbors=params.min_neighbors,
+            minSize=(min_side, min_side),
+        )
+        return [(int(x), int(y), int(w), int(h)) for (x, y, w, h) in faces]
+
+
+class YuNetDetector(FaceDetector):
+    name = "yunet"
+    needs_color = True
+
+    def __init__(self, path: str) -> None:
+        self._net = None
+        if path and Path(path).exists():
+            self._net = cv2.FaceDetectorYN.create(path, "", (320, 320))
+
+    def empty(self) -> bool:
+        return self._net is None
+
+    def detect(self, image: np.ndarray, params: DetectorParams, scale: float) -> list[Box]:
+        height, width = image.shape[:2]
+        self._net.setInputSize((width, height))
+        self._net.setScoreThreshold(params.score_threshold)
+        _, faces = self._net.detect(image)
+        if faces is None:
+            return []
+        min_side = params.min_size * scale
+        boxes: list[Box] = []
+        for face in faces:
+            x, y = max(0, int(face[0])), max(0, int(face[1]))
+            w, h = int(face[2]), int(face[3])
+            if w >= min_side and h >= min_side:
+                boxes.append((x, y, w, h))
+        return boxes
+
+
+class DnnDetector(FaceDetector):
+    """OpenCV DNN SSD face detector (res10 300x300 Caffe model)."""
+
+    name = "dnn"
+    needs_color = True
+
+    def __init__(self, prototxt: str, model: str) -> None:
+        self._net = None
+        if prototxt and model and Path(prototxt).exists() and Path(model).exists():
+            self._net = cv2.dnn.readNetFromCaffe(prototxt, model)
+
+    def empty(self) -> bool:
+        return self._net is None
+
+    def detect(self, image: np.ndarray, params: DetectorParams, scale: float) -> list[Box]:
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(image, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self._net.setInput(blob)
+        detections = self._net.forward()
+        min_side = params.min_size * scale
+        boxes: list[Box] = []
+        for det in detections[0, 0]:
+            if float(det[2]) < params.score_threshold:
+                continue
+            x0, y0 = max(0, int(det[3] * width)), max(0, int(det[4] * height))
+            x1, y1 = min(width, int(det[5] * width)), min(height, int(det[6] * height))
+            if x1 - x0 >= min_side and y1 - y0 >= min_side:
+                boxes.append((x0, y0, x1 - x0, y1 - y0))
+        return boxes
+
+
+_DETECTOR_FACTORIES = {
+    "haar": lambda: CascadeDetector("haar", _HAAR_CASCADE_PATH),
+    "lbp": lambda: CascadeDetector("lbp", os.getenv("VISION_LBP_CASCADE", "").strip()),
+    "yunet": lambda: YuNetDetector(os.getenv("VISION_YUNET_MODEL", "").strip()),
+    "dnn": lambda: DnnDetector(
+        os.getenv("VISION_DNN_PROTOTXT", "").strip(),
+        os.getenv("VISION_DNN_MODEL", "").strip(),
+    ),
+}
+
+
+def _worker_detector(name: str) -> FaceDetector:
+    """This worker's instance of the named detector, loaded on first use.
+
+    Unknown names and backends whose model files cannot be loaded fall back
+    to the Haar cascade.
+    """
+    detectors = getattr(_worker_state, "detectors", None)
+    if detectors is None:
+        detectors = _worker_state.detectors = {}
+    detector = detectors.get(name)
+    if detector is None:
+        factory = _DETECTOR_FACTORIES.get(name)
+        detector = factory() if factory else None
+        if (detector is None or detector.empty()) and name != "haar":
+            detector = _worker_detector("haar")
+        detectors[name] = detector
+    return detector
+
+
+def _warm_up_detector(name: str) -> tuple[str, bool, float]:
+    detector = _worker_detector(name)
+    if detector.empty():
+        return detector.name, False, 0.0
+    image = np.zeros((240, 320, 3) if detector.needs_color else (240, 320), dtype=np.uint8)
+    started = time.perf_counter()
+    detector.detect(image, DetectorParams(), 1.0)
+    return detector.name, True, time.perf_counter() - started
+
+
+# Local emotion classifier: an ONNX model run with OpenCV DNN on square gray
+# crops of EMOTION_LOCAL_INPUT_SIZE px, pixel values (0-255) multiplied by
+# EMOTION_LOCAL_INPUT_SCALE. EMOTION_LOCAL_LABELS names the output classes in
+# order. The defaults fit the FER+ model (emotion-ferplus-8.onnx).
+_LOCAL_MODEL_PATH = os.getenv("EMOTION_LOCAL_MODEL", "").strip()
+_LOCAL_LABELS = tuple(
+    label.strip()
+    for label in os.getenv(
+        "EMOTION_LOCAL_LABELS", "neutral,happiness,surprise,sadness,anger,disgust,fear,contempt"
+    ).split(",")
+    if label.strip()
+)
+_LOCAL_INPUT_SIZE = max(8, _env_int("EMOTION_LOCAL_INPUT_SIZE", 64))
+_LOCAL_INPUT_SCALE = _env_float("EMOTION_LOCAL_INPUT_SCALE", 1.0)
+_local_classifier_warmup: dict[str, object] = {}
+
+
+class EmotionClassifier:
+    """Offline CPU emotion classifier; one instance per pool worker, like detectors."""
+
+    def __init__(self, path: str, labels: tuple[str, ...], size: int, scale: float) -> None:
+        self._net = cv2.dnn.readNetFromONNX(path) if path and Path(path).exists() else None
+        self.size = size
+        self.scale = scale
+        # Classes that map to the same detailed emotion (sadness, contempt) are summed.
+        emotions = [_normalize_emotion_detail(label) for label in labels]
+        self.emotions = sorted(set(emotions))
+        self._projection = np.zeros((len(labels), len(self.emotions)), np.float32)
+        for idx, emotion in enumerate(emotions):
+            self._projection[idx, self.emotions.index(emotion)] = 1.0
+
+    def empty(self) -> bool:
+        return self._net is None
+
+    def classify(self, crops: list[bytes]) -> list[tuple[str, float, float] | None]:
+        """Emotion, probability and lead over the runner-up per crop, in one forward pass.
+
+        None for undecodable crops.
+        """
+        size = self.size
+        batch = _worker_buffer("classify", (len(crops), size, size))
+        decoded: list[int] = []
+        for idx, crop in enumerate(crops):
+            gray = cv2.imdecode(np.frombuffer(crop, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if gray is None or gray.size == 0:
+                continue
+            batch[len(decoded)] = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+            decoded.append(idx)
+        results: list[tuple[str, float, float] | None] = [None] * len(crops)
+        if not decoded:
+            return results
+        blob = batch[: len(decoded), np.newaxis].astype(np.float32)
+        if self.scale != 1.0:
+            blob *= self.scale
+        self._net.setInput(blob)
+        scores = self._net.forward().reshape(len(decoded), -1)
+        # Models that end in a softmax already return probabilities.
+        if scores.min() < 0 or not np.allclose(scores.sum(axis=1), 1.0, atol=1e-3):
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+        probabilities = scores @ self._projection
+        best = probabilities.argmax(axis=1)
+        if probabilities.shape[1] > 1:
+            top_two = -np.partition(-probabilities, 1, axis=1)[:, :2]
+            margins = top_two[:, 0] - top_two[:, 1]
+        else:
+            margins = probabilities[:, 0]
+        for row, idx in enumerate(decoded):
+            results[idx] = (self.emotions[best[row]], float(probabilities[row, best[row]]), float(margins[row]))
+        return results
+
+
+def _worker_classifier() -> EmotionClassifier:
+    classifier = getattr(_worker_state, "classifier", None)
+    if classifier is None:
+        classifier = _worker_state.classifier = EmotionClassifier(
+            _LOCAL_MODEL_PATH, _LOCAL_LABELS, _LOCAL_INPUT_SIZE, _LOCAL_INPUT_SCALE
+        )
+    return classifier
+
+
+def _classify_local(crops: list[bytes]) -> list[tuple[str, float, float] | None] | None:
+    """Pool job: classify crops with this worker's local model; None when no model is loaded."""
+    classifier = _worker_classifier()
+    if classifier.empty():
+        return None
+    return classifier.classify(crops)
+
+
+def _warm_up_classifier() -> tuple[bool, float]:
+    classifier = _worker_classifier()
+    if classifier.empty():
+        return False, 0.0
+    crop = cv2.imencode(".jpg", np.zeros((classifier.size, classifier.size), np.uint8))[1].tobytes()
+    started = time.perf_counter()
+    classifier.classify([crop])
+    return True, time.perf_counter() - started
+
+
+def _detect_boxes(
+    detector: FaceDetector,
+    image: np.ndarray,
+    params: DetectorParams,
+    rois: list[Box] | None,
+) -> tuple[list[Box], float]:
+    """Detect faces on a downscaled copy of image; boxes come back in full-resolution pixels."""
+    height, width = image.shape[:2]
+    scale = 1.0
+    if params.max_width and width > params.max_width:
+        scale = params.max_width / width
+        size = (params.max_width, max(1, round(height * scale)))
+        buffer = _worker_buffer("detect", (size[1], size[0], *image.shape[2:]))
+        image = cv2.resize(image, size, dst=buffer, interpolation=cv2.INTER_AREA)
+    small_h, small_w = image.shape[:2]
+
+    if not rois:
+        found = detector.detect(image, params, scale)
+    else:
+        found = []
+        for rx, ry, rw, rh in rois:
+            mx, my = rw * params.roi_margin, rh * params.roi_margin
+            x0 = max(0, int((rx - mx) * scale))
+            y0 = max(0, int((ry - my) * scale))
+            x1 = min(small_w, int((rx + rw + mx) * scale) + 1)
+            y1 = min(small_h, int((ry + rh + my) * scale) + 1)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            for x, y, w, h in detector.detect(image[y0:y1, x0:x1], params, scale):
+                box = (x + x0, y + y0, w, h)
+                # Regions of nearby faces overlap; keep one box per face.
+                if all(_box_iou(box, other) < 0.3 for other in found):
+                    found.append(box)
+
+    boxes: list[Box] = []
+    for x, y, w, h in found:
+        fx, fy = int(x / scale), int(y / scale)
+        fw = min(int(round(w / scale)), width - fx)
+        fh = min(int(round(h / scale)), height - fy)
+        if fw > 0 and fh > 0:
+            boxes.append((fx, fy, fw, fh))
+    return boxes, scale
+
+
+def _detect_faces_in_frame(
+    data: bytes,
+    params: DetectorParams | None = None,
+    reference: bytes | None = None,
+    rois: list[Box] | None = None,
+    crop: CropParams | None = None,
+) -> FrameDetection:
+    """Decode a frame, detect faces and encode the crops to analyze.
+
+    When a reference thumbnail is given and the frame is within the gate
+    threshold of it, detection is skipped and the result is marked static.
+    With rois, the detector only searches around those boxes, and the whole
+    frame when none of them holds a face.
+    """
+    params = params or DetectorParams()
+    crop = crop or CropParams()
+    timings: dict[str, float] = {}
+    detector = _worker_detector(params.detector)
+    # Gray crops from a gray detector never need the color planes.
+    gray_only = crop.grayscale and not detector.needs_color
+    started = time.perf_counter()
+    img, factor = _decode_frame(data, params.decode_max_width, gray_only)
+    timings["decode"] = time.perf_counter() - started
+    if img is None or detector.empty():
+        return FrameDetection(timings=timings)
+    if factor > 1:
+        # Boxes stay in decoded pixels; only the full-resolution minimum face size shrinks.
+        params = replace(params, min_size=max(1, params.min_size // factor))
+    started = time.perf_counter()
+    if gray_only:
+        gray = img
+    else:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=_worker_buffer("gray", img.shape[:2]))
+    timings["gray"] = time.perf_counter() - started
+    thumbnail = cv2.resize(gray, _FRAME_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).tobytes()
+    frame_diff = None
+    if reference is not None:
+        frame_diff = _signature_distance(reference, thumbnail)
+        if frame_diff <= params.gate_threshold:
+            return FrameDetection(
+                decoded=True,
+                thumbnail=thumbnail,
+                static=True,
+                frame_diff=frame_diff,
+                timings=timings,
+            )
+    started = time.perf_counter()
+    image = img if detector.needs_color else gray
+    faces, scale = _detect_boxes(detector, image, params, rois)
+    if rois and not faces:
+        # The faces left their regions: rescan the whole frame rather than
+        # fall back to classifying it upstream as if nobody were there.
+        rois = None
+        faces, scale = _detect_boxes(detector, image, params, None)
+    timings["detect"] = time.perf_counter() - started
+    detection = FrameDetection(
+        decoded=True,
+        face_count=len(faces),
+        thumbnail=thumbnail,
+        frame_diff=frame_diff,
+        scan="roi" if rois else "full",
+        detect_scale=scale / factor,
+        face_boxes=faces,
+        detector=detector.name,
+        timings=timings,
+    )
+    if len(faces) == 0:
+        detection.frame_hash = _perceptual_hash(gray)
+    timings["encode"] = _encode_face_crops(detection, img, gray, faces[:MAX_FACES_PER_FRAME], crop)
+    return detection
+
+
+_DECODE_COLOR = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+_DECODE_GRAY = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def _jpeg_size(data: bytes) -> tuple[int, int] | None:
+    """(width, height) from a JPEG's frame header without decoding; None for other images."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    idx = 2
+    while idx + 9 <= len(data):
+        if data[idx] != 0xFF:
+            return None
+        marker = data[idx + 1]
+        if marker == 0xFF:
+            idx += 1
+            continue
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC).
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">HH", data, idx + 5)
+            return width, height
+        idx += 2 + struct.unpack_from(">H", data, idx + 2)[0]
+    return None
+
+
+def _decode_frame(data: bytes, max_width: int, gray_only: bool) -> tuple[np.ndarray | None, int]:
+    """Decode a frame, at 1/2, 1/4 or 1/8 scale when it stays at least max_width wide.
+
+    libjpeg scales while decoding (IMREAD_REDUCED_*), which skips most of the
+    IDCT work and allocates the smaller image only. Returns the image and
+    the reduction factor.
+    """
+    factor = 1
+    size = _jpeg_size(data) if max_width else None
+    if size is not None:
+        while factor < 8 and size[0] // (factor * 2) >= max_width:
+            factor *= 2
+    flags = (_DECODE_GRAY if gray_only else _DECODE_COLOR)[factor]
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags), factor
+
+
+_CROP_ENCODINGS = {"jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY), "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY)}
+
+
+def _worker_buffer(purpose: str, shape: tuple[int, ...]) -> np.ndarray:
+    """This worker's reusable uint8 buffer for one purpose and shape.
+
+    Buffers are overwritten by the next frame, so nothing derived from one
+    may outlive the pool job without a copy.
+    """
+    buffers = getattr(_worker_state, "buffers", None)
+    if buffers is None:
+        buffers = _worker_state.buffers = {}
+    key = (purpose, shape)
+    buffer = buffers.get(key)
+    if buffer is None:
+        # Box sizes vary from frame to frame without crop_size; keep the set bounded.
+        if len(buffers) >= 32:
+            buffers.clear()
+        buffer = buffers[key] = np.empty(shape, np.uint8)
+    return buffer
+
+
+def _encode_face_crops(
+    detection: FrameDetection,
+    img: np.ndarray,
+    gray: np.ndarray,
+    boxes: list[Box],
+    crop: CropParams,
+) -> float:
+    """Normalize and encode the boxed regions of a frame into detection; returns the encode seconds.
+
+    Signatures and hashes are taken from the detected box itself, so the
+    crop settings do not affect tracking or the result cache.
+    """
+    height, width = gray.shape[:2]
+    ext, quality_flag = _CROP_ENCODINGS[crop.format]
+    encode_params = [quality_flag, crop.quality]
+    source = gray if crop.grayscale else img
+    encode_seconds = 0.0
+    for (x, y, w, h) in boxes:
+        started = time.perf_counter()
+        pad_x, pad_y = int(w * crop.margin), int(h * crop.margin)
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+        face_crop = source[y0:y1, x0:x1]
+        scale = crop.size / max(x1 - x0, y1 - y0) if crop.size else 1.0
+        if scale < 1.0:
+            size = (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale)))
+            buffer = _worker_buffer("crop", (size[1], size[0], *face_crop.shape[2:]))
+            face_crop = cv2.resize(face_crop, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        ok, enc = cv2.imencode(ext, face_crop, encode_params)
+        encode_seconds += time.perf_counter() - started
+        if ok:
+            face_gray = gray[y : y + h, x : x + w]
+            signature = cv2.resize(face_gray, (_SIGNATURE_SIZE, _SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+            detection.crops.append(enc.tobytes())
+            detection.boxes.append((x, y, w, h))
+            detection.signatures.append(signature.tobytes())
+            detection.hashes.append(_perceptual_hash(face_gray))
+    return encode_seconds
+
+
+def _prepare_client_faces(faces: ClientFaces, crop: CropParams | None = None) -> FrameDetection:
+    """Build a FrameDetection from faces the client already located; no detector runs.
+
+    Pre-cropped JPEGs are forwarded as uploaded and only decoded to grayscale
+    for the track signature and cache hash. A frame with boxes is decoded once
+    and cropped at the given boxes, clamped to the frame, with the crop
+    settings applied.
+    """
+    timings: dict[str, float] = {}
+    detection = FrameDetection(scan="client", detector="client", timings=timings)
+    started = time.perf_counter()
+    if faces.frame is None:
+        for idx, crop in enumerate(faces.crops[:MAX_FACES_PER_FRAME]):
+            face_gray = cv2.imdecode(np.frombuffer(crop, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if face_gray is None or face_gray.size == 0:
+                continue
+            signature = cv2.resize(face_gray, (_SIGNATURE_SIZE, _SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+            detection.crops.append(crop)
+            detection.signatures.append(signature.tobytes())
+            detection.hashes.append(_perceptual_hash(face_gray))
+            if faces.boxes:
+                detection.boxes.append(faces.boxes[idx])
+        timings["decode"] = time.perf_counter() - started
+        # Crops that do not decode are neither analyzed nor counted.
+        detection.decoded = bool(detection.crops)
+        detection.face_count = len(detection.crops)
+        detection.face_boxes = list(detection.boxes)
+        return detection
+
+    img = cv2.imdecode(np.frombuffer(faces.frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+    timings["decode"] = time.perf_counter() - started
+    if img is None:
+        return detection
+    started = time.perf_counter()
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=_worker_buffer("gray", img.shape[:2]))
+    timings["gray"] = time.perf_counter() - started
+    height, width = gray.shape[:2]
+    boxes: list[Box] = []
+    for x, y, w, h in faces.boxes:
+        x0, y0 = min(max(x, 0), width), min(max(y, 0), height)
+        x1, y1 = min(x + w, width), min(y + h, height)
+        if x1 > x0 and y1 > y0:
+            boxes.append((x0, y0, x1 - x0, y1 - y0))
+    detection.decoded = True
+    detection.face_count = len(boxes)
+    detection.face_boxes = boxes
+    if not boxes:
+        detection.frame_hash = _perceptual_hash(gray)
+    timings["encode"] = _encode_face_crops(detection, img, gray, boxes[:MAX_FACES_PER_FRAME], crop or CropParams())
+    return detection
+
+
+def _get_cpu_pool() -> Executor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        if _CPU_WORKER_MODE == "process":
+            _cpu_pool = ProcessPoolExecutor(
+                max_workers=_CPU_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            _cpu_pool = ThreadPoolExecutor(max_workers=_CPU_WORKERS, thread_name_prefix="vision-cpu")
+    return _cpu_pool
+
+
+def _shutdown_cpu_pool() -> None:
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+    _cpu_pool = None
+
+
+async def _run_cpu(fn, *args):
+    global _cpu_in_flight
+    _cpu_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_cpu_pool(), fn, *args)
+    finally:
+        _cpu_in_flight -= 1
+
+
+async def _warm_up_detectors() -> None:
+    """Load and exercise the configured detector once in every pool worker."""
+    name = _detector_params().detector
+    results = await asyncio.gather(*(_run_cpu(_warm_up_detector, name) for _ in range(_CPU_WORKERS)))
+    _detector_warmup.update(
+        requested=name,
+        active=results[0][0],
+        ready=all(ready for _, ready, _ in results),
+        warmup_seconds=max(seconds for _, _, seconds in results),
+    )
+
+
+async def _warm_up_classifiers() -> None:
+    """Load the local emotion model in every pool worker when the config uses it."""
+    if not _LOCAL_MODEL_PATH or (_emotion_engine() == "remote" and not _emotion_config.local_fallback):
+        return
+    results = await asyncio.gather(*(_run_cpu(_warm_up_classifier) for _ in range(_CPU_WORKERS)))
+    _local_classifier_warmup.update(
+        model=_LOCAL_MODEL_PATH,
+        ready=all(ready for ready, _ in results),
+        warmup_seconds=max(seconds for _, seconds in results),
+    )
+
+
+def _cpu_pool_stats() -> dict[str, float]:
+    busy = min(_cpu_in_flight, _CPU_WORKERS)
+    return {
+        "workers": _CPU_WORKERS,
+        "in_flight": _cpu_in_flight,
+        "queue_depth": max(0, _cpu_in_flight - _CPU_WORKERS),
+        "utilization": busy / _CPU_WORKERS,
+    }
+
+
+def _request_session(request: Request, session_id: str) -> StreamSession:
+    """The stream session of a request.
+
+    Requests without a session id get a session of their own: behind an
+    ingress or mesh every client has the proxy's address, so keying on it
+    would mix clients' frames, tracks and results. VISION_SESSION_BY_ADDRESS
+    restores one shared session per client address for direct connections.
+    """
+    session_id = session_id.strip()[:128]
+    if session_id:
+        return _sessions.get(session_id)
+    if _SESSION_BY_ADDRESS and request.client is not None:
+        return _sessions.get(f"client:{request.client.host}")
+    return StreamSession()
+
+
+MetricCallback("vision_cpu_pool_workers", "Worker count of the CPU stage pool.", "gauge", lambda: _CPU_WORKERS)
+MetricCallback(
+    "vision_cpu_pool_in_flight",
+    "CPU stage jobs submitted and not yet finished.",
+    "gauge",
+    lambda: _cpu_pool_stats()["in_flight"],
+)
+MetricCallback(
+    "vision_cpu_pool_queue_depth",
+    "CPU stage jobs waiting for a free worker.",
+    "gauge",
+    lambda: _cpu_pool_stats()["queue_depth"],
+)
+MetricCallback(
+    "vision_cpu_pool_utilization",
+    "Fraction of CPU stage workers busy.",
+    "gauge",
+    lambda: _cpu_pool_stats()["utilization"],
+)
+MetricCallback("vision_sessions_active", "Stream sessions currently held in memory.", "gauge", lambda: len(_sessions))
+MetricCallback(
+    "vision_sessions_evicted_total",
+    "Stream sessions evicted by LRU cap or TTL.",
+    "counter",
+    lambda: _sessions.evicted,
+)
+MetricCallback(
+    "emotion_cache_hits_total",
+    "Emotion results served from the perceptual-hash cache.",
+    "counter",
+    lambda: _result_cache.hits,
+)
+MetricCallback(
+    "emotion_cache_misses_total",
+    "Emotion cache lookups that required a model call.",
+    "counter",
+    lambda: _result_cache.misses,
+)
+MetricCallback("emotion_cache_entries", "Entries held in the emotion result cache.", "gauge", lambda: len(_result_cache))
+MetricCallback(
+    "emotion_cache_bytes",
+    "Estimated memory held by the emotion result cache.",
+    "gauge",
+    lambda: _result_cache.bytes,
+)
+MetricCallback(
+    "emotion_breaker_state",
+    "Circuit breaker state per emotion endpoint: 0 closed, 1 half-open, 2 open.",
+    "gauge",
+    lambda: {(u.endpoint,): _BREAKER_STATES[u.current_state(_emotion_config)] for u in _upstreams.values()},
+    ("upstream",),
+)
+MetricCallback(
+    "emotion_call_timeout_seconds",
+    "Current (adaptive) read timeout of emotion calls per upstream and call kind.",
+    "gauge",
+    lambda: {
+        (u.endpoint, kind): u.timeout(_emotion_config, kind) for u in _upstreams.values() for kind in u.latency
+    },
+    ("upstream", "kind"),
+)
+MetricCallback(
+    "emotion_upstream_outstanding",
+    "Emotion calls routed to each upstream and not finished yet.",
+    "gauge",
+    lambda: {(u.endpoint,): u.outstanding for u in _upstreams.values()},
+    ("upstream",),
+)
+MetricCallback(
+    "emotion_upstream_calls_total",
+    "Emotion calls routed to each upstream.",
+    "counter",
+    lambda: {(u.endpoint,): u.calls for u in _upstreams.values()},
+    ("upstream",),
+)
+
+
+def _request_trace(timing: bool, traceparent: str) -> RequestTrace | None:
+    report = timing or _emotion_config.debug_timing
+    if not report and not traceparent:
+        return None
+    return RequestTrace(traceparent, report)
+
+
+@app.post("/vision")
+async def vision(
+    request: Request,
+    frame: UploadFile | None = File(None),
+    session_id: str = Form(""),
+    x_session_id: str = Header(""),
+    timing: bool = False,
+    traceparent: str = Header(""),
+):
+    """Analyze one frame: a multipart ``frame`` upload, or the raw request body
+    when it is sent as ``image/jpeg`` (or any ``image/*`` type), which skips
+    multipart parsing and its spooled copy of the upload.
+    """
+    trace = _request_trace(timing, traceparent)
+    started = time.perf_counter()
+    if frame is not None:
+        data = await frame.read()
+    elif request.headers.get("content-type", "").startswith("image/"):
+        data = await request.body()
+    else:
+        raise HTTPException(status_code=400, detail="Send a multipart frame or an image/jpeg body")
+    if not data:
+        raise HTTPException(status_code=400, detail="Frame is empty")
+    if trace is not None:
+        trace.stages["read"] = time.perf_counter() - started
+    session = _request_session(request, session_id or x_session_id)
+    if _emotion_config.latest_frame_wins:
+        return await session.scheduler.submit(lambda: _process_frame(data, session, "http", trace))
+    return await _process_frame(data, session, "http", trace)
+
+
+# Packed /vision/faces body, little-endian: u16 face count, then per face u16
+# x, y, w, h (all zero when unknown) and a u32 JPEG length, followed by the JPEG.
+_PACKED_COUNT = struct.Struct("<H")
+_PACKED_FACE = struct.Struct("<HHHHI")
+
+
+def _unpack_faces(body: bytes) -> ClientFaces:
+    if len(body) < _PACKED_COUNT.size:
+        raise HTTPException(status_code=400, detail="Packed body is too short")
+    (count,) = _PACKED_COUNT.unpack_from(body)
+    if count == 0:
+        raise HTTPException(status_code=400, detail="Packed body has no faces")
+    offset = _PACKED_COUNT.size
+    faces = ClientFaces()
+    for _ in range(count):
+        if offset + _PACKED_FACE.size > len(body):
+            raise HTTPException(status_code=400, detail="Packed body is truncated")
+        x, y, w, h, length = _PACKED_FACE.unpack_from(body, offset)
+        offset += _PACKED_FACE.size
+        if length == 0 or offset + length > len(body):
+            raise HTTPException(status_code=400, detail="Packed body is truncated")
+        faces.crops.append(body[offset : offset + length])
+        faces.boxes.append((x, y, w, h))
+        offset += length
+    if offset != len(body):
+        raise HTTPException(status_code=400, detail="Packed body has trailing bytes")
+    if all(w == 0 and h == 0 for _, _, w, h in faces.boxes):
+        faces.boxes = []
+    return faces
+
+
+def _parse_boxes(raw: str) -> list[Box]:
+    if not raw.strip():
+        return []
+    try:
+        items = json.loads(raw)
+        boxes = [tuple(int(v) for v in item) for item in items]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="boxes must be a JSON list of [x, y, w, h]") from None
+    if any(len(box) != 4 or box[2] <= 0 or box[3] <= 0 for box in boxes):
+        raise HTTPException(status_code=400, detail="boxes must be a JSON list of [x, y, w, h]")
+    return boxes
+
+
+async def _client_faces_from_form(form) -> ClientFaces:
+    boxes = _parse_boxes(str(form.get("boxes") or ""))
+    crops = [await item.read() for item in form.getlist("faces") if not isinstance(item, str)]
+    if not all(crops):
+        raise HTTPException(status_code=400, detail="faces must not be empty")
+    frame = form.get("frame")
+    if frame is not None and not isinstance(frame, str):
+        if crops:
+            raise HTTPException(status_code=400, detail="Send either faces or frame, not both")
+        data = await frame.read()
+        if not data:
+            raise HTTPException(status_code=400, detail="Frame is empty")
+        return ClientFaces(boxes=boxes, frame=data)
+    if not crops:
+        raise HTTPException(status_code=400, detail="Expected faces or frame")
+    if boxes and len(boxes) != len(crops):
+        raise HTTPException(status_code=400, detail="boxes must have one entry per face")
+    return ClientFaces(crops=crops, boxes=boxes)
+
+
+@app.post("/vision/faces")
+async def vision_faces(
+    request: Request,
+    x_session_id: str = Header(""),
+    timing: bool = False,
+    traceparent: str = Header(""),
+):
+    """/vision for clients that locate faces themselves; decode and detection are skipped.
+
+    multipart/form-data takes repeated ``faces`` JPEG crops, or one ``frame``
+    to crop; ``boxes`` is an optional JSON list of [x, y, w, h], one per
+    crop (enables tracking) or the regions of the frame. Any other content
+    type is read as the packed layout above.
+    """
+    trace = _request_trace(timing, traceparent)
+    started = time.perf_counter()
+    session_id = ""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        form = await request.form()
+        faces = await _client_faces_from_form(form)
+        session_id = str(form.get("session_id") or "")
+    else:
+        faces = _unpack_faces(await request.body())
+    if trace is not None:
+        trace.stages["read"] = time.perf_counter() - started
+    session = _request_session(request, session_id or x_session_id)
+    if _emotion_config.latest_frame_wins:
+        return await session.scheduler.submit(lambda: _process_frame(b"", session, "faces", trace, faces))
+    return await _process_frame(b"", session, "faces", trace, faces)
+
+
+@app.websocket("/vision/stream")
+async def vision_stream(websocket: WebSocket, session_id: str = "", timing: bool = False):
+    """Continuous frame stream: binary JPEG frames in, JSON results out.
+
+    Frames that arrive while the previous one is still being processed
+    replace each other, so only the newest waiting frame is analyzed and a
+    slow model never builds up a backlog.
+    """
+    await websocket.accept()
+    session_key = session_id.strip()[:128] or f"ws:{uuid.uuid4().hex}"
+    pending: tuple[int, bytes] | None = None
+    frame_ready = asyncio.Event()
+    received = 0
+    dropped = 0
+
+    async def process() -> None:
+        nonlocal pending
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if pending is None:
+                continue
+            seq, data = pending
+            pending = None
+            trace = _request_trace(timing, "")
+            try:
+                result = await _process_frame(data, _sessions.get(session_key), "ws", trace)
+            except Exception as exc:
+                # One bad frame must not end the stream; report it and take the next.
+                _logger.exception("vision stream %s: frame %d failed", session_key, seq)
+                result = {"error": f"Frame processing failed: {type(exc).__name__}"}
+            await websocket.send_json({**result, "frame_seq": seq, "dropped_frames": dropped})
+
+    worker = asyncio.create_task(process())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            data = message.get("bytes")
+            if not data:
+                continue
+            received += 1
+            if pending is not None:
+                dropped += 1
+            pending = (received, data)
+            frame_ready.set()
+            if worker.done():
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        worker.cancel()
+
+
+async def _process_frame(
+    data: bytes,
+    session: StreamSession,
+    transport: str = "http",
+    trace: RequestTrace | None = None,
+    faces: ClientFaces | None = None,
+) -> dict:
+    """Shared /vision core: detect faces in a frame and aggregate their emotions.
+
+    With client-located faces, data is unused and detection is skipped.
+    """
+    started = time.perf_counter()
+    token = _current_trace.set(trace) if trace is not None else None
+    # Per-request sessions (no session id) have nothing to share.
+    shared = _shared_store is not None and bool(session.key)
+    try:
+        if shared:
+            await _load_shared_session(session)
+        result = await _analyze_frame(data, session, faces)
+        # Static-gate answers change nothing worth sharing.
+        if shared and not result["cached"]:
+            await _save_shared_session(session)
+    finally:
+        _REQUEST_SECONDS.observe(time.perf_counter() - started, transport=transport)
+        if token is not None:
+            _current_trace.reset(token)
+    if trace is not None and trace.report:
+        result = {**result, "debug": {**result["debug"], "timing": trace.as_dict()}}
+    return result
+
+
+async def _analyze_frame(data: bytes, session: StreamSession, faces: ClientFaces | None = None) -> dict:
+    face_count = 0
+    emotion_counts: dict[str, int] = {}
+    # Set from the results actually used; stays "none" when no face got an answer.
+    sentiment_source = "none"
+    sentiment_error = None
+    emotion_raw = None
+    detected_faces = 0
+    analyzed_faces = 0
+    counts_source = "none"
+    timed_out_faces = 0
+    tracked_faces = 0
+    track_ids: list[int] = []
+    cache_hits = 0
+    cache_lookups = 0
+    tiers: Counter = Counter()
+
+    reference = None
+    if (
+        faces is None
+        and _emotion_config.frame_gate
+        and session.last_response is not None
+        and time.monotonic() - session.last_response_at <= _emotion_config.frame_gate_max_staleness
+    ):
+        reference = session.last_thumbnail
+    rois = None
+    if (
+        faces is None
+        and _emotion_config.detect_roi
+        and session.last_boxes
+        and session.frames_since_full_scan + 1 < _emotion_config.detect_full_scan_interval
+    ):
+        rois = session.last_boxes
+    trace = _current_trace.get()
+    cpu_started = time.perf_counter()
+    if faces is None:
+        detection: FrameDetection = await _run_cpu(
+            _detect_faces_in_frame, data, _detector_params(), reference, rois, _crop_params()
+        )
+        frame, size = data, len(data)
+    else:
+        detection = await _run_cpu(_prepare_client_faces, faces, _crop_params())
+        if faces.frame is None and not detection.decoded:
+            raise HTTPException(status_code=400, detail="No face crop could be decoded")
+        frame, size = faces.frame, faces.size
+    for stage, seconds in detection.timings.items():
+        _STAGE_SECONDS.observe(seconds, stage=stage)
+    for crop in detection.crops:
+        _CROP_BYTES.observe(len(crop), format=_image_format(crop))
+    if trace is not None:
+        cpu_ended = time.perf_counter()
+        trace.add_span("cpu_stage", cpu_started, cpu_ended, detector=detection.detector)
+        trace.stages["cpu"] = cpu_ended - cpu_started
+        trace.stages.update(detection.timings)
+    if detection.static and session.last_response is not None:
+        _STATIC_FRAMES.inc()
+        return {
+            **session.last_response,
+            "bytes": size,
+            "cached": True,
+            "debug": {**session.last_response["debug"], "frame_gate": "static", "frame_diff": detection.frame_diff},
+        }
+    inference_started = time.perf_counter()
+    if detection.decoded:
+        if faces is None:
+            if not detection.static:
+                _DETECTOR_SECONDS.observe(detection.timings.get("detect", 0.0), detector=detection.detector)
+            session.frames_since_full_scan = 0 if detection.scan == "full" else session.frames_since_full_scan + 1
+            session.last_boxes = detection.face_boxes
+        face_count = detection.face_count
+        detected_faces = face_count
+        _FACES_DETECTED.inc(face_count)
+
+        if face_count > 0:
+            cropped_blobs = detection.crops
+            analyzed_faces = len(cropped_blobs)
+            _FACES_ANALYZED.inc(analyzed_faces)
+
+            # Crops uploaded without boxes have no position to track by.
+            if _emotion_config.tracking and detection.boxes:
+                tracks = _match_tracks(session, detection.boxes, detection.signatures)
+                track_ids = [track.track_id for track in tracks]
+                now = time.monotonic()
+                pending = [
+                    idx
+                    for idx, track in enumerate(tracks)
+                    if not _track_result_reusable(track, detection.signatures[idx], now)
+                ]
+                fresh, cache_hits, cache_lookups = await _analyze_crops_cached(
+                    [cropped_blobs[idx] for idx in pending],
+                    [detection.hashes[idx] for idx in pending],
+                    tiers=tiers,
+                )
+                results = [track.result for track in tracks]
+                for idx, result in zip(pending, fresh):
+                    results[idx] = result
+                    # Only successful answers are cached on the track.
+                    if _result_reusable(result):
+                        tracks[idx].result = result
+                        tracks[idx].signature = detection.signatures[idx]
+                        tracks[idx].classified_at = now
+                tracked_faces = analyzed_faces - len(pending)
+                _TRACKED_FACES.inc(tracked_faces)
+                _CLASSIFIED_FACES.inc(len(pending))
+            else:
+                results, cache_hits, cache_lookups = await _analyze_crops_cached(
+                    cropped_blobs, detection.hashes, tiers=tiers
+                )
+            timed_out_faces = sum(1 for result in results if result is None)
+            if timed_out_faces:
+                sentiment_error = f"Deadline exceeded for {timed_out_faces} of {analyzed_faces} faces"
+
+            raw_chunks = []
+            for result in results:
+                if result is None:
+                    continue
+                detail, source, err, raw, counts = _stabilize_result(session, result)
+                sentiment_source = source
+                if err and not sentiment_error:
+                    sentiment_error = err
+                if raw:
+                    raw_chunks.append(raw)
+                if _has_nonzero_counts(counts):
+                    for k, v in counts.items():
+                        emotion_counts[k] = emotion_counts.get(k, 0) + v
+                    counts_source = "model-per-face"
+                else:
+                    emotion_counts[detail] = emotion_counts.get(detail, 0) + 1
+                    if counts_source == "none":
+                        counts_source = "fallback-per-face"
+
+            if raw_chunks:
+                emotion_raw = " | ".join(raw_chunks[:4])
+
+    if face_count == 0 and frame is not None:
+        # Fallback to whole-frame classification when no face box is found.
+        if detection.frame_hash is not None:
+            (frame_result,), cache_hits, cache_lookups = await _analyze_crops_cached(
+                [frame], [detection.frame_hash], batch=False, tiers=tiers
+            )
+        else:
+            (frame_result,) = await _analyze_crops([frame], batch=False, tiers=tiers)
+        if frame_result is None:
+            timed_out_faces = 1
+            frame_result = ("neutral", "fallback", "Deadline exceeded for full frame", None, None)
+        emotion_detail, sentiment_source, sentiment_error, emotion_raw, frame_counts = _stabilize_result(session, frame_result)
+        if _has_nonzero_counts(frame_counts):
+            emotion_counts = frame_counts or {}
+            face_count = max(1, sum(emotion_counts.values()))
+            counts_source = "model-full-frame"
+        else:
+            face_count = max(1, face_count)
+            emotion_counts = {emotion_detail: face_count}
+            counts_source = "fallback-full-frame"
+
+    if trace is not None:
+        inference_ended = time.perf_counter()
+        trace.add_span("inference", inference_started, inference_ended, faces=analyzed_faces or 1)
+        trace.stages["inference"] = inference_ended - inference_started
+    dominant_detail = _dominant_from_counts(emotion_counts) if emotion_counts else "neutral"
+    response = {
+        "face_count": face_count,
+        "bytes": size,
+        "sentiment": _emotion_bucket(dominant_detail),
+        "emotion_detail": dominant_detail,
+        "emotion_counts": emotion_counts,
+        "emotion_raw": emotion_raw,
+        "sentiment_source": sentiment_source,
+        "sentiment_error": sentiment_error,
+        "debug": {
+            "detected_faces": detected_faces,
+            "analyzed_faces": analyzed_faces,
+            "counts_source": counts_source,
+            "timed_out_faces": timed_out_faces,
+            "tracked_faces": tracked_faces,
+            "track_ids": track_ids,
+            "cache_hits": cache_hits,
+            "cache_misses": cache_lookups - cache_hits,
+            "local_faces": tiers["local"],
+            "remote_faces": tiers["remote"],
+            "frame_gate": "processed",
+            "frame_diff": detection.frame_diff,
+            "detector": detection.detector,
+            "detect_scan": detection.scan,
+            "detect_scale": detection.detect_scale,
+        },
+        "cached": False,
+        "superseded": False,
+    }
+    if detection.thumbnail is not None:
+        session.last_thumbnail = detection.thumbnail
+        session.last_response = response
+        session.last_response_at = time.monotonic()
+    return response
+
+
+class SentimentRequest(BaseModel):
+    text: str
+
+
+def analyze_sentiment(text: str) -> str:
+    # Simple heuristic for demo use; replace with real model as needed.
+    positive = {"good", "great", "excellent", "love", "happy", "awesome", "fantastic", "positive"}
+    negative = {"bad", "terrible", "awful", "hate", "sad", "angry", "negative", "horrible"}
+    tokens = {t.strip(".,!?;:").lower() for t in text.split()}
+    score = len(tokens & positive) - len(tokens & negative)
+    if score > 0:
+        return "positive"
+    if score < 0:
+        return "negative"
+    return "neutral"
+
+
+@app.post("/sentiment")
+async def sentiment(payload: SentimentRequest):
+    label = analyze_sentiment(payload.text)
+    return {"sentiment": label}
+
+
+@app.get("/health")
+async def health():
+    delay = _hedge_delay()
+    return {
+        "status": "ok",
+        "detector": _detector_warmup,
+        "emotion_engine": _emotion_config.emotion_engine,
+        "local_classifier": _local_classifier_warmup,
+        "emotion_upstreams": [upstream.snapshot(_emotion_config) for upstream in _emotion_upstreams()],
+        "lb_policy": _emotion_config.lb_policy,
+        "hedge_delay_ms": round(delay * 1000, 3) if delay is not None else None,
+        # Metrics and most state are per process; this tells workers apart.
+        "worker_pid": os.getpid(),
+        "web_workers": _WEB_WORKERS,
+        "shared_store": _shared_store.kind if _shared_store is not None else None,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return render_metrics()
+
+
+@app.get("/emotion-config")
+async def get_emotion_config():
+    return _emotion_config
+
+
+@app.post("/emotion-config")
+async def set_emotion_config(payload: EmotionConfig):
+    # Start from the latest saved config, which another worker may have changed.
+    changed = _reload_emotion_config()
+    # Only fields present in the request are applied so clients that post
+    # endpoint/token/model alone keep the tuned client settings.
+    for field in payload.model_fields_set:
+        value = getattr(payload, field)
+        setattr(_emotion_config, field, value.strip() if isinstance(value, str) else value)
+    _save_emotion_config(_emotion_config, payload.model_fields_set)
+    await _apply_config_changes(changed | payload.model_fields_set)
+    return _emotion_config
+
+
+async def _apply_config_changes(fields: set[str]) -> None:
+    _emotion_upstreams()
+    if "detector" in fields:
+        await _warm_up_detectors()
+    if fields & {"emotion_engine", "local_fallback"}:
+        await _warm_up_classifiers()
+
+
+async def _watch_emotion_config() -> None:
+    while True:
+        await asyncio.sleep(_CONFIG_WATCH_INTERVAL)
+        try:
+            changed = _reload_emotion_config()
+            if changed:
+                await _apply_config_changes(changed)
+        except Exception:
+            # Keep watching; the next change is applied normally.
+            continue
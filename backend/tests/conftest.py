@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+# main reads its config at import; never let it touch /data.
+os.environ["EMOTION_CONFIG_PATH"] = os.path.join(tempfile.mkdtemp(), "emotion-config.json")
+
+import main  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def emotion_config(tmp_path, monkeypatch):
+    """A fresh default config persisted under tmp_path for every test."""
+    monkeypatch.setattr(main, "_config_path", tmp_path / "emotion-config.json")
+    monkeypatch.setattr(main, "_config_stamp", None)
+    config = main.EmotionConfig()
+    monkeypatch.setattr(main, "_emotion_config", config)
+    return config
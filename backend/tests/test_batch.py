@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+
+ENDPOINT = "http://upstream/v1/chat/completions"
+
+
+def images(request: httpx.Request) -> int:
+    content = json.loads(request.content)["messages"][1]["content"]
+    return sum(1 for part in content if part["type"] == "image_url")
+
+
+def answer(count: int) -> httpx.Response:
+    faces = [{"index": idx, "emotion": "happy"} for idx in range(count)]
+    message = {"content": json.dumps({"faces": faces})}
+    return httpx.Response(200, json={"choices": [{"message": message}]})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """A batch-capable upstream answering through handler(request), set per test."""
+    upstream = main.Upstream(ENDPOINT)
+    upstream.model = "model"
+    upstream.handler = lambda request: answer(images(request))
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: upstream.handler(request)))
+    monkeypatch.setattr(main, "_emotion_upstreams", lambda: [upstream])
+    monkeypatch.setattr(main, "_batch_rejections", {})
+    return upstream
+
+
+def run(crops: list[bytes]):
+    return asyncio.run(main.analyze_faces_batch(crops))
+
+
+def test_rejections_pause_batching_only_after_the_limit(upstream):
+    upstream.handler = lambda request: httpx.Response(422, text="one image only")
+    for _ in range(main._BATCH_REJECT_LIMIT - 1):
+        assert run([b"a", b"b"]) is None
+        assert main._batch_capable(upstream)
+    assert run([b"a", b"b"]) is None
+    assert not main._batch_capable(upstream)
+
+
+def test_paused_batching_is_retried_and_cleared_by_a_success(upstream, monkeypatch):
+    main._batch_rejections[(ENDPOINT, "model")] = (main._BATCH_REJECT_LIMIT, main.time.monotonic())
+    assert not main._batch_capable(upstream)
+    monkeypatch.setattr(main, "_BATCH_REJECT_PAUSE", 0.0)
+    assert main._batch_capable(upstream)
+    assert [result[0] for result in run([b"a", b"b"])] == ["happy", "happy"]
+    assert main._batch_rejections == {}
+
+
+def test_success_resets_the_rejection_count(upstream):
+    main._batch_rejections[(ENDPOINT, "model")] = (main._BATCH_REJECT_LIMIT - 1, main.time.monotonic())
+    run([b"a", b"b"])
+    assert main._batch_rejections == {}
+
+
+def test_too_large_batch_is_split(upstream):
+    sizes = []
+
+    def handler(request):
+        sizes.append(images(request))
+        return httpx.Response(413) if sizes[-1] > 2 else answer(sizes[-1])
+
+    upstream.handler = handler
+    results = run([b"a", b"b", b"c", b"d", b"e"])
+    assert [result[0] for result in results] == ["happy"] * 5
+    assert sorted(sizes) == [1, 2, 2, 3, 5]
+    assert main._batch_rejections == {}
+    assert main._batch_capable(upstream)
+
+
+def test_split_half_that_cannot_batch_goes_per_crop(upstream, monkeypatch):
+    def handler(request):
+        count = images(request)
+        return httpx.Response(413) if count > 1 else httpx.Response(200, json={"choices": [{"message": {"content": "?"}}]})
+
+    async def single(crop):
+        return ("sad", "nim-chat", None, None, None)
+
+    upstream.handler = handler
+    monkeypatch.setattr(main, "analyze_face_sentiment", single)
+    assert [result[0] for result in run([b"a", b"b"])] == ["sad", "sad"]
+
+
+def test_single_crop_too_large_is_left_to_the_caller(upstream):
+    upstream.handler = lambda request: httpx.Response(413)
+    assert run([b"a"]) is None
+    assert main._batch_rejections == {}
+
+
+def call_counts() -> dict[str, float]:
+    return {
+        dict(pairs)["sentiment_source"]: value
+        for suffix, pairs, value in main._EMOTION_CALL_SECONDS.samples()
+        if suffix == "_count"
+    }
+
+
+@pytest.mark.parametrize(("status", "source"), [(200, "nim-chat"), (500, "fallback"), (422, "fallback")])
+def test_call_is_labelled_by_its_result_source(upstream, monkeypatch, status, source):
+    monkeypatch.setattr(main._EMOTION_CALL_SECONDS, "_values", {})
+    if status != 200:
+        upstream.handler = lambda request: httpx.Response(status, text="no")
+    results = run([b"a", b"b"])
+    assert call_counts() == {source: 1}
+    if results is not None:
+        assert {result[1] for result in results} == {source}
@@ -0,0 +1,71 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def upstream(emotion_config):
+    emotion_config.breaker_failures = 2
+    emotion_config.breaker_cooldown = 0.0
+    return main.Upstream("http://upstream/v1/chat/completions")
+
+
+def open_with_late_call(upstream, config):
+    """Admit a call while closed, then fail the breaker open behind its back."""
+    late = upstream.admit(config)
+    for _ in range(config.breaker_failures):
+        upstream.finish(config, "single", False, probe=upstream.admit(config))
+    assert upstream.state == "open"
+    return late
+
+
+def test_closed_calls_are_not_probes(upstream, emotion_config):
+    assert upstream.admit(emotion_config) is False
+    assert upstream.probe_in_flight is False
+
+
+def test_probe_success_closes(upstream, emotion_config):
+    open_with_late_call(upstream, emotion_config)
+    assert upstream.admit(emotion_config) is True
+    assert upstream.state == "half_open"
+    assert not upstream.admissible(emotion_config)
+    upstream.finish(emotion_config, "single", True, probe=True)
+    assert upstream.state == "closed"
+    assert upstream.failures == 0
+    assert upstream.admissible(emotion_config)
+
+
+def test_probe_failure_reopens(upstream, emotion_config):
+    open_with_late_call(upstream, emotion_config)
+    upstream.admit(emotion_config)
+    upstream.finish(emotion_config, "single", False, probe=True)
+    assert upstream.state == "open"
+    assert upstream.probe_in_flight is False
+
+
+@pytest.mark.parametrize("ok", [True, False, None])
+def test_late_call_leaves_probe_alone(upstream, emotion_config, ok):
+    late = open_with_late_call(upstream, emotion_config)
+    assert upstream.admit(emotion_config) is True
+    upstream.finish(emotion_config, "single", ok, probe=late)
+    assert upstream.state == "half_open"
+    assert upstream.probe_in_flight is True
+    assert not upstream.admissible(emotion_config)
+
+
+def test_cancelled_probe_admits_another(upstream, emotion_config):
+    open_with_late_call(upstream, emotion_config)
+    upstream.admit(emotion_config)
+    upstream.finish(emotion_config, "single", None, probe=True)
+    assert upstream.state == "half_open"
+    assert upstream.admit(emotion_config) is True
+
+
+def test_acquire_reports_the_probe(upstream, emotion_config, monkeypatch):
+    monkeypatch.setattr(main, "_emotion_upstreams", lambda: [upstream])
+    assert main._acquire_upstream() == (upstream, False)
+    upstream.finish(emotion_config, "single", False)
+    upstream.finish(emotion_config, "single", False)
+    assert main._acquire_upstream() == (upstream, True)
+    with pytest.raises(main.CircuitOpenError):
+        main._acquire_upstream()
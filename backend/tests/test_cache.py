@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import main
+
+IDENTITY = ("http://upstream/v1/chat/completions", "model")
+HASH = 0x1234_5678_9ABC_DEF0
+RESULT = ("happy", "nim-chat", None, "happy", None)
+ENTRY = main._CACHE_ENTRY_OVERHEAD + len("happy")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_near_duplicate_within_the_hamming_threshold_hits():
+    cache = main.ResultCache()
+    cache.put(IDENTITY, HASH, RESULT, 60, 1 << 20)
+    # Three flipped bits, spread over three bands.
+    near = HASH ^ (1 << 3) ^ (1 << 20) ^ (1 << 40)
+    assert cache.get(IDENTITY, near, 3) == RESULT
+    assert cache.get(IDENTITY, near, 2) is None
+    assert cache.get(IDENTITY, HASH, 0) == RESULT
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_beyond_the_threshold_or_another_identity_misses():
+    cache = main.ResultCache()
+    cache.put(IDENTITY, HASH, RESULT, 60, 1 << 20)
+    assert cache.get(IDENTITY, HASH ^ 0b1111, 3) is None
+    assert cache.get(("http://other", "model"), HASH, 3) is None
+
+
+def test_closest_entry_wins():
+    cache = main.ResultCache()
+    far = ("sad", "nim-chat", None, "sad", None)
+    cache.put(IDENTITY, HASH ^ 0b11, far, 60, 1 << 20)
+    cache.put(IDENTITY, HASH ^ 0b1, RESULT, 60, 1 << 20)
+    assert cache.get(IDENTITY, HASH, 3) == RESULT
+
+
+def test_expired_entry_is_dropped_with_its_bands(clock):
+    cache = main.ResultCache()
+    cache.put(IDENTITY, HASH, RESULT, 5, 1 << 20)
+    clock[0] += 4
+    assert cache.get(IDENTITY, HASH ^ 1, 1) == RESULT
+    clock[0] += 1
+    assert cache.get(IDENTITY, HASH ^ 1, 1) is None
+    assert len(cache) == 0 and cache.bytes == 0
+    assert cache._bands == {}
+
+
+def test_lru_eviction_keeps_the_band_index_in_step():
+    cache = main.ResultCache()
+    first, second, third = HASH, HASH ^ (0xFFFF << 16), HASH ^ (0xFFFF << 48)
+    cache.put(IDENTITY, first, RESULT, 60, 2 * ENTRY)
+    cache.put(IDENTITY, second, RESULT, 60, 2 * ENTRY)
+    # Reading first makes second the least recently used.
+    assert cache.get(IDENTITY, first, 0) == RESULT
+    cache.put(IDENTITY, third, RESULT, 60, 2 * ENTRY)
+    assert len(cache) == 2 and cache.bytes == 2 * ENTRY
+    assert cache.get(IDENTITY, second, 0) is None
+    members = set().union(*cache._bands.values())
+    assert members == {first, third}
+    assert all(cache._bands.values())
+
+
+def test_entry_larger_than_the_cache_is_not_stored():
+    cache = main.ResultCache()
+    cache.put(IDENTITY, HASH, RESULT, 60, ENTRY - 1)
+    assert len(cache) == 0 and cache._bands == {}
+
+
+def test_lookups_are_only_reported_when_the_cache_is_consulted(monkeypatch):
+    async def analyze_crops(crops, batch=True, tiers=None):
+        return [RESULT] * len(crops)
+
+    monkeypatch.setattr(main, "_analyze_crops", analyze_crops)
+    monkeypatch.setattr(main, "_result_cache", main.ResultCache())
+    crops, hashes = [b"a", b"b"], [HASH, HASH ^ (0xFFFF << 32)]
+
+    # Stub mode: no upstream, so no cache.
+    assert asyncio.run(main._analyze_crops_cached(crops, hashes))[1:] == (0, 0)
+
+    upstream = main.Upstream(IDENTITY[0])
+    upstream.model = IDENTITY[1]
+    monkeypatch.setattr(main, "_emotion_upstreams", lambda: [upstream])
+    assert asyncio.run(main._analyze_crops_cached(crops, hashes))[1:] == (0, 2)
+    assert asyncio.run(main._analyze_crops_cached(crops, hashes))[1:] == (2, 2)
+    main._emotion_config.cache_enabled = False
+    assert asyncio.run(main._analyze_crops_cached(crops, hashes))[1:] == (0, 0)
@@ -0,0 +1,54 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_post_persists_only_the_posted_fields():
+    client = TestClient(main.app)
+    resp = client.post("/emotion-config", json={"endpoint": "http://model/v1/chat/completions", "model": "m"})
+    assert resp.status_code == 200
+    assert json.loads(main._config_path.read_text()) == {"endpoint": "http://model/v1/chat/completions", "model": "m"}
+
+    client.post("/emotion-config", json={"cache_ttl": 5.0})
+    saved = json.loads(main._config_path.read_text())
+    assert saved == {"endpoint": "http://model/v1/chat/completions", "model": "m", "cache_ttl": 5.0}
+
+
+def test_env_defaults_apply_under_saved_overrides(monkeypatch):
+    main._config_path.write_text(json.dumps({"model": "saved"}))
+    monkeypatch.setenv("EMOTION_ENDPOINT", "http://env/v1/chat/completions")
+    monkeypatch.setenv("EMOTION_MODEL", "env-model")
+
+    config = main._load_emotion_config()
+
+    assert config.model == "saved"
+    assert config.endpoint == "http://env/v1/chat/completions"
+    # Tunables missing from the file keep their (env-derived) field defaults.
+    assert config.cache_ttl == main.EmotionConfig.model_fields["cache_ttl"].default
+
+
+def test_invalid_file_falls_back_to_env(monkeypatch):
+    main._config_path.write_text("{not json")
+    monkeypatch.setenv("EMOTION_MODEL", "env-model")
+    assert main._load_emotion_config().model == "env-model"
+
+
+def test_reload_applies_changes_from_other_workers():
+    main._save_emotion_config(main.EmotionConfig(detect_min_size=20), {"detect_min_size"})
+    assert main._reload_emotion_config() == set()
+
+    # Another worker rewrites the file.
+    main._config_path.write_text(json.dumps({"detect_min_size": 30, "model": "other"}))
+    main._config_stamp = None
+    assert main._reload_emotion_config() == {"detect_min_size", "model"}
+    assert main._emotion_config.detect_min_size == 30
+    assert main._emotion_config.model == "other"
+
+
+def test_reload_ignores_unreadable_file():
+    main._emotion_config.model = "kept"
+    main._config_path.write_text("{truncated")
+    assert main._reload_emotion_config() == set()
+    assert main._emotion_config.model == "kept"
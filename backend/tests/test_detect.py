@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+
+import main
+
+FRAME = cv2.imencode(".jpg", np.full((720, 1280, 3), 128, dtype=np.uint8))[1].tobytes()
+
+
+def overlaps(a, b) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def test_face_that_leaves_its_roi_is_found_by_a_full_rescan(emotion_config, monkeypatch):
+    emotion_config.frame_gate = False
+    emotion_config.detect_roi = True
+    emotion_config.detect_full_scan_interval = 10
+    face = [(240, 300, 120, 120)]
+    scans = []
+
+    def detect_boxes(detector, image, params, rois):
+        scans.append("roi" if rois else "full")
+        if rois:
+            return [box for box in face if any(overlaps(box, roi) for roi in rois)], 1.0
+        return list(face), 1.0
+
+    monkeypatch.setattr(main, "_detect_boxes", detect_boxes)
+    frame_calls = []
+    real_analyze = main._analyze_crops_cached
+
+    async def analyze_crops_cached(crops, hashes, batch=True, tiers=None):
+        frame_calls.append(batch)
+        return await real_analyze(crops, hashes, batch, tiers)
+
+    monkeypatch.setattr(main, "_analyze_crops_cached", analyze_crops_cached)
+    client = TestClient(main.app)
+    post = lambda: client.post(  # noqa: E731
+        "/vision", content=FRAME, headers={"Content-Type": "image/jpeg", "X-Session-Id": "cam"}
+    ).json()
+
+    first = post()
+    assert first["debug"]["detect_scan"] == "full" and first["face_count"] == 1
+    face[0] = (920, 300, 120, 120)
+    moved = post()
+    assert scans == ["full", "roi", "full"]
+    assert moved["debug"]["detect_scan"] == "full"
+    assert moved["debug"]["detected_faces"] == 1
+    assert moved["debug"]["counts_source"] == "fallback-per-face"
+    # Both frames classified crops; neither fell back to a whole-frame call.
+    assert frame_calls == [True, True]
+    face.clear()
+    nobody = post()
+    assert scans[3:] == ["roi", "full"]
+    assert nobody["debug"]["counts_source"] == "fallback-full-frame"
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+def jpeg(seed: int = 0) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 256, (48, 48), dtype=np.uint8)
+    return cv2.imencode(".jpg", pixels)[1].tobytes()
+
+
+def packed(crops: list[bytes], count: int | None = None) -> bytes:
+    body = main._PACKED_COUNT.pack(len(crops) if count is None else count)
+    for crop in crops:
+        body += main._PACKED_FACE.pack(0, 0, 0, 0, len(crop)) + crop
+    return body
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def post_packed(client, body):
+    return client.post("/vision/faces", content=body, headers={"Content-Type": "application/octet-stream"})
+
+
+@pytest.mark.parametrize("body", [packed([]), packed([b"not a jpeg", b"\xff\xd8\xff"])])
+def test_no_decodable_faces_is_rejected(client, body):
+    assert post_packed(client, body).status_code == 400
+
+
+def test_zero_count_with_a_payload_is_rejected(client):
+    assert post_packed(client, packed([jpeg()], count=0)).status_code == 400
+
+
+def test_empty_multipart_is_rejected(client):
+    resp = client.post("/vision/faces", data={"boxes": ""}, files={"other": ("x", b"", "text/plain")})
+    assert resp.status_code == 400
+
+
+def test_face_count_skips_undecodable_crops(client):
+    resp = post_packed(client, packed([jpeg(1), b"not a jpeg", jpeg(2)]))
+    assert resp.status_code == 200
+    result = resp.json()
+    assert result["face_count"] == 2
+    assert result["debug"]["analyzed_faces"] == 2
+    assert result["sentiment_source"] == "stub"
+    assert result["debug"]["counts_source"] == "fallback-per-face"
+    # Stub mode never consults the cache.
+    assert result["debug"]["cache_misses"] == 0
+
+
+def test_source_is_none_without_an_answer(client, monkeypatch):
+    async def timed_out(crops, hashes, batch=True, tiers=None):
+        return [None] * len(crops), 0, 0
+
+    monkeypatch.setattr(main, "_analyze_crops_cached", timed_out)
+    result = post_packed(client, packed([jpeg()])).json()
+    assert result["face_count"] == 1
+    assert result["debug"]["timed_out_faces"] == 1
+    assert result["sentiment_source"] == "none"
+    assert result["debug"]["counts_source"] == "none"
+
+
+@pytest.mark.parametrize(
+    "files",
+    [
+        [("faces", ("a.jpg", jpeg(), "image/jpeg")), ("faces", ("b.jpg", b"", "image/jpeg"))],
+        [("frame", ("frame.jpg", b"", "image/jpeg"))],
+    ],
+)
+def test_empty_multipart_part_is_rejected(files):
+    client = TestClient(main.app, raise_server_exceptions=False)
+    assert client.post("/vision/faces", files=files).status_code == 400
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+def encode(ext: str, width: int, height: int) -> bytes:
+    return cv2.imencode(ext, np.zeros((height, width, 3), dtype=np.uint8))[1].tobytes()
+
+
+def test_jpeg_size_reads_the_frame_header():
+    assert main._jpeg_size(encode(".jpg", 320, 200)) == (320, 200)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"\xff\xd8", encode(".jpg", 320, 200)[:20], b"\xff\xd8\x00\x00" + b"\x00" * 16, encode(".png", 32, 32)],
+)
+def test_jpeg_size_rejects_truncated_and_other_images(data):
+    assert main._jpeg_size(data) is None
+
+
+@pytest.mark.parametrize(
+    ("max_width", "factor", "width"),
+    [(0, 1, 1920), (1920, 1, 1920), (960, 2, 960), (700, 2, 960), (480, 4, 480), (100, 8, 240)],
+)
+def test_decode_reduction_factor(max_width, factor, width):
+    img, chosen = main._decode_frame(encode(".jpg", 1920, 1080), max_width, gray_only=False)
+    assert chosen == factor
+    assert img.shape[1] == width
+
+
+def test_non_jpeg_is_decoded_at_full_size():
+    img, factor = main._decode_frame(encode(".png", 640, 480), 100, gray_only=True)
+    assert factor == 1
+    assert img.shape == (480, 640)
+
+
+@pytest.mark.parametrize("content_type", ["image/jpeg", "image/png"])
+def test_empty_raw_body_is_rejected(content_type):
+    client = TestClient(main.app, raise_server_exceptions=False)
+    resp = client.post("/vision", content=b"", headers={"Content-Type": content_type})
+    assert resp.status_code == 400
+
+
+def test_empty_multipart_frame_is_rejected():
+    client = TestClient(main.app, raise_server_exceptions=False)
+    resp = client.post("/vision", files={"frame": ("frame.jpg", b"", "image/jpeg")})
+    assert resp.status_code == 400
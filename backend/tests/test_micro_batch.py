@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def answer(crop: bytes, source: str) -> tuple:
+    return (crop.decode(), source, None, None, None)
+
+
+@pytest.fixture
+def backend(emotion_config, monkeypatch):
+    """Fake upstream: records every batch and single call; crops named "fail" raise."""
+    emotion_config.batch_max_size = 3
+    emotion_config.batch_max_wait = 0.02
+    calls = {"batch": [], "single": [], "batch_answer": True}
+
+    async def analyze_faces_batch(crops):
+        calls["batch"].append(list(crops))
+        if not calls["batch_answer"]:
+            return None
+        return [answer(crop, "batch") for crop in crops]
+
+    async def analyze_face_sentiment(crop):
+        calls["single"].append(crop)
+        if crop == b"fail":
+            raise RuntimeError("upstream exploded")
+        return answer(crop, "single")
+
+    monkeypatch.setattr(main, "analyze_faces_batch", analyze_faces_batch)
+    monkeypatch.setattr(main, "analyze_face_sentiment", analyze_face_sentiment)
+    return calls
+
+
+def test_max_size_flushes_without_waiting(backend, emotion_config):
+    emotion_config.batch_max_wait = 10.0
+
+    async def scenario():
+        batcher = main.MicroBatcher()
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.submit([b"a", b"b"]), batcher.submit([b"c"])), timeout=1.0
+        )
+
+    first, second = asyncio.run(scenario())
+    assert first == [answer(b"a", "batch"), answer(b"b", "batch")]
+    assert second == [answer(b"c", "batch")]
+    assert backend["batch"] == [[b"a", b"b", b"c"]]
+
+
+def test_max_wait_flushes_a_partial_batch(backend):
+    async def scenario():
+        batcher = main.MicroBatcher()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = asyncio.create_task(batcher.submit([b"a"]))
+        await asyncio.sleep(0.005)
+        results = await asyncio.gather(first, batcher.submit([b"b"]))
+        return results, loop.time() - started
+
+    (first, second), elapsed = asyncio.run(scenario())
+    assert first == [answer(b"a", "batch")] and second == [answer(b"b", "batch")]
+    assert backend["batch"] == [[b"a", b"b"]]
+    assert 0.015 <= elapsed < 0.5
+
+
+def test_overflow_starts_the_next_batch(backend):
+    async def scenario():
+        return await main.MicroBatcher().submit([b"a", b"b", b"c", b"d"])
+
+    assert [result[0] for result in asyncio.run(scenario())] == ["a", "b", "c", "d"]
+    assert backend["batch"] == [[b"a", b"b", b"c"]]
+    # A lone crop goes through the single-image call.
+    assert backend["single"] == [b"d"]
+
+
+def test_single_crop_passes_through(backend):
+    async def scenario():
+        return await main.MicroBatcher().submit([b"a"])
+
+    assert asyncio.run(scenario()) == [answer(b"a", "single")]
+    assert backend["batch"] == [] and backend["single"] == [b"a"]
+
+
+def test_failed_crop_falls_back_alone(backend):
+    backend["batch_answer"] = False
+
+    async def scenario():
+        batcher = main.MicroBatcher()
+        return await asyncio.gather(batcher.submit([b"a"]), batcher.submit([b"fail", b"c"]))
+
+    first, second = asyncio.run(scenario())
+    assert first == [answer(b"a", "single")]
+    assert second[0] == ("neutral", "fallback", "upstream exploded", None, None)
+    assert second[1] == answer(b"c", "single")
+
+
+def test_failed_batch_call_answers_every_caller(backend, monkeypatch):
+    async def broken(crops):
+        raise RuntimeError("batch exploded")
+
+    monkeypatch.setattr(main, "analyze_faces_batch", broken)
+
+    async def scenario():
+        batcher = main.MicroBatcher()
+        return await asyncio.gather(batcher.submit([b"a"]), batcher.submit([b"b"]))
+
+    fallback = ("neutral", "fallback", "batch exploded", None, None)
+    assert asyncio.run(scenario()) == [[fallback], [fallback]]
+
+
+def test_cancelled_caller_is_left_out_of_the_batch(backend):
+    async def scenario():
+        batcher = main.MicroBatcher()
+        gone = asyncio.create_task(batcher.submit([b"gone"]))
+        await asyncio.sleep(0)
+        gone.cancel()
+        return await batcher.submit([b"a", b"b"])
+
+    assert asyncio.run(scenario()) == [answer(b"a", "batch"), answer(b"b", "batch")]
+    assert backend["batch"] == [[b"a", b"b"]]
@@ -0,0 +1,60 @@
+import pytest
+
+import main
+
+
+def _chat(text):
+    return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"emotion_counts": {"happy": 2, "sad": 0}}', {"happy": 2}),
+        ('```json\n{"emotion_counts": {"Anger": 1}}\n```', {"angry": 1}),
+        ('Here is the analysis: {"emotion_counts": {"joy": 1}} Let me know.', {"joy": 1}),
+        ('Here is [1 face]: {"emotion_counts": {"happy": 1}}', {"happy": 1}),
+        ('{"faces": [{"index": 0, "emotion": "sad"}, {"index": 1, "emotion": "sad"}]}', {"sad": 2}),
+        ("[2]", {}),
+        ('["happy"]', {}),
+        ('I see {braces} but {"emotion_counts": {"fear": 1}}', {"fear": 1}),
+        ('{"emotion_counts": {"happy": 1', {}),
+        ("happy", {}),
+    ],
+)
+def test_extract_counts(text, expected):
+    assert main._extract_counts_from_text(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"faces": [{"index": 1, "emotion": "sad"}, {"index": 0, "emotion": "happy"}]}', ["happy", "sad"]),
+        ('[{"emotion": "angry"}, {"label": "joyful"}]', ["angry", "joy"]),
+        ('Result: ["happy", "sad"]', ["happy", "sad"]),
+        ("[2, [1]]", []),
+        ("no json here", []),
+    ],
+)
+def test_extract_face_emotions(text, expected):
+    assert main._extract_face_emotions_from_text(text) == expected
+
+
+def test_json_payload_only_accepts_arrays_when_asked():
+    assert main._extract_json_payload("[1, 2]") is None
+    assert main._extract_json_payload("[1, 2]", arrays=True) == [1, 2]
+    assert main._extract_json_payload('x [1] {"a": 1}') == {"a": 1}
+
+
+def test_chat_message_text_joins_content_parts():
+    data = {"choices": [{"message": {"content": [{"type": "text", "text": "happy"}, {"type": "text", "text": "!"}]}}]}
+    assert main._chat_message_text(data) == "happy !"
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [("Happy.", "happy"), ("The person looks upset and tense.", "sad"), ("unclear", "neutral")],
+)
+def test_emotion_detail_from_text(text, expected):
+    assert main._emotion_detail_from_text(text) == expected
+
@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+
+
+def pool(monkeypatch, *outstanding: int, weights=None) -> list[main.Upstream]:
+    upstreams = []
+    for idx, count in enumerate(outstanding):
+        upstream = main.Upstream(f"http://upstream-{idx}/v1/chat/completions")
+        upstream.outstanding = count
+        upstream.weight = weights[idx] if weights else 1.0
+        upstreams.append(upstream)
+    monkeypatch.setattr(main, "_emotion_upstreams", lambda: upstreams)
+    return upstreams
+
+
+def test_least_outstanding_picks_the_least_loaded(monkeypatch):
+    upstreams = pool(monkeypatch, 3, 0, 1)
+    assert main._acquire_upstream()[0] is upstreams[1]
+    assert upstreams[1].calls == 1
+
+
+def test_weight_scales_the_load(monkeypatch):
+    # (3 + 1) / 4 = 1.0 beats (1 + 1) / 1 = 2.0.
+    upstreams = pool(monkeypatch, 1, 3, weights=[1.0, 4.0])
+    assert main._acquire_upstream()[0] is upstreams[1]
+
+
+def test_saturated_upstream_only_takes_calls_when_all_are(monkeypatch):
+    upstreams = pool(monkeypatch, 1, 5)
+    upstreams[0].max_concurrency = 1
+    assert main._acquire_upstream()[0] is upstreams[1]
+    upstreams[1].max_concurrency = 5
+    # Both full: fewest queued calls per slot, (1 + 1) / 1 against (5 + 1) / 5.
+    assert main._acquire_upstream()[0] is upstreams[1]
+
+
+def test_p2c_takes_the_less_loaded_of_two_random_picks(emotion_config, monkeypatch):
+    emotion_config.lb_policy = "p2c"
+    upstreams = pool(monkeypatch, 0, 4, 2)
+    picks = []
+
+    def choices(candidates, weights, k):
+        picks.append((list(candidates), weights, k))
+        return [upstreams[1], upstreams[2]]
+
+    monkeypatch.setattr(main.random, "choices", choices)
+    assert main._acquire_upstream()[0] is upstreams[2]
+    assert picks == [(upstreams, [1.0, 1.0, 1.0], 2)]
+
+
+def test_p2c_with_two_candidates_compares_both(emotion_config, monkeypatch):
+    emotion_config.lb_policy = "p2c"
+    upstreams = pool(monkeypatch, 2, 1)
+    monkeypatch.setattr(main.random, "choices", lambda *args, **kwargs: pytest.fail("no sampling needed"))
+    assert main._acquire_upstream()[0] is upstreams[1]
+
+
+def test_open_breaker_is_skipped(emotion_config, monkeypatch):
+    upstreams = pool(monkeypatch, 5, 0)
+    upstreams[1].state = "open"
+    upstreams[1].opened_at = time.monotonic()
+    assert main._acquire_upstream()[0] is upstreams[0]
+    upstreams[0].state = "open"
+    upstreams[0].opened_at = time.monotonic()
+    assert main._upstreams_down()
+    with pytest.raises(main.CircuitOpenError):
+        main._acquire_upstream()
+
+
+def test_eligible_filters_candidates(monkeypatch):
+    upstreams = pool(monkeypatch, 5, 0)
+    assert main._acquire_upstream(lambda upstream: upstream is upstreams[0])[0] is upstreams[0]
+
+
+def test_adaptive_timeout_follows_the_latency_percentile(emotion_config):
+    emotion_config.read_timeout = 10.0
+    emotion_config.adaptive_timeout_min = 0.5
+    emotion_config.adaptive_timeout_multiplier = 3.0
+    upstream = main.Upstream("http://upstream/v1/chat/completions")
+    for _ in range(main._LATENCY_MIN_SAMPLES - 1):
+        upstream.latency["single"].add(0.4)
+    # Too few samples to trust.
+    assert upstream.timeout(emotion_config, "single") == 10.0
+    upstream.latency["single"].add(0.4)
+    assert upstream.timeout(emotion_config, "single") == pytest.approx(1.2)
+    assert upstream.timeout(emotion_config, "batch") == 10.0
+    for _ in range(256):
+        upstream.latency["single"].add(0.01)
+    assert upstream.timeout(emotion_config, "single") == 0.5
+    emotion_config.adaptive_timeout = False
+    assert upstream.timeout(emotion_config, "single") == 10.0
+
+
+def test_hedge_delay_uses_the_fastest_closed_upstream(emotion_config, monkeypatch):
+    emotion_config.hedge = True
+    emotion_config.hedge_percentile = 50.0
+    upstreams = pool(monkeypatch, 0, 0, 0)
+    for upstream, latency in zip(upstreams, (0.3, 0.1, 0.05)):
+        for _ in range(main._LATENCY_MIN_SAMPLES):
+            upstream.latency["single"].add(latency)
+    upstreams[2].state = "open"
+    assert main._hedge_delay() == 0.1
+    emotion_config.hedge = False
+    assert main._hedge_delay() is None
+
+
+@pytest.fixture
+def slow_primary(monkeypatch):
+    """The first call hangs until cancelled, every later call answers at once."""
+    calls = {"count": 0, "cancelled": []}
+
+    async def request(frame_bytes, span_id=None):
+        calls["count"] += 1
+        number = calls["count"]
+        if number == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                calls["cancelled"].append(number)
+                raise
+        return ("happy", "nim-chat", None, None, None)
+
+    monkeypatch.setattr(main, "_request_face_sentiment", request)
+    monkeypatch.setattr(main, "_hedge_delay", lambda: 0.01)
+    return calls
+
+
+def test_hedge_fires_and_cancels_the_loser(slow_primary, monkeypatch):
+    monkeypatch.setattr(main, "_take_hedge", lambda: True)
+
+    async def scenario():
+        result = await asyncio.wait_for(main._hedged_face_sentiment(b"crop", None), timeout=1.0)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(scenario())[1] == "nim-chat"
+    assert slow_primary["count"] == 2
+    assert slow_primary["cancelled"] == [1]
+
+
+def test_no_hedge_without_budget(slow_primary, monkeypatch):
+    monkeypatch.setattr(main, "_take_hedge", lambda: False)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(main._hedged_face_sentiment(b"crop", None), timeout=0.1)
+
+    asyncio.run(scenario())
+    assert slow_primary["count"] == 1
+
+
+def test_hedge_budget_is_a_share_of_calls(emotion_config, monkeypatch):
+    emotion_config.hedge_budget = 0.1
+    upstreams = pool(monkeypatch, 0)
+    upstreams[0].calls = 20
+    monkeypatch.setattr(main, "_hedges_sent", 0)
+    assert [main._take_hedge() for _ in range(3)] == [True, True, False]
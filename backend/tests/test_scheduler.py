@@ -0,0 +1,111 @@
+import asyncio
+
+import main
+
+
+def superseded_total() -> float:
+    return sum(value for _, _, value in main._SUPERSEDED_REQUESTS.samples())
+
+
+class Jobs:
+    """Frame jobs that finish when released; records the order they started in."""
+
+    def __init__(self) -> None:
+        self.started: list[str] = []
+        self.gates: dict[str, asyncio.Event] = {}
+
+    def job(self, name: str):
+        self.gates[name] = asyncio.Event()
+
+        async def run() -> dict:
+            self.started.append(name)
+            await self.gates[name].wait()
+            return {"frame": name}
+
+        return run
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_latest_frame_wins_and_counts_each_supersession_once():
+    before = superseded_total()
+
+    async def scenario():
+        scheduler, jobs = main.FrameScheduler(), Jobs()
+        running = asyncio.create_task(scheduler.submit(jobs.job("a")))
+        await settle()
+        waiting = []
+        for name in "bcd":
+            waiting.append(asyncio.create_task(scheduler.submit(jobs.job(name))))
+            await settle()
+        jobs.gates["a"].set()
+        jobs.gates["d"].set()
+        return await running, await asyncio.gather(*waiting), jobs.started
+
+    first, (b, c, d), started = asyncio.run(scenario())
+    assert started == ["a", "d"]
+    assert first == {"frame": "a"}
+    # Replaced before any result existed: answered with the frame that replaced them.
+    assert b == c == {"frame": "d", "superseded": True}
+    assert d == {"frame": "d"}
+    assert superseded_total() - before == 2
+
+
+def test_superseded_request_gets_the_last_result():
+    before = superseded_total()
+
+    async def scenario():
+        scheduler, jobs = main.FrameScheduler(), Jobs()
+        done = jobs.job("a")
+        jobs.gates["a"].set()
+        await scheduler.submit(done)
+        running = asyncio.create_task(scheduler.submit(jobs.job("b")))
+        await settle()
+        replaced = asyncio.create_task(scheduler.submit(jobs.job("c")))
+        await settle()
+        latest = asyncio.create_task(scheduler.submit(jobs.job("d")))
+        await settle()
+        answer = await replaced
+        jobs.gates["b"].set()
+        jobs.gates["d"].set()
+        await asyncio.gather(running, latest)
+        return answer, jobs.started
+
+    answer, started = asyncio.run(scenario())
+    assert answer == {"frame": "a", "superseded": True}
+    assert started == ["a", "b", "d"]
+    assert superseded_total() - before == 1
+
+
+def test_streams_do_not_wait_for_each_other():
+    async def scenario():
+        jobs = Jobs()
+        first = asyncio.create_task(main.FrameScheduler().submit(jobs.job("a")))
+        second = asyncio.create_task(main.FrameScheduler().submit(jobs.job("b")))
+        await settle()
+        both_running = list(jobs.started)
+        jobs.gates["a"].set()
+        jobs.gates["b"].set()
+        return both_running, await first, await second
+
+    both_running, first, second = asyncio.run(scenario())
+    assert sorted(both_running) == ["a", "b"]
+    assert first == {"frame": "a"} and second == {"frame": "b"}
+
+
+def test_failed_frame_reaches_its_waiters():
+    async def scenario():
+        scheduler = main.FrameScheduler()
+
+        async def fail() -> dict:
+            raise RuntimeError("decode failed")
+
+        try:
+            await scheduler.submit(fail)
+        except RuntimeError as exc:
+            return str(exc)
+
+    assert asyncio.run(scenario()) == "decode failed"
@@ -0,0 +1,62 @@
+import pytest
+from starlette.requests import Request
+
+import main
+
+
+def _request(host="10.0.0.1"):
+    return Request({"type": "http", "headers": [], "client": (host, 5000)})
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    store = main.SessionStore(max_sessions=2, ttl=60.0)
+    monkeypatch.setattr(main, "_sessions", store)
+    return store
+
+
+def test_session_id_selects_a_shared_session(sessions):
+    first = main._request_session(_request(), "cam-1")
+    assert main._request_session(_request("10.0.0.2"), " cam-1 ") is first
+    assert first.key == "cam-1"
+
+
+def test_requests_without_session_id_share_nothing(sessions):
+    first = main._request_session(_request(), "")
+    second = main._request_session(_request(), "")
+    assert first is not second
+    assert first.key == ""
+    assert len(sessions) == 0
+
+
+def test_address_sessions_are_opt_in(sessions, monkeypatch):
+    monkeypatch.setattr(main, "_SESSION_BY_ADDRESS", True)
+    assert main._request_session(_request(), "") is main._request_session(_request(), "")
+    assert main._request_session(_request(), "") is not main._request_session(_request("10.0.0.2"), "")
+
+
+def test_session_store_evicts_least_recently_used(sessions):
+    a = sessions.get("a")
+    sessions.get("b")
+    assert sessions.get("a") is a
+    sessions.get("c")
+    assert len(sessions) == 2
+    assert sessions.evicted == 1
+    assert sessions.get("a") is a
+    assert sessions.get("b") is not None and sessions.evicted == 2
+
+
+def test_session_store_expires_idle_sessions(sessions):
+    a = sessions.get("a")
+    a.last_seen -= 120
+    assert sessions.get("a") is not a
+    assert sessions.evicted == 1
+
+
+def test_history_ring_keeps_the_newest_entries():
+    session = main.StreamSession()
+    for label in ["happy", "sad"] * 10:
+        session.push_emotion(label)
+    session.push_emotion("unknown-label")
+    assert session.history_len == main._SESSION_HISTORY
+    assert session.recent_emotions(3) == ["happy", "sad", "neutral"]
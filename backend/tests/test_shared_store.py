@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+
+pytest.importorskip("redis")
+
+
+async def read_command(reader: asyncio.StreamReader) -> list[bytes]:
+    count = int((await reader.readline())[1:])
+    args = []
+    for _ in range(count):
+        length = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def serve(handler):
+    """A RESP server on a free local port; handler maps a command to its raw reply, or None to hang."""
+
+    async def connection(reader, writer):
+        try:
+            while True:
+                reply = handler(await read_command(reader))
+                if reply is None:
+                    await asyncio.sleep(3600)
+                writer.write(reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            writer.close()
+
+    server = await asyncio.start_server(connection, "127.0.0.1", 0)
+    return server, f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}/0"
+
+
+def memory_handler(data: dict):
+    def handle(args):
+        name = args[0].upper()
+        if name == b"SET":
+            data[args[1]] = args[2]
+            return b"+OK\r\n"
+        if name == b"MGET":
+            values = [data.get(key) for key in args[1:]]
+            return b"*%d\r\n" % len(values) + b"".join(
+                b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value) for value in values
+            )
+        return b"-ERR unknown command\r\n"
+
+    return handle
+
+
+def test_round_trip():
+    async def scenario():
+        data = {}
+        server, url = await serve(memory_handler(data))
+        store = main.RedisStore(url)
+        try:
+            await store.set("a", b"1", 10)
+            await store.set("b", b"2", 0)
+            return await store.get_many(["a", "missing", "b"])
+        finally:
+            await store.close()
+            server.close()
+
+    assert asyncio.run(scenario()) == [b"1", None, b"2"]
+
+
+def test_timeouts_are_separate(monkeypatch):
+    monkeypatch.setattr(main, "_SHARED_STORE_TIMEOUT", 0.05)
+    monkeypatch.setattr(main, "_SHARED_STORE_CONNECT_TIMEOUT", 2.0)
+    monkeypatch.setattr(main, "_SHARED_STORE_MAX_CONNECTIONS", 3)
+    pool = main.RedisStore("redis://127.0.0.1:6379/0")._pool
+    assert pool.timeout == 0.05
+    assert pool.max_connections == 3
+    assert pool.connection_kwargs["socket_timeout"] == 0.05
+    assert pool.connection_kwargs["socket_connect_timeout"] == 2.0
+
+
+def test_stalled_server_and_pool_wait_count_as_misses(monkeypatch):
+    monkeypatch.setattr(main, "_SHARED_STORE_TIMEOUT", 0.05)
+    monkeypatch.setattr(main, "_SHARED_STORE_MAX_CONNECTIONS", 1)
+
+    async def scenario():
+        server, url = await serve(lambda args: None if args[0].upper() == b"MGET" else b"-ERR unknown\r\n")
+        monkeypatch.setattr(main, "_shared_store", main.RedisStore(url))
+        started = time.perf_counter()
+        try:
+            values = await asyncio.gather(*(main._shared_get("session", ["k"]) for _ in range(3)))
+        finally:
+            await main._shared_store.close()
+            server.close()
+        return values, time.perf_counter() - started
+
+    values, elapsed = asyncio.run(scenario())
+    assert values == [[None]] * 3
+    # One stalled command at a time, or a pool wait, each bounded by the timeout.
+    assert elapsed < 1.0
+
+
+def test_redis_url_without_package(monkeypatch, caplog):
+    monkeypatch.setattr(main, "_REDIS_AVAILABLE", False)
+    assert main._open_shared_store("redis://127.0.0.1:6379/0") is None
+    assert "redis package is not installed" in caplog.text
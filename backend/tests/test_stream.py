@@ -0,0 +1,29 @@
+import logging
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_stream_reports_a_failed_frame_and_continues(monkeypatch, caplog):
+    calls = 0
+
+    async def process_frame(data, session, transport="http", trace=None, faces=None):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RuntimeError("detector crashed")
+        return {"face_count": 1, "bytes": len(data)}
+
+    monkeypatch.setattr(main, "_process_frame", process_frame)
+    client = TestClient(main.app)
+    with caplog.at_level(logging.ERROR, logger="live_vision"):
+        with client.websocket_connect("/vision/stream?session_id=cam") as ws:
+            ws.send_bytes(b"frame-1")
+            failed = ws.receive_json()
+            ws.send_bytes(b"frame-22")
+            ok = ws.receive_json()
+
+    assert failed == {"error": "Frame processing failed: RuntimeError", "frame_seq": 1, "dropped_frames": 0}
+    assert ok["frame_seq"] == 2 and ok["bytes"] == 8
+    assert "frame 1 failed" in caplog.text
@@ -0,0 +1,47 @@
+import pytest
+
+import main
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT = "00f067aa0ba902b7"
+
+
+@pytest.mark.parametrize("flags", ["00", "01"])
+def test_incoming_trace_is_passed_through(flags):
+    trace = main.RequestTrace(f"00-{TRACE_ID}-{PARENT}-{flags}")
+    assert trace.trace_id == TRACE_ID
+    assert trace.traceparent(trace.new_span_id()) == f"00-{TRACE_ID}-{PARENT}-{flags}"
+
+
+def test_local_trace_is_sent_unsampled():
+    trace = main.RequestTrace("")
+    span_id = trace.new_span_id()
+    assert trace.traceparent(span_id) == f"00-{trace.trace_id}-{span_id}-00"
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        f"00-{'0' * 32}-{PARENT}-01",
+        f"00-{TRACE_ID}-{'0' * 16}-01",
+        f"00-{TRACE_ID}-{PARENT}-1",
+        f"00-{TRACE_ID}-{PARENT}-zz",
+        "garbage",
+    ],
+)
+def test_invalid_traceparent_starts_a_new_trace(header):
+    trace = main.RequestTrace(header)
+    assert trace.parent_span_id is None
+    assert trace.trace_id != TRACE_ID
+    assert trace.traceparent("a" * 16).endswith("-00")
+
+
+def test_emotion_headers_carry_the_current_trace():
+    trace = main.RequestTrace(f"00-{TRACE_ID}-{PARENT}-00")
+    token = main._current_trace.set(trace)
+    try:
+        headers = main._emotion_headers("secret", "b" * 16)
+    finally:
+        main._current_trace.reset(token)
+    assert headers == {"Authorization": "Bearer secret", "traceparent": f"00-{TRACE_ID}-{PARENT}-00"}
+    assert main._emotion_headers("", "b" * 16) == {}
@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+
+import main
+
+
+def test_shutdown_closes_retiring_clients(emotion_config):
+    async def scenario():
+        client = httpx.AsyncClient()
+        main._retire_client(client, emotion_config)
+        assert main._retiring_clients
+        await main._close_emotion_client()
+        return client
+
+    client = asyncio.run(scenario())
+    assert client.is_closed
+    assert not main._retiring_clients
+
+
+def test_retired_client_closes_after_the_delay(emotion_config):
+    emotion_config.connect_timeout = 0.0
+    emotion_config.read_timeout = 0.01
+
+    async def scenario():
+        client = httpx.AsyncClient()
+        main._retire_client(client, emotion_config)
+        await asyncio.gather(*main._retiring_clients)
+        return client
+
+    assert asyncio.run(scenario()).is_closed
+
+
+def test_client_replaced_mid_request_finishes_it_then_closes(emotion_config, monkeypatch):
+    endpoint = "http://upstream/v1/chat/completions"
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return httpx.Response(200, json={"ok": True})
+
+        upstream = main.Upstream(endpoint)
+        old = upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        upstream.client_key = ("replaced settings",)
+        monkeypatch.setitem(main._upstreams, endpoint, upstream)
+        in_flight = asyncio.create_task(old.post(endpoint))
+        await asyncio.sleep(0)
+        upstream.configure(emotion_config, main.EmotionUpstream(endpoint=endpoint))
+        assert upstream.client is not old and old in main._retiring_clients.values()
+        await asyncio.sleep(0)
+        # The grace period lets the request that was in flight finish.
+        assert not old.is_closed
+        release.set()
+        resp = await in_flight
+        await main._close_emotion_client()
+        return resp, old, upstream.client
+
+    resp, old, new = asyncio.run(scenario())
+    assert resp.json() == {"ok": True}
+    assert old.is_closed and new.is_closed
+    assert not main._retiring_clients
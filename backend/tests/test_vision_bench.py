@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bench"))
+
+import vision_bench  # noqa: E402
+
+
+def _result(path, fps=10.0):
+    workload = {
+        "workload": "synthetic:4",
+        "throughput_fps": fps,
+        "latency_ms": {"p95": 100.0},
+        "cpu_ms_per_frame": 10.0,
+        "upstream_calls_per_frame": 4.0,
+        "crop_bytes_per_frame": 1000.0,
+    }
+    return {"meta": {"path": path}, "workloads": [workload]}
+
+
+def test_default_run_takes_the_cold_path():
+    args = vision_bench._parse_args([])
+    assert not args.warm
+    assert vision_bench.COLD_CONFIG == {"frame_gate": False, "tracking": False, "cache_enabled": False}
+
+
+def test_compare_rejects_a_baseline_of_the_other_path():
+    problems = vision_bench.compare(_result("cold"), _result("warm"), 0.1)
+    assert problems == ["baseline measured the warm path, this run the cold path"]
+    # Baselines from before --warm measured the warm path.
+    assert vision_bench.compare(_result("warm"), {"workloads": _result("warm")["workloads"]}, 0.1) == []
+
+
+def test_compare_flags_throughput_regressions():
+    problems = vision_bench.compare(_result("cold", fps=5.0), _result("cold"), 0.1)
+    assert len(problems) == 1 and "synthetic:4" in problems[0]
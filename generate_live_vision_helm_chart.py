@@ -113,6 +113,13 @@ emotion:
   createTokenSecret: false
   tokenValue: ""
 
+backend:
+  # uvicorn worker processes per pod (WEB_CONCURRENCY); match the CPU limit.
+  workers: 1
+  # Session/result store shared by the workers, e.g. "sqlite:///dev/shm/live-vision.db";
+  # empty keeps per-process state.
+  sharedStore: ""
+
 ingress:
   enabled: false
   className: ""
@@ -264,6 +271,10 @@ spec:
               value: {{ .Values.emotion.model | quote }}
             - name: EMOTION_CONFIG_PATH
               value: "/data/emotion-config.json"
+            - name: WEB_CONCURRENCY
+              value: {{ .Values.backend.workers | quote }}
+            - name: VISION_SHARED_STORE
+              value: {{ .Values.backend.sharedStore | quote }}
             - name: EMOTION_TOKEN
               valueFrom:
                 secretKeyRef:
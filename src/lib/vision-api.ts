@@ -5,6 +5,16 @@ interface VisionResponse {
 
 const DEFAULT_BACKEND = "";
 
+// Identifies this tab's camera stream so the backend keeps per-stream state.
+const SESSION_ID =
+  typeof crypto !== "undefined" && "randomUUID" in crypto
+    ? crypto.randomUUID()
+    : Math.random().toString(36).slice(2);
+
+export function getSessionId(): string {
+  return SESSION_ID;
+}
+
 export function getBackendUrl(): string {
   return localStorage.getItem("vision-backend-url") || DEFAULT_BACKEND;
 }
@@ -13,12 +23,19 @@ export function setBackendUrl(url: string) {
   localStorage.setItem("vision-backend-url", url);
 }
 
+// Set localStorage "vision-debug-timing" to "1" to get per-stage timings in debug.timing.
+function debugTimingEnabled(): boolean {
+  return localStorage.getItem("vision-debug-timing") === "1";
+}
+
 export async function sendFrameToBackend(blob: Blob): Promise<VisionResponse> {
   const backendUrl = getBackendUrl();
   const formData = new FormData();
   formData.append("frame", blob);
+  formData.append("session_id", SESSION_ID);
 
-  const endpoint = backendUrl ? `${backendUrl}/vision` : "/vision";
+  const base = backendUrl ? `${backendUrl}/vision` : "/vision";
+  const endpoint = debugTimingEnabled() ? `${base}?timing=1` : base;
   const res = await fetch(endpoint, { method: "POST", body: formData });
 
   if (!res.ok) throw new Error(`Backend error: ${res.status}`);